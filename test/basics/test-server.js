@@ -27,6 +27,121 @@ function do_test(path) {
 [
     'hello.html',
     'status?200',
-    'echo'
+    'echo',
+    'chunked',
+    'delay?50'
 ]
     .forEach(do_test);
+
+async_test(function () {
+    var page = webpage.create();
+    page.open(TEST_HTTP_BASE + 'chunked?n=5&delay=50',
+              this.step_func_done(function (status) {
+                  assert_equals(status, 'success');
+                  assert_equals(page.plainText, '0,1,2,3,4');
+              }));
+}, "chunked response, delivered progressively");
+
+async_test(function () {
+    var page = webpage.create();
+    var start = Date.now();
+    page.open(TEST_HTTP_BASE + 'hello.html?__latency=250',
+              this.step_func_done(function (status) {
+                  assert_equals(status, 'success');
+                  assert_greater_than_equal(Date.now() - start, 250);
+                  assert_equals(page.plainText, 'Hello, world!');
+              }));
+}, "traffic shaping: first-byte latency");
+
+async_test(function () {
+    var page = webpage.create();
+    page.open(TEST_HTTP_BASE + 'hello.html', this.step_func(function () {
+        // Synchronous requests, one after another, all go over the
+        // persistent connection that loaded the page.
+        var times = page.evaluate(function () {
+            var times = [];
+            for (var i = 0; i < 10; i++) {
+                var start = Date.now();
+                var xhr = new XMLHttpRequest();
+                xhr.open('GET', 'status?200', false);
+                xhr.send();
+                times.push(Date.now() - start);
+            }
+            return times;
+        });
+        times.sort(function (a, b) { return a - b; });
+        // Nagle's algorithm and delayed ACKs would make this about 40 ms.
+        assert_less_than(times[5], 20);
+        this.done();
+    }));
+}, "requests on a persistent connection are not delayed");
+
+async_test(function () {
+    var page = webpage.create();
+    var stats_url = TEST_HTTP_BASE + '__stats?reset=1';
+    page.open(stats_url, this.step_func(function (status) {
+        assert_equals(status, 'success');
+        page.open(TEST_HTTP_BASE + 'nonexistent.html', this.step_func(
+            function () {
+                page.open(stats_url, this.step_func_done(function (status) {
+                    assert_equals(status, 'success');
+                    var stats = JSON.parse(page.plainText);
+                    assert_equals(stats.requests, 1);
+                    assert_equals(stats.status['404'], 1);
+                    assert_greater_than(stats.bytes_out, 0);
+                }));
+            }));
+    }));
+}, "per-test request statistics");
+
+async_test(function () {
+    var page = webpage.create();
+    page.onCallback = this.step_func_done(function (result) {
+        assert_equals(result.echoed, 'hello');
+        assert_equals(result.code, 4001);
+        assert_equals(result.reason, 'bye');
+    });
+    page.open(TEST_HTTP_BASE + 'hello.html', this.step_func(function () {
+        page.evaluate(function (base) {
+            var echoed;
+            var ws = new WebSocket(base + 'ws-echo');
+            ws.onopen = function () { ws.send('hello'); };
+            ws.onmessage = function (event) {
+                echoed = event.data;
+                ws.close();
+            };
+            ws.onclose = function () {
+                ws = new WebSocket(base + 'ws-close?server&code=4001&reason=bye');
+                ws.onclose = function (event) {
+                    window.callPhantom({ echoed: echoed,
+                                         code: event.code,
+                                         reason: event.reason });
+                };
+            };
+        }, TEST_HTTP_BASE.replace(/^http:/, 'ws:'));
+    }));
+}, "WebSocket echo and server-initiated close");
+
+async_test(function () {
+    var page = webpage.create();
+    page.open(TEST_HTTP_BASE + 'upload-sink', 'post', 'hello',
+              this.step_func_done(function (status) {
+                  assert_equals(status, 'success');
+                  var result = JSON.parse(page.plainText);
+                  assert_equals(result.size, 5);
+                  assert_equals(result.sha256,
+                                '2cf24dba5fb0a30e26e83b2ac5b9e29e' +
+                                '1b161e5c1fa7425e73043362938b9824');
+              }));
+}, "streamed request body");
+
+Object.keys(TEST_TLS_BASES).forEach(function (name) {
+    async_test(function () {
+        var page = webpage.create();
+        page.onResourceError = this.unreached_func();
+        page.open(TEST_TLS_BASES[name] + 'hello.html',
+                  this.step_func_done(function (status) {
+                      assert_equals(status, 'success');
+                  }));
+    }, "HTTPS server with TLS profile " + name);
+});
@@ -0,0 +1,148 @@
+//! timeout: 600
+
+// Measure the cost of running subprocesses with the child_process
+// module, using the fixtures from module/child_process/basics.js, at
+// increasing numbers of concurrent children:
+//
+//   spawn     spawn() lib/fixtures/echo.py; record how many children
+//             complete per second, and the time from spawn() to the
+//             first byte of output and to the exit event
+//   execFile  the same with execFile(), which collects the output
+//   pipe      pipe data through lib/fixtures/cat.py: write it all to
+//             the children's stdin, close it, and read it back; record
+//             the total throughput
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   CP_CONCURRENCY  comma-separated numbers of concurrent children
+//                   (default 1,4,16,64)
+//   CP_SPAWNS       children to run at each level (default 100)
+//   CP_BYTES        bytes to pipe through cat.py at each level, split
+//                   between the children (default 16 MiB)
+//   CP_CHUNK        size of each write to a child's stdin (default 64 KiB)
+
+var fs      = require('fs');
+var cp      = require('child_process');
+var bench   = require('bench-utils');
+
+var MiB         = 1024 * 1024;
+var CONCURRENCY = bench.number_list(bench_param('CP_CONCURRENCY',
+                                                '1,4,16,64'));
+var SPAWNS      = bench_param('CP_SPAWNS', 100);
+var BYTES       = bench_param('CP_BYTES', 16 * MiB);
+var CHUNK       = bench_param('CP_CHUNK', 64 * 1024);
+
+var ECHO_SCRIPT = fs.join(TEST_DIR, 'lib', 'fixtures', 'echo.py');
+var CAT_SCRIPT  = fs.join(TEST_DIR, 'lib', 'fixtures', 'cat.py');
+
+setup({ timeout: 600 * 1000 });
+
+// Run |total| jobs, no more than |concurrency| at a time.
+// |start_job(i, done)| starts job |i|, and must call |done| when it
+// finishes.  Calls |callback| with the elapsed time, in milliseconds,
+// when all jobs have finished.
+function run_pool(total, concurrency, start_job, callback) {
+    var started = 0, finished = 0, start = Date.now();
+    function done() {
+        finished++;
+        if (finished === total) {
+            callback(Date.now() - start);
+        } else if (started < total) {
+            start_job(started++, done);
+        }
+    }
+    while (started < Math.min(concurrency, total)) {
+        start_job(started++, done);
+    }
+}
+
+CONCURRENCY.forEach(function (concurrency) {
+    async_test(function () {
+        var test = this, first = [], exits = [];
+        run_pool(SPAWNS, concurrency, function (i, done) {
+            var start = Date.now(), out = '';
+            var child = cp.spawn(PYTHON, [ECHO_SCRIPT, 'hello']);
+            child.stdout.on('data', function (data) {
+                if (out === '') {
+                    first.push(Date.now() - start);
+                }
+                out += data;
+            });
+            child.on('exit', test.step_func(function (code) {
+                exits.push(Date.now() - start);
+                assert_equals(code, 0);
+                assert_equals(out, 'hello');
+                done();
+            }));
+        }, test.step_func_done(function (elapsed) {
+            var prefix = 'spawn_' + concurrency;
+            record_metric(prefix + '.rate', SPAWNS / elapsed * 1000,
+                          'children/s');
+            record_metric(prefix + '.first_byte_p50',
+                          bench.percentile(first, 50), 'ms');
+            record_metric(prefix + '.first_byte_p90',
+                          bench.percentile(first, 90), 'ms');
+            record_metric(prefix + '.exit_p50',
+                          bench.percentile(exits, 50), 'ms');
+            record_metric(prefix + '.exit_p90',
+                          bench.percentile(exits, 90), 'ms');
+        }));
+    }, 'spawn with ' + concurrency + ' concurrent children');
+
+    async_test(function () {
+        var test = this, times = [];
+        run_pool(SPAWNS, concurrency, function (i, done) {
+            var start = Date.now();
+            cp.execFile(PYTHON, [ECHO_SCRIPT, 'hello'], null,
+                        test.step_func(function (err, stdout, stderr) {
+                times.push(Date.now() - start);
+                assert_equals(err, null);
+                assert_equals(stdout, 'hello');
+                done();
+            }));
+        }, test.step_func_done(function (elapsed) {
+            var prefix = 'execFile_' + concurrency;
+            record_metric(prefix + '.rate', SPAWNS / elapsed * 1000,
+                          'children/s');
+            record_metric(prefix + '.latency_p50',
+                          bench.percentile(times, 50), 'ms');
+            record_metric(prefix + '.latency_p90',
+                          bench.percentile(times, 90), 'ms');
+        }));
+    }, 'execFile with ' + concurrency + ' concurrent children');
+
+    async_test(function () {
+        var test = this;
+        var per_child = Math.ceil(BYTES / concurrency);
+        var chunk = new Array(Math.min(CHUNK, per_child) + 1).join('x');
+        var first = [];
+        run_pool(concurrency, concurrency, function (i, done) {
+            var start = Date.now(), received = 0, written = 0;
+            var child = cp.spawn(PYTHON, [CAT_SCRIPT]);
+            child.stdout.on('data', function (data) {
+                if (received === 0) {
+                    first.push(Date.now() - start);
+                }
+                received += data.length;
+            });
+            child.on('exit', test.step_func(function (code) {
+                assert_equals(code, 0);
+                assert_equals(received, written);
+                done();
+            }));
+            while (written < per_child) {
+                var piece = per_child - written >= chunk.length ?
+                    chunk : chunk.slice(0, per_child - written);
+                assert_equals(child.stdin.write(piece), piece.length);
+                written += piece.length;
+            }
+            child.stdin.close();
+        }, test.step_func_done(function (elapsed) {
+            var prefix = 'pipe_' + concurrency;
+            record_metric(prefix + '.throughput',
+                          per_child * concurrency / MiB /
+                          (Math.max(elapsed, 1) / 1000), 'MiB/s');
+            record_metric(prefix + '.first_byte_p50',
+                          bench.percentile(first, 50), 'ms');
+        }));
+    }, 'pipe ' + BYTES + ' bytes through ' + concurrency + ' children');
+});
@@ -0,0 +1,209 @@
+//! timeout: 900
+
+// Measure how PhantomJS's cookie jar copes as it grows.  For each jar
+// size, the jar is filled by loading lib/www/cookie-flood.py from
+// several host names (through TEST_PROXY_BASE, which resolves
+// *.localhost to this machine) with the cookies spread over several
+// paths; then the following are measured:
+//
+//   fill          time to fill the jar, per cookie
+//   rss_growth    growth in resident memory, per 1000 cookies (this
+//                 is approximate, since memory freed when the previous,
+//                 smaller jar was cleared may be reused)
+//   request       latency of XMLHttpRequests from a page whose URL
+//                 matches some of the cookies
+//   phantom_cookies, page_cookies
+//                 time to read phantom.cookies and page.cookies
+//   save          extra time taken to add one cookie to a persistent
+//                 jar (cookiejar.create(FILE)), compared to the default
+//                 jar; each change to a persistent jar re-serializes
+//                 the whole jar
+//   load          time to create a persistent jar from the file saved
+//                 by the previous step
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   JAR_SIZES     comma-separated jar sizes (default 100,1000,10000)
+//   JAR_DOMAINS   number of host names to spread the cookies over
+//                 (default 10)
+//   JAR_PATHS     number of paths to spread each host's cookies over
+//                 (default 10)
+//   JAR_REQUESTS  number of requests for the latency test (default 50)
+//   JAR_REPEAT    number of times to repeat each access (default 10)
+
+var webpage   = require('webpage');
+var cookiejar = require('cookiejar');
+var fs        = require('fs');
+var bench     = require('bench-utils');
+
+var SIZES    = bench.number_list(bench_param('JAR_SIZES', '100,1000,10000'));
+var DOMAINS  = bench_param('JAR_DOMAINS', 10);
+var PATHS    = bench_param('JAR_PATHS', 10);
+var REQUESTS = bench_param('JAR_REQUESTS', 50);
+var REPEAT   = bench_param('JAR_REPEAT', 10);
+
+var JAR_FILE = 'temp-cookie-jar.test';
+
+var PROXY = TEST_PROXY_BASE.match(/^http:\/\/([^:\/]+):(\d+)\//);
+
+setup({ timeout: 900 * 1000 });
+
+// The URL of cookie-flood.py on host name number |d|.
+function flood_url(d, count) {
+    var host = d === 0 ? 'localhost' : 'd' + d + '.localhost';
+    return TEST_HTTP_BASE.replace(/\/\/[^:\/]+:/, '//' + host + ':') +
+        'cookie-flood?count=' + count + '&paths=' + PATHS;
+}
+
+// Load cookie-flood.py from each host name in turn, into |jar| (or the
+// default jar), setting |size| cookies in all.
+function fill_jar(test, jar, size, callback) {
+    var d = 0;
+    phantom.setProxy(PROXY[1], Number(PROXY[2]), 'http');
+    function next() {
+        if (d === DOMAINS) {
+            phantom.setProxy('');
+            callback();
+            return;
+        }
+        var count = Math.floor(size / DOMAINS) +
+            (d < size % DOMAINS ? 1 : 0);
+        var page = webpage.create();
+        if (jar) {
+            page.cookieJar = jar;
+        }
+        page.open(flood_url(d, count), test.step_func(function (status) {
+            assert_equals(status, 'success');
+            page.close();
+            d++;
+            next();
+        }));
+    }
+    next();
+}
+
+function median_time(fn) {
+    var times = [];
+    for (var i = 0; i < REPEAT; i++) {
+        var start = Date.now();
+        fn(i);
+        times.push(Date.now() - start);
+    }
+    return bench.median(times);
+}
+
+// Runs in the page: times |arg.count| sequential requests.
+function requests_in_page(arg) {
+    var times = [];
+    function one() {
+        var xhr = new XMLHttpRequest();
+        var start = Date.now();
+        xhr.open('GET', arg.url + '?n=' + times.length);
+        xhr.onloadend = function () {
+            times.push(Date.now() - start);
+            if (times.length < arg.count) {
+                one();
+            } else {
+                window.callPhantom(times);
+            }
+        };
+        xhr.send();
+    }
+    one();
+}
+
+function extra_cookie(i) {
+    return { name: 'extra-' + i, value: 'x', domain: 'localhost',
+             path: '/', expires: Date.now() + 86400 * 1000 };
+}
+
+function measure_persistence(test, size, prefix, callback) {
+    if (fs.exists(JAR_FILE)) {
+        fs.remove(JAR_FILE);
+    }
+    var jar = cookiejar.create(JAR_FILE);
+    var start = Date.now();
+    fill_jar(test, jar, size, test.step_func(function () {
+        record_metric(prefix + '.fill_persistent',
+                      (Date.now() - start) / size * 1000, 'us');
+        var persistent = median_time(function (i) {
+            jar.addCookie(extra_cookie(i));
+        });
+        var in_memory = median_time(function (i) {
+            phantom.addCookie(extra_cookie(i));
+        });
+        record_metric(prefix + '.save', persistent - in_memory, 'ms');
+        jar.close();
+
+        // The jar is only written out once the event loop has had a
+        // chance to destroy it.
+        setTimeout(test.step_func(function () {
+            record_metric(prefix + '.file_size', fs.size(JAR_FILE),
+                          'bytes');
+            var loaded = null;
+            var load = median_time(function () {
+                if (loaded) {
+                    loaded.close();
+                }
+                loaded = cookiejar.create(JAR_FILE);
+            });
+            assert_greater_than_equal(loaded.cookies.length, size);
+            loaded.close();
+            record_metric(prefix + '.load', load, 'ms');
+            setTimeout(test.step_func(function () {
+                fs.remove(JAR_FILE);
+                callback();
+            }), 100);
+        }), 100);
+    }));
+}
+
+SIZES.forEach(function (size) {
+    async_test(function () {
+        var test = this, prefix = 'jar_' + size;
+        phantom.clearCookies();
+        var mem_before = process_memory();
+        var start = Date.now();
+
+        fill_jar(test, null, size, test.step_func(function () {
+            record_metric(prefix + '.fill',
+                          (Date.now() - start) / size * 1000, 'us');
+            var mem_after = process_memory();
+            if (mem_before && mem_after) {
+                record_metric(prefix + '.rss_growth',
+                              (mem_after.rss - mem_before.rss) /
+                              size * 1000, 'kB');
+            }
+            assert_equals(phantom.cookies.length, size);
+
+            var page = webpage.create();
+            page.open(TEST_HTTP_BASE + 'hello.html',
+                      test.step_func(function (status) {
+                assert_equals(status, 'success');
+                record_metric(prefix + '.phantom_cookies',
+                              median_time(function () {
+                                  return phantom.cookies.length;
+                              }), 'ms');
+                record_metric(prefix + '.page_cookies',
+                              median_time(function () {
+                                  return page.cookies.length;
+                              }), 'ms');
+
+                page.onCallback = test.step_func(function (times) {
+                    page.onCallback = null;
+                    page.close();
+                    record_metric(prefix + '.request_p50',
+                                  bench.percentile(times, 50), 'ms');
+                    record_metric(prefix + '.request_p90',
+                                  bench.percentile(times, 90), 'ms');
+                    measure_persistence(test, size, prefix,
+                                        test.step_func_done(function () {
+                        phantom.clearCookies();
+                    }));
+                });
+                page.evaluate(requests_in_page,
+                              { url: TEST_HTTP_BASE + 'hello.html',
+                                count: REQUESTS });
+            }));
+        }));
+    }, 'cookie jar with ' + size + ' cookies');
+});
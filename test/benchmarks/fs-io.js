@@ -0,0 +1,191 @@
+//! timeout: 1800
+
+// Measure the throughput of the fs module, on files generated in a
+// scratch directory.  For each file size, the file is written and read
+// back in several ways:
+//
+//   write_stream  fs.open(path, 'w') and write() in chunks
+//   read_lines    fs.open(path, 'r') and readLine() until atEnd()
+//   read_binary   fs.open(path, 'rb') and read(CHUNK) until atEnd()
+//   read_whole    fs.read(path)
+//   write_whole   fs.write(path, content)
+//
+// and for each, the throughput and the growth in *peak* resident
+// memory are recorded.  The streaming methods are measured first, so
+// that an operation which holds the whole file in memory shows up as
+// a jump in the peak, however large the file.  Files smaller than
+// FS_MIN_BYTES are processed repeatedly, to get a measurable time.
+//
+// Then, for each number of directory entries, that many files are
+// created in a fresh directory, which is listed with fs.list, copied
+// with fs.copyTree, and removed with fs.removeTree, and each step is
+// timed.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   FS_SIZES        comma-separated file sizes, bytes
+//                   (default 1 KiB, 1 MiB, 64 MiB; use up to GiBs)
+//   FS_WHOLE_LIMIT  largest file to read or write whole (default 256 MiB),
+//                   since that needs twice the file size in memory
+//   FS_MIN_BYTES    minimum bytes to process per measurement (default 16 MiB)
+//   FS_CHUNK        size of each streamed read and write (default 64 KiB)
+//   FS_ENTRIES      comma-separated directory sizes (default 1000,10000)
+//   FS_ENTRY_SIZE   size of each file in those directories (default 1024)
+//   FS_SCRATCH      where to make the scratch directory, which is
+//                   removed afterward (default $TMPDIR or /tmp)
+
+var fs     = require('fs');
+var system = require('system');
+var bench  = require('bench-utils');
+
+var KiB = 1024, MiB = 1024 * 1024;
+
+var SIZES       = bench.number_list(bench_param('FS_SIZES',
+                                                KiB + ',' + MiB + ',' +
+                                                64 * MiB));
+var WHOLE_LIMIT = bench_param('FS_WHOLE_LIMIT', 256 * MiB);
+var MIN_BYTES   = bench_param('FS_MIN_BYTES', 16 * MiB);
+var CHUNK       = bench_param('FS_CHUNK', 64 * KiB);
+var ENTRIES     = bench.number_list(bench_param('FS_ENTRIES', '1000,10000'));
+var ENTRY_SIZE  = bench_param('FS_ENTRY_SIZE', 1024);
+var SCRATCH     = fs.join(bench_param('FS_SCRATCH',
+                                      system.env.TMPDIR || '/tmp'),
+                          'phantomjs-fs-io-' + system.pid);
+
+// Files are made of 64-byte lines.
+var LINE = new Array(64).join('x') + '\n';
+
+// A string of |size| bytes of lines.
+function content(size) {
+    var s = LINE;
+    while (s.length < size) {
+        s += s;
+    }
+    return s.slice(0, size);
+}
+
+// Run |fn| enough times to process at least MIN_BYTES of a file of
+// |size| bytes, and record its throughput and the growth in peak RSS
+// as NAME.throughput and NAME.peak_growth.
+function measure(name, size, fn) {
+    var repeat = Math.max(1, Math.ceil(MIN_BYTES / size));
+    var before = process_memory();
+    var start = Date.now();
+    for (var i = 0; i < repeat; i++) {
+        fn();
+    }
+    var elapsed = Math.max(Date.now() - start, 1);
+    var after = process_memory();
+    record_metric(name + '.throughput',
+                  size * repeat / MiB / (elapsed / 1000), 'MiB/s');
+    if (before && after) {
+        record_metric(name + '.peak_growth', after.peak - before.peak, 'kB');
+    }
+}
+
+setup(function () {
+    assert_is_true(fs.makeTree(SCRATCH), 'cannot create ' + SCRATCH);
+}, { timeout: 1800 * 1000 });
+
+SIZES.forEach(function (size) {
+    test(function () {
+        var path = fs.join(SCRATCH, 'file-' + size);
+        var prefix = 'file_' + size;
+        var chunk = content(Math.min(CHUNK, size));
+        this.add_cleanup(function () { fs.remove(path); });
+
+        measure(prefix + '.write_stream', size, function () {
+            var f = fs.open(path, 'w'), written = 0;
+            while (written < size) {
+                var piece = size - written >= chunk.length ?
+                    chunk : chunk.slice(0, size - written);
+                f.write(piece);
+                written += piece.length;
+            }
+            f.close();
+        });
+        // fs.size cannot report sizes of 2 GiB or more.
+        if (size < 2048 * MiB) {
+            assert_equals(fs.size(path), size);
+        }
+
+        measure(prefix + '.read_lines', size, function () {
+            var f = fs.open(path, 'r'), lines = 0;
+            while (!f.atEnd()) {
+                f.readLine();
+                lines++;
+            }
+            f.close();
+            assert_equals(lines, Math.ceil(size / LINE.length));
+        });
+
+        measure(prefix + '.read_binary', size, function () {
+            var f = fs.open(path, 'rb'), total = 0;
+            while (!f.atEnd()) {
+                total += f.read(CHUNK).length;
+            }
+            f.close();
+            assert_equals(total, size);
+        });
+
+        if (size > WHOLE_LIMIT) {
+            return;
+        }
+        measure(prefix + '.read_whole', size, function () {
+            assert_equals(fs.read(path).length, size);
+        });
+        var whole = content(size);
+        measure(prefix + '.write_whole', size, function () {
+            fs.write(path, whole, 'w');
+        });
+    }, 'read and write a ' + size + '-byte file');
+});
+
+ENTRIES.forEach(function (count) {
+    test(function () {
+        var dir = fs.join(SCRATCH, 'dir-' + count);
+        var copy = dir + '-copy';
+        var prefix = 'dir_' + count;
+        var data = content(ENTRY_SIZE);
+        this.add_cleanup(function () {
+            [dir, copy].forEach(function (path) {
+                if (fs.exists(path)) {
+                    fs.removeTree(path);
+                }
+            });
+        });
+
+        assert_is_true(fs.makeDirectory(dir));
+        var start = Date.now();
+        for (var i = 0; i < count; i++) {
+            fs.write(fs.join(dir, 'entry-' + i), data, 'w');
+        }
+        var elapsed = Math.max(Date.now() - start, 1);
+        record_metric(prefix + '.create', count / elapsed * 1000, 'files/s');
+
+        start = Date.now();
+        var entries = fs.list(dir);
+        record_metric(prefix + '.list', Date.now() - start, 'ms');
+        // fs.list includes "." and "..".
+        assert_equals(entries.length, count + 2);
+
+        start = Date.now();
+        fs.copyTree(dir, copy);
+        elapsed = Math.max(Date.now() - start, 1);
+        record_metric(prefix + '.copyTree', count / elapsed * 1000,
+                      'files/s');
+        record_metric(prefix + '.copyTree_throughput',
+                      count * ENTRY_SIZE / MiB / (elapsed / 1000), 'MiB/s');
+        assert_equals(fs.list(copy).length, count + 2);
+
+        start = Date.now();
+        fs.removeTree(copy);
+        elapsed = Math.max(Date.now() - start, 1);
+        record_metric(prefix + '.removeTree', count / elapsed * 1000,
+                      'files/s');
+    }, 'list, copy, and remove a directory of ' + count + ' files');
+});
+
+test(function () {
+    fs.removeTree(SCRATCH);
+    assert_is_false(fs.exists(SCRATCH));
+}, 'remove the scratch directory');
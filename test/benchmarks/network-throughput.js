@@ -0,0 +1,96 @@
+//! timeout: 900
+
+// Measure how fast PhantomJS's network stack can receive data, and how
+// much memory it uses per byte received, by downloading synthetic
+// payloads from the test server (see lib/www/bytes.py, drip.py, and
+// stream-json.py).  The downloads are made with XMLHttpRequest from
+// within a page, so that the data does not have to be rendered.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   NET_BYTES       size of the bulk download (default 64 MiB)
+//   NET_RECORDS     number of records in the JSON download (default 100000)
+//   NET_DRIP_RATE   pacing of the drip download, bytes/s (default 1 MiB/s)
+//   NET_DRIP_TOTAL  size of the drip download (default 4 MiB)
+//   NET_REPEAT      number of times to repeat each download (default 3)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var MiB        = 1024 * 1024;
+var BYTES      = bench_param('NET_BYTES', 64 * MiB);
+var RECORDS    = bench_param('NET_RECORDS', 100000);
+var DRIP_RATE  = bench_param('NET_DRIP_RATE', MiB);
+var DRIP_TOTAL = bench_param('NET_DRIP_TOTAL', 4 * MiB);
+var REPEAT     = bench_param('NET_REPEAT', 3);
+
+setup({ timeout: 900 * 1000 });
+
+function download_test(name, path, type, parse, check, report) {
+    async_test(function () {
+        var test = this, page = webpage.create(), results = [];
+        var mem_before = null;
+
+        function next() {
+            if (results.length === REPEAT) {
+                var mem_after = process_memory();
+                page.close();
+                report(results);
+                if (mem_before && mem_after) {
+                    record_metric(name + '.rss_growth_per_MiB',
+                                  (mem_after.rss - mem_before.rss) /
+                                  (REPEAT * results[0].bytes / MiB), 'kB');
+                    record_metric(name + '.peak_rss', mem_after.peak, 'kB');
+                }
+                test.done();
+                return;
+            }
+            bench.download(page, TEST_HTTP_BASE + path, type, parse,
+                test.step_func(function (result) {
+                    assert_equals(result.status, 200);
+                    check(result);
+                    results.push(result);
+                    next();
+                }));
+        }
+
+        page.open(TEST_HTTP_BASE + 'hello.html',
+                  this.step_func(function (status) {
+                      assert_equals(status, 'success');
+                      mem_before = process_memory();
+                      next();
+                  }));
+    }, name);
+}
+
+download_test('bytes', 'bytes?n=' + BYTES, 'arraybuffer', false,
+    function (r) { assert_equals(r.bytes, BYTES); },
+    function (results) {
+        var elapsed = results.map(function (r) { return r.elapsed; });
+        record_metric('bytes.throughput',
+                      BYTES / MiB / (bench.median(elapsed) / 1000), 'MiB/s');
+        record_metric('bytes.first_byte',
+                      bench.median(results.map(function (r) { return r.first; })),
+                      'ms');
+    });
+
+download_test('drip',
+              'drip?rate=' + DRIP_RATE + '&total=' + DRIP_TOTAL,
+              'arraybuffer', false,
+    function (r) { assert_equals(r.bytes, DRIP_TOTAL); },
+    function (results) {
+        var elapsed = results.map(function (r) { return r.elapsed; });
+        var achieved = DRIP_TOTAL / (bench.median(elapsed) / 1000);
+        record_metric('drip.achieved_rate', achieved / MiB, 'MiB/s');
+        record_metric('drip.rate_error', achieved / DRIP_RATE - 1);
+    });
+
+download_test('stream-json', 'stream-json?records=' + RECORDS, 'text', true,
+    function (r) { assert_equals(r.records, RECORDS); },
+    function (results) {
+        var elapsed = results.map(function (r) { return r.elapsed; });
+        record_metric('stream-json.throughput',
+                      RECORDS / (bench.median(elapsed) / 1000), 'records/s');
+        record_metric('stream-json.parse',
+                      bench.median(results.map(function (r) { return r.parse; })),
+                      'ms');
+    });
@@ -0,0 +1,133 @@
+//! timeout: 600
+
+// Measure how the cost of loading, scripting, and rendering a page
+// grows with its size, using the generated pages in lib/www/gen.  For
+// each kind of page and each size, the page is loaded, a script that
+// forces a full layout is evaluated in it, and it is rendered, and
+// each step is timed.  Besides the times themselves, the largest
+// "scaling exponent" between successive sizes is recorded for each
+// step: 1 means the cost grows linearly with the size of the page, and
+// anything much larger than that is worth investigating.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   SCALE_DOM      comma-separated element counts (default 1000,10000,100000)
+//   SCALE_TABLE    comma-separated table row counts (default 100,1000,10000)
+//   SCALE_SCRIPTS  comma-separated script counts (default 10,100,1000)
+//   SCALE_IMAGES   comma-separated image counts (default 10,100,1000)
+//   SCALE_REPEAT   number of times to repeat each measurement (default 3)
+//   SCALE_SEED     seed for the page generators (default 0)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var REPEAT = bench_param('SCALE_REPEAT', 3);
+var SEED   = bench_param('SCALE_SEED', 0);
+
+var KINDS = [
+    { name: 'dom', param: 'SCALE_DOM', sizes: '1000,10000,100000',
+      url: function (n) { return 'gen/dom?depth=12&nodes=' + n; },
+      check: function (n, r) { assert_greater_than_equal(r.elements, n); } },
+    { name: 'table', param: 'SCALE_TABLE', sizes: '100,1000,10000',
+      url: function (n) { return 'gen/table?cols=10&rows=' + n; },
+      check: function (n, r) { assert_equals(r.rows, n + 1); } },
+    { name: 'scripts', param: 'SCALE_SCRIPTS', sizes: '10,100,1000',
+      url: function (n) { return 'gen/scripts?external=1&count=' + n; },
+      check: function (n, r) { assert_equals(r.scripts_run, n); } },
+    { name: 'images', param: 'SCALE_IMAGES', sizes: '10,100,1000',
+      url: function (n) { return 'gen/images?count=' + n; },
+      check: function (n, r) { assert_equals(r.images_complete, n); } }
+];
+
+setup({ timeout: 600 * 1000 });
+
+// Runs in the page: forces a full style and layout pass, and counts
+// things for the sanity checks.
+function inspect_page() {
+    var images = document.images, complete = 0;
+    for (var i = 0; i < images.length; i++) {
+        if (images[i].complete && images[i].naturalWidth > 0) {
+            complete++;
+        }
+    }
+    return {
+        height: document.body.scrollHeight,
+        elements: document.body.getElementsByTagName('*').length,
+        rows: document.getElementsByTagName('tr').length,
+        scripts_run: window.genScriptsRun || 0,
+        images_complete: complete
+    };
+}
+
+function measure_once(test, url, check, callback) {
+    var page = webpage.create();
+    page.viewportSize = { width: 1024, height: 768 };
+    page.clipRect = { top: 0, left: 0, width: 1024, height: 768 };
+    var start = Date.now();
+    page.open(url, test.step_func(function (status) {
+        assert_equals(status, 'success');
+        var loaded = Date.now();
+        var result = page.evaluate(inspect_page);
+        var evaluated = Date.now();
+        page.renderBase64('PNG');
+        var rendered = Date.now();
+        page.close();
+        check(result);
+        callback({ load: loaded - start,
+                   evaluate: evaluated - loaded,
+                   render: rendered - evaluated });
+    }));
+}
+
+function record_exponents(prefix, sizes, medians) {
+    ['load', 'evaluate', 'render'].forEach(function (step) {
+        var worst = null;
+        for (var i = 1; i < sizes.length; i++) {
+            // Times below a few milliseconds are mostly noise.
+            var a = Math.max(medians[i-1][step], 1);
+            var b = Math.max(medians[i][step], 1);
+            var exponent = Math.log(b / a) / Math.log(sizes[i] / sizes[i-1]);
+            if (worst === null || exponent > worst) {
+                worst = exponent;
+            }
+        }
+        if (worst !== null) {
+            record_metric(prefix + '.' + step + '_exponent', worst);
+        }
+    });
+}
+
+KINDS.forEach(function (kind) {
+    var sizes = bench.number_list(bench_param(kind.param, kind.sizes));
+    async_test(function () {
+        var test = this, medians = [], results = [];
+        function next() {
+            if (medians.length === sizes.length) {
+                record_exponents(kind.name, sizes, medians);
+                test.done();
+                return;
+            }
+            var n = sizes[medians.length];
+            var url = TEST_HTTP_BASE + kind.url(n) + '&seed=' + SEED;
+            measure_once(test, url, function (r) { kind.check(n, r); },
+                         function (result) {
+                results.push(result);
+                if (results.length < REPEAT) {
+                    next();
+                    return;
+                }
+                var median = {};
+                ['load', 'evaluate', 'render'].forEach(function (step) {
+                    median[step] = bench.median(results.map(function (r) {
+                        return r[step];
+                    }));
+                    record_metric(kind.name + '_' + n + '.' + step,
+                                  median[step], 'ms');
+                });
+                medians.push(median);
+                results = [];
+                next();
+            });
+        }
+        next();
+    }, kind.name + ' pages at sizes ' + sizes.join(', '));
+});
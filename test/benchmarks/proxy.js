@@ -0,0 +1,104 @@
+//! timeout: 300
+
+// Measure the cost of loading pages through an HTTP proxy, using the
+// test runner's forward proxies (TEST_PROXY_BASE and
+// TEST_PROXY_AUTH_BASE).  The same page is loaded directly, through
+// the proxy, through the authenticating proxy, and over HTTPS through
+// the proxy (which uses a CONNECT tunnel).  For each, the median load
+// time is reported; the proxy's own statistics show how much of the
+// difference it is responsible for, and whether PhantomJS reused its
+// connections to the proxy.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   PROXY_LOADS   number of page loads in each configuration (default 50)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var LOADS = bench_param('PROXY_LOADS', 50);
+
+setup({ timeout: 300 * 1000 });
+
+// Returns {host, port, user, password} for a proxy URL.
+function parse_proxy(url) {
+    var m = url.match(/^http:\/\/(?:([^:@\/]*):([^@\/]*)@)?([^:\/]+):(\d+)\//);
+    return { user: m[1] || '', password: m[2] || '',
+             host: m[3], port: Number(m[4]) };
+}
+
+function fetch_stats(page, reset, callback) {
+    page.open(TEST_PROXY_BASE + '__proxy/stats' + (reset ? '?reset=1' : ''),
+              function (status) {
+                  callback(status === 'success'
+                           ? JSON.parse(page.plainText) : null);
+              });
+}
+
+function load_repeatedly(test, url, n, callback) {
+    var page = webpage.create(), times = [];
+    function next() {
+        if (times.length === n) {
+            page.close();
+            callback(times);
+            return;
+        }
+        var start = Date.now();
+        page.open(url, test.step_func(function (status) {
+            assert_equals(status, 'success');
+            times.push(Date.now() - start);
+            next();
+        }));
+    }
+    next();
+}
+
+function proxy_test(name, proxy_url, page_url) {
+    async_test(function () {
+        var test = this, stats_page = webpage.create();
+        var proxy = proxy_url && parse_proxy(proxy_url);
+        if (proxy) {
+            phantom.setProxy(proxy.host, proxy.port, 'http',
+                             proxy.user, proxy.password);
+        } else {
+            phantom.setProxy('');
+        }
+        fetch_stats(stats_page, true, test.step_func(function () {
+            load_repeatedly(test, page_url, LOADS, function (times) {
+                fetch_stats(stats_page, false, test.step_func_done(
+                    function (stats) {
+                        phantom.setProxy('');
+                        stats_page.close();
+                        record_metric(name + '.load', bench.median(times),
+                                      'ms');
+                        if (!proxy) {
+                            return;
+                        }
+                        // The stats request itself is not counted.
+                        assert_greater_than_equal(stats.requests, LOADS);
+                        if (stats.overhead_ms) {
+                            record_metric(name + '.overhead_p50',
+                                          stats.overhead_ms.p50, 'ms');
+                            record_metric(name + '.overhead_p90',
+                                          stats.overhead_ms.p90, 'ms');
+                        }
+                        record_metric(name + '.client_connections',
+                                      stats.client_connections);
+                        record_metric(name + '.requests_per_connection',
+                                      stats.requests /
+                                      Math.max(stats.client_connections, 1));
+                        record_metric(name + '.upstream_reuse',
+                                      stats.pool_hits /
+                                      Math.max(stats.pool_hits +
+                                               stats.pool_misses, 1));
+                        record_metric(name + '.tunnels', stats.tunnels);
+                    }));
+            });
+        }));
+    }, name);
+}
+
+proxy_test('direct', null, TEST_HTTP_BASE + 'hello.html');
+proxy_test('proxied', TEST_PROXY_BASE, TEST_HTTP_BASE + 'hello.html');
+proxy_test('proxied_auth', TEST_PROXY_AUTH_BASE,
+           TEST_HTTP_BASE + 'hello.html');
+proxy_test('proxied_https', TEST_PROXY_BASE, TEST_HTTPS_BASE + 'hello.html');
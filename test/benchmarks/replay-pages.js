@@ -0,0 +1,70 @@
+//! phantomjs: --ignore-ssl-errors=true
+//! timeout: 600
+
+// Measure page load times for real-world pages, served from a
+// record/replay archive (see "--replay" in run-tests.py) so that the
+// results do not depend on the network.  Without --replay, this
+// benchmark is skipped.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   REPLAY_PAGES    maximum number of recorded pages to load (default 20)
+//   REPLAY_REPEAT   number of times to load each page (default 3)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var PAGES  = bench_param('REPLAY_PAGES', 20);
+var REPEAT = bench_param('REPLAY_REPEAT', 3);
+
+setup({ timeout: 600 * 1000 });
+
+async_test(function () {
+    var test = this;
+    var page = webpage.create();
+
+    // The list of pages must be fetched before the proxy is set.
+    page.open(TEST_REPLAY_BASE + '__replay/pages',
+              this.step_func(function (status) {
+        assert_equals(status, 'success');
+        var urls = JSON.parse(page.plainText).slice(0, PAGES);
+        var parts = TEST_REPLAY_BASE.match(/^http:\/\/([^:\/]+):(\d+)\//);
+        page.close();
+        assert_greater_than(urls.length, 0, 'archive has no pages');
+        phantom.setProxy(parts[1], Number(parts[2]), 'http');
+
+        var times = [], failures = 0, queue = [];
+        urls.forEach(function (url) {
+            for (var i = 0; i < REPEAT; i++) {
+                queue.push(url);
+            }
+        });
+
+        function next() {
+            if (queue.length === 0) {
+                phantom.setProxy('');
+                record_metric('pages', urls.length);
+                record_metric('failures', failures);
+                if (times.length > 0) {
+                    record_metric('load.median', bench.median(times), 'ms');
+                    record_metric('load.p90', bench.percentile(times, 90),
+                                  'ms');
+                }
+                test.done();
+                return;
+            }
+            var url = queue.shift();
+            var p = webpage.create();
+            var start = Date.now();
+            p.open(url, test.step_func(function (status) {
+                if (status === 'success') {
+                    times.push(Date.now() - start);
+                } else {
+                    failures++;
+                }
+                p.close();
+                next();
+            }));
+        }
+        next();
+    }));
+}, 'replayed page loads', { skip: TEST_REPLAY_BASE === undefined });
@@ -0,0 +1,109 @@
+//! timeout: 300
+
+// Measure the overhead of PhantomJS's network callbacks, by loading a
+// page with many subresources (lib/www/fanout.py) with different sets
+// of callbacks attached:
+//
+//   none       no callbacks
+//   requested  onResourceRequested
+//   received   onResourceRequested and onResourceReceived
+//   all        those two, plus onResourceError and onResourceTimeout
+//   abort      onResourceRequested, aborting every image request, as in
+//              module/webpage/abort-network-request.js
+//
+// For each, the median load time (until the page's XHRs have also
+// finished) is recorded, and for all but 'none' and 'abort', the
+// additional time per resource relative to 'none'.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   FANOUT_EACH    number of each kind of subresource (default 50)
+//   FANOUT_SIZE    size of each subresource, bytes (default 256)
+//   FANOUT_REPEAT  number of page loads in each configuration (default 10)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var EACH   = bench_param('FANOUT_EACH', 50);
+var SIZE   = bench_param('FANOUT_SIZE', 256);
+var REPEAT = bench_param('FANOUT_REPEAT', 10);
+
+// Four kinds of subresource, plus the page itself.
+var RESOURCES = 4 * EACH + 1;
+var URL = TEST_HTTP_BASE + 'fanout?scripts=' + EACH + '&images=' + EACH +
+    '&css=' + EACH + '&xhr=' + EACH + '&size=' + SIZE;
+
+setup({ timeout: 300 * 1000 });
+
+var CONFIGS = {
+    none: function (page, counts) {},
+    requested: function (page, counts) {
+        page.onResourceRequested = function () { counts.requested++; };
+    },
+    received: function (page, counts) {
+        page.onResourceRequested = function () { counts.requested++; };
+        page.onResourceReceived = function (response) {
+            if (response.stage === 'end') {
+                counts.received++;
+            }
+        };
+    },
+    all: function (page, counts) {
+        CONFIGS.received(page, counts);
+        page.onResourceError = function () { counts.errors++; };
+        page.onResourceTimeout = function () { counts.errors++; };
+    },
+    abort: function (page, counts) {
+        page.onResourceRequested = function (requestData, request) {
+            counts.requested++;
+            if (/res=image/.test(requestData.url)) {
+                request.abort();
+                counts.aborted++;
+            }
+        };
+    }
+};
+
+var medians = {};
+
+Object.keys(CONFIGS).forEach(function (name) {
+    async_test(function () {
+        var test = this, times = [];
+        function next() {
+            if (times.length === REPEAT) {
+                medians[name] = bench.median(times);
+                record_metric(name + '.load', medians[name], 'ms');
+                if (name !== 'none' && name !== 'abort' &&
+                    medians.none !== undefined) {
+                    record_metric(name + '.per_resource_overhead',
+                                  (medians[name] - medians.none) /
+                                  RESOURCES * 1000, 'us');
+                }
+                test.done();
+                return;
+            }
+            var page = webpage.create();
+            var counts = { requested: 0, received: 0, errors: 0,
+                           aborted: 0 };
+            var start = Date.now();
+            CONFIGS[name](page, counts);
+            page.onCallback = test.step_func(function (message) {
+                assert_equals(message, 'fanout-done');
+                times.push(Date.now() - start);
+                page.close();
+                if (name === 'abort') {
+                    assert_equals(counts.aborted, EACH);
+                } else if (name !== 'none') {
+                    assert_equals(counts.requested, RESOURCES);
+                }
+                if (name === 'received' || name === 'all') {
+                    assert_equals(counts.received, RESOURCES);
+                }
+                next();
+            });
+            page.open(URL, test.step_func(function (status) {
+                assert_equals(status, 'success');
+            }));
+        }
+        next();
+    }, 'page load with callbacks: ' + name);
+});
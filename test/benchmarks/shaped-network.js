@@ -0,0 +1,108 @@
+//! timeout: 300
+
+// Measure how PhantomJS's view of resource timing compares with the
+// network conditions imposed by the test server's traffic shaping
+// (see "--shape" in run-tests.py).  For each first-byte latency, a
+// small page is loaded and the time from request to first byte, as
+// reported to onResourceReceived, is compared with the latency; for
+// each bandwidth limit, a download is timed and the achieved rate is
+// compared with the limit.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   SHAPE_LATENCIES  comma-separated latencies, ms (default 0,50,200)
+//   SHAPE_RATES      comma-separated rates, bytes/s (default 262144,1048576)
+//   SHAPE_BYTES      size of each rate-limited download (default 1 MiB)
+//   SHAPE_REPEAT     number of times to repeat each load (default 5)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var LATENCIES = bench.number_list(bench_param('SHAPE_LATENCIES', '0,50,200'));
+var RATES     = bench.number_list(bench_param('SHAPE_RATES',
+                                              '262144,1048576'));
+var BYTES     = bench_param('SHAPE_BYTES', 1024 * 1024);
+var REPEAT    = bench_param('SHAPE_REPEAT', 5);
+
+setup({ timeout: 300 * 1000 });
+
+function repeat(test, n, action, finish) {
+    var results = [];
+    function next() {
+        if (results.length === n) {
+            finish(results);
+            test.done();
+        } else {
+            action(function (result) {
+                results.push(result);
+                next();
+            });
+        }
+    }
+    next();
+}
+
+LATENCIES.forEach(function (latency) {
+    async_test(function () {
+        var test = this;
+        var url = TEST_HTTP_BASE + 'hello.html?__latency=' + latency;
+        repeat(this, REPEAT, function (done) {
+            var page = webpage.create(), requested, first, last;
+            page.onResourceRequested = test.step_func(function (rq) {
+                if (rq.id === 1) {
+                    requested = rq.time.getTime();
+                }
+            });
+            page.onResourceReceived = test.step_func(function (rs) {
+                if (rs.id !== 1) {
+                    return;
+                }
+                if (rs.stage === 'start') {
+                    first = rs.time.getTime();
+                } else if (rs.stage === 'end') {
+                    last = rs.time.getTime();
+                }
+            });
+            page.open(url, test.step_func(function (status) {
+                assert_equals(status, 'success');
+                page.close();
+                assert_greater_than_equal(first - requested, latency);
+                done({ ttfb: first - requested, load: last - requested });
+            }));
+        }, function (results) {
+            var ttfb = bench.median(results.map(function (r) {
+                return r.ttfb;
+            }));
+            var prefix = 'latency_' + latency;
+            record_metric(prefix + '.ttfb', ttfb, 'ms');
+            record_metric(prefix + '.ttfb_excess', ttfb - latency, 'ms');
+            record_metric(prefix + '.load', bench.median(results.map(
+                function (r) { return r.load; })), 'ms');
+        });
+    }, 'first-byte latency ' + latency + 'ms');
+});
+
+RATES.forEach(function (rate) {
+    async_test(function () {
+        var test = this, page = webpage.create();
+        var url = TEST_HTTP_BASE + 'bytes?n=' + BYTES + '&__rate=' + rate;
+        page.open(TEST_HTTP_BASE + 'hello.html', this.step_func(function () {
+            repeat(test, REPEAT, function (done) {
+                bench.download(page, url, 'arraybuffer', false,
+                    test.step_func(function (result) {
+                        assert_equals(result.status, 200);
+                        assert_equals(result.bytes, BYTES);
+                        done(result);
+                    }));
+            }, function (results) {
+                var elapsed = bench.median(results.map(function (r) {
+                    return r.elapsed;
+                }));
+                var achieved = BYTES / (elapsed / 1000);
+                record_metric('rate_' + rate + '.achieved', achieved,
+                              'bytes/s');
+                record_metric('rate_' + rate + '.error', achieved / rate - 1);
+                page.close();
+            });
+        }));
+    }, 'bandwidth limit ' + rate + ' bytes/s');
+});
@@ -0,0 +1,140 @@
+//! timeout: 600
+
+// Measure the cost of setting up TLS connections, using the test
+// server's extra HTTPS listeners (TEST_TLS_BASES; see TLS_PROFILES in
+// run-tests.py), which differ in key type and size, cipher suite, and
+// whether sessions can be resumed.  Plain HTTP (TEST_HTTP_BASE) and
+// the default HTTPS listener (TEST_HTTPS_BASE) are measured the same
+// way, for comparison.  For each, these are recorded:
+//
+//   page_open      time to open a page in a fresh webpage object,
+//                  which must make a new connection
+//   connect_*      latency of XMLHttpRequests whose responses close the
+//                  connection, so that each one must connect (and
+//                  handshake) again
+//   first_byte_*   time from sending each of those requests to
+//                  receiving the response headers
+//   keepalive_p50  latency of requests on an established connection
+//   setup          connect_p50 - keepalive_p50: the cost of setting up
+//                  a connection, handshake included
+//   tls_overhead   setup minus the same for plain HTTP
+//
+// Comparing a profile with its "-noresume" twin shows how much
+// PhantomJS gains from session resumption.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   TLS_REQUESTS  number of requests of each kind (default 100)
+//   TLS_OPENS     number of fresh pages to open (default 10)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var REQUESTS = bench_param('TLS_REQUESTS', 100);
+var OPENS    = bench_param('TLS_OPENS', 10);
+
+setup({ timeout: 600 * 1000 });
+
+var TARGETS = [['http', TEST_HTTP_BASE], ['https', TEST_HTTPS_BASE]];
+Object.keys(TEST_TLS_BASES).forEach(function (name) {
+    TARGETS.push([name, TEST_TLS_BASES[name]]);
+});
+
+var setup_times = {};
+
+// Runs in the page: times |arg.count| sequential requests for
+// |arg.url|, returning the total time and the time to the response
+// headers for each.
+function requests_in_page(arg) {
+    var times = [], first = [];
+    function one() {
+        var xhr = new XMLHttpRequest();
+        var start = Date.now();
+        var sep = arg.url.indexOf('?') === -1 ? '?' : '&';
+        xhr.open('GET', arg.url + sep + 'n=' + times.length);
+        xhr.onreadystatechange = function () {
+            if (xhr.readyState === 2) {
+                first.push(Date.now() - start);
+            }
+        };
+        xhr.onloadend = function () {
+            times.push(Date.now() - start);
+            if (xhr.status !== 200) {
+                window.callPhantom({ status: xhr.status });
+            } else if (times.length < arg.count) {
+                one();
+            } else {
+                window.callPhantom({ status: 200, times: times,
+                                     first: first });
+            }
+        };
+        xhr.send();
+    }
+    one();
+}
+
+function run_requests(page, url, callback) {
+    page.onCallback = function (result) {
+        page.onCallback = null;
+        callback(result);
+    };
+    page.evaluate(requests_in_page, { url: url, count: REQUESTS });
+}
+
+TARGETS.forEach(function (target) {
+    var name = target[0], base = target[1];
+
+    async_test(function () {
+        var test = this, opens = [];
+
+        function open_next() {
+            var page = webpage.create();
+            var start = Date.now();
+            page.open(base + 'hello.html', test.step_func(function (status) {
+                assert_equals(status, 'success');
+                opens.push(Date.now() - start);
+                if (opens.length < OPENS) {
+                    page.close();
+                    open_next();
+                } else {
+                    record_metric(name + '.page_open', bench.median(opens),
+                                  'ms');
+                    measure_requests(page);
+                }
+            }));
+        }
+
+        function measure_requests(page) {
+            run_requests(page, base + 'status?Connection=close',
+                         test.step_func(function (closing) {
+                assert_equals(closing.status, 200);
+                run_requests(page, base + 'hello.html',
+                             test.step_func_done(function (keepalive) {
+                    assert_equals(keepalive.status, 200);
+                    page.close();
+                    report(closing, keepalive);
+                }));
+            }));
+        }
+
+        function report(closing, keepalive) {
+            var connect = bench.median(closing.times);
+            var reuse = bench.median(keepalive.times);
+            record_metric(name + '.connect_p50', connect, 'ms');
+            record_metric(name + '.connect_p90',
+                          bench.percentile(closing.times, 90), 'ms');
+            record_metric(name + '.first_byte_p50',
+                          bench.median(closing.first), 'ms');
+            record_metric(name + '.first_byte_p90',
+                          bench.percentile(closing.first, 90), 'ms');
+            record_metric(name + '.keepalive_p50', reuse, 'ms');
+            setup_times[name] = connect - reuse;
+            record_metric(name + '.setup', setup_times[name], 'ms');
+            if (name !== 'http' && setup_times.http !== undefined) {
+                record_metric(name + '.tls_overhead',
+                              setup_times[name] - setup_times.http, 'ms');
+            }
+        }
+
+        open_next();
+    }, 'connection setup: ' + name);
+});
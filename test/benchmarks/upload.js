@@ -0,0 +1,71 @@
+//! timeout: 300
+
+// Measure how fast PhantomJS can upload a request body, by POSTing
+// bodies of several sizes with XMLHttpRequest to the test server's
+// upload sink (lib/www/upload-sink.py), which reads and discards them.
+// Reported for each size: the time from send() to the end of the
+// response, as seen by the page, and the receive throughput, as seen
+// by the server.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   UPLOAD_SIZES   comma-separated body sizes, bytes
+//                  (default 65536,1048576,16777216)
+//   UPLOAD_REPEAT  number of uploads of each size (default 5)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var SIZES  = bench.number_list(bench_param('UPLOAD_SIZES',
+                                           '65536,1048576,16777216'));
+var REPEAT = bench_param('UPLOAD_REPEAT', 5);
+
+setup({ timeout: 300 * 1000 });
+
+function upload_in_page(arg) {
+    var body = new Array(arg.size + 1).join('u');
+    var results = [];
+    function next() {
+        if (results.length === arg.repeat) {
+            window.callPhantom(results);
+            return;
+        }
+        var xhr = new XMLHttpRequest();
+        var start = Date.now();
+        xhr.open('POST', arg.url);
+        xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+        xhr.onloadend = function () {
+            var elapsed = Date.now() - start;
+            var server = xhr.status === 200 ? JSON.parse(xhr.responseText)
+                                            : null;
+            results.push({ status: xhr.status, elapsed: elapsed,
+                           server: server });
+            next();
+        };
+        xhr.send(body);
+    }
+    next();
+}
+
+SIZES.forEach(function (size) {
+    async_test(function () {
+        var test = this, page = webpage.create();
+        page.open(TEST_HTTP_BASE + 'hello.html', this.step_func(function () {
+            page.onCallback = test.step_func_done(function (results) {
+                page.close();
+                results.forEach(function (r) {
+                    assert_equals(r.status, 200);
+                    assert_equals(r.server.size, size);
+                });
+                var prefix = 'upload_' + size;
+                record_metric(prefix + '.elapsed', bench.median(
+                    results.map(function (r) { return r.elapsed; })), 'ms');
+                record_metric(prefix + '.server_bytes_per_sec', bench.median(
+                    results.map(function (r) {
+                        return r.server.bytes_per_sec || 0;
+                    })), 'bytes/s');
+            });
+            page.evaluate(upload_in_page, { url: TEST_HTTP_BASE + 'upload-sink',
+                                            size: size, repeat: REPEAT });
+        }));
+    }, 'upload ' + size + ' bytes');
+});
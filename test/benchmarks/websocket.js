@@ -0,0 +1,126 @@
+//! timeout: 300
+
+// Measure PhantomJS's WebSocket performance, using the test server's
+// WebSocket endpoints (lib/www/ws-echo.py and ws-flood.py).  The echo
+// test sends messages one at a time and times each round trip; the
+// flood tests have the server send messages as fast as it can (or at
+// a fixed rate), and measure the rate at which they are received and
+// the latency of each, from the server's timestamp in the message.
+//
+// Parameters (set with run-tests.py --bench-param NAME=VALUE):
+//   WS_ROUNDTRIPS  number of echo round trips (default 500)
+//   WS_SIZES       comma-separated message sizes, bytes (default 64,4096,65536)
+//   WS_MESSAGES    number of messages in each flood (default 5000)
+//   WS_RATE        flood rate, messages/s; 0 means unlimited (default 0)
+
+var webpage = require('webpage');
+var bench   = require('bench-utils');
+
+var ROUNDTRIPS = bench_param('WS_ROUNDTRIPS', 500);
+var SIZES      = bench.number_list(bench_param('WS_SIZES', '64,4096,65536'));
+var MESSAGES   = bench_param('WS_MESSAGES', 5000);
+var RATE       = bench_param('WS_RATE', 0);
+
+var WS_BASE = TEST_HTTP_BASE.replace(/^http:/, 'ws:');
+
+setup({ timeout: 300 * 1000 });
+
+// Run |fn| in |page| with argument |arg|.  |fn| must eventually call
+// window.callPhantom with its result, which is passed to |callback|.
+function run_in_page(page, fn, arg, callback) {
+    page.onCallback = function (result) {
+        page.onCallback = null;
+        callback(result);
+    };
+    page.evaluate(fn, arg);
+}
+
+function echo_in_page(arg) {
+    var ws = new WebSocket(arg.url);
+    var message = new Array(arg.size + 1).join('x');
+    var times = [], sent;
+    ws.onopen = function () {
+        sent = Date.now();
+        ws.send(message);
+    };
+    ws.onmessage = function (event) {
+        times.push(Date.now() - sent);
+        if (event.data.length !== message.length) {
+            ws.close();
+        } else if (times.length < arg.count) {
+            sent = Date.now();
+            ws.send(message);
+        } else {
+            ws.close(1000);
+        }
+    };
+    ws.onclose = function (event) {
+        window.callPhantom({ code: event.code, times: times });
+    };
+}
+
+function flood_in_page(arg) {
+    var ws = new WebSocket(arg.url);
+    var latencies = [], bytes = 0, start = null;
+    ws.onmessage = function (event) {
+        var now = Date.now();
+        if (start === null) {
+            start = now;
+        }
+        bytes += event.data.length;
+        latencies.push(now - parseFloat(event.data.split(' ')[1]));
+    };
+    ws.onclose = function (event) {
+        window.callPhantom({
+            code: event.code,
+            latencies: latencies,
+            bytes: bytes,
+            elapsed: Date.now() - start
+        });
+    };
+}
+
+function ws_test(name, fn, arg, report) {
+    async_test(function () {
+        var test = this, page = webpage.create();
+        page.open(TEST_HTTP_BASE + 'hello.html', this.step_func(function () {
+            run_in_page(page, fn, arg, test.step_func_done(function (r) {
+                page.close();
+                assert_equals(r.code, 1000);
+                report(r);
+            }));
+        }));
+    }, name);
+}
+
+SIZES.forEach(function (size) {
+    ws_test('echo round trips, ' + size + '-byte messages', echo_in_page,
+            { url: WS_BASE + 'ws-echo', size: size, count: ROUNDTRIPS },
+            function (r) {
+                var prefix = 'echo_' + size;
+                assert_equals(r.times.length, ROUNDTRIPS);
+                record_metric(prefix + '.rtt_p50',
+                              bench.percentile(r.times, 50), 'ms');
+                record_metric(prefix + '.rtt_p90',
+                              bench.percentile(r.times, 90), 'ms');
+                record_metric(prefix + '.rtt_p99',
+                              bench.percentile(r.times, 99), 'ms');
+            });
+
+    ws_test('server push, ' + size + '-byte messages', flood_in_page,
+            { url: WS_BASE + 'ws-flood?count=' + MESSAGES +
+                  '&size=' + size + '&rate=' + RATE },
+            function (r) {
+                var prefix = 'flood_' + size;
+                var seconds = Math.max(r.elapsed, 1) / 1000;
+                assert_equals(r.latencies.length, MESSAGES);
+                record_metric(prefix + '.messages_per_sec',
+                              MESSAGES / seconds, 'msg/s');
+                record_metric(prefix + '.bytes_per_sec',
+                              r.bytes / seconds, 'bytes/s');
+                record_metric(prefix + '.latency_p50',
+                              bench.percentile(r.latencies, 50), 'ms');
+                record_metric(prefix + '.latency_p99',
+                              bench.percentile(r.latencies, 99), 'ms');
+            });
+});
@@ -0,0 +1,12 @@
+// Lays out and renders text in each generic font family, which makes
+// PhantomJS load its font database.  run-tests.py runs this once at
+// startup, to fill the fontconfig cache that all of the tests share
+// (see TestRunner.prepare_font_cache).
+
+var page = require('webpage').create();
+page.setContent('<p style="font-family: serif">serif</p>' +
+                '<p style="font-family: sans-serif">sans-serif</p>' +
+                '<p style="font-family: monospace">monospace</p>',
+                'about:blank');
+page.renderBase64('PNG');
+phantom.exit(0);
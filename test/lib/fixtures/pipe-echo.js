@@ -0,0 +1,32 @@
+// Copies standard input to standard output, for run-tests.py --pipe.
+// With the argument "lines", copies a line at a time with readLine()
+// and writeLine(), stopping at the first empty line (which is how
+// readLine() reports the end of input).  With "binary", copies blocks
+// of up to 64 KiB with read() and write(), in ISO-8859-1 so that every
+// byte passes through unchanged.  In either case, writes "ready" first,
+// so that the runner can tell when PhantomJS has started.
+
+var system = require('system');
+var stdin  = system.stdin;
+var stdout = system.stdout;
+var mode   = system.args[1];
+var data;
+
+if (mode === 'lines') {
+    stdout.writeLine('ready');
+    while ((data = stdin.readLine()) !== '') {
+        stdout.writeLine(data);
+    }
+    phantom.exit(0);
+} else if (mode === 'binary') {
+    stdin.setEncoding('ISO-8859-1');
+    stdout.setEncoding('ISO-8859-1');
+    stdout.writeLine('ready');
+    while ((data = stdin.read(65536)) !== '') {
+        stdout.write(data);
+    }
+    phantom.exit(0);
+} else {
+    system.stderr.writeLine('usage: pipe-echo.js lines|binary');
+    phantom.exit(2);
+}
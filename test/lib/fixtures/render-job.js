@@ -0,0 +1,21 @@
+// Loads the page at the URL given as the first argument, renders it to
+// the file named by the second, and exits; one job of the workload for
+// run-tests.py --scaling.  Exits with status 1 if the page fails to
+// load.
+
+var webpage = require('webpage');
+var system  = require('system');
+
+var url  = system.args[1];
+var page = webpage.create();
+page.viewportSize = { width: 1024, height: 768 };
+
+page.open(url, function (status) {
+    if (status !== 'success') {
+        system.stderr.writeLine('failed to load ' + url);
+        phantom.exit(1);
+    } else {
+        page.render(system.args[2]);
+        phantom.exit(0);
+    }
+});
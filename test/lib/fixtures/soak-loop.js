@@ -0,0 +1,43 @@
+// Repeats one unit of work -- open a page, evaluate a script in it,
+// render it, and close it -- for run-tests.py --soak.  Arguments: the
+// URL of the page, the number of iterations, and the file to render
+// to (which is overwritten each time).  Writes "iteration N" after
+// each iteration, so that the runner can match its memory samples to
+// iterations, and "done" at the end.  Exits with status 1 if the page
+// fails to load.
+
+var webpage = require('webpage');
+var system  = require('system');
+
+var url        = system.args[1];
+var iterations = Number(system.args[2]);
+var output     = system.args[3];
+var completed  = 0;
+
+function iteration() {
+    var page = webpage.create();
+    page.viewportSize = { width: 800, height: 600 };
+    page.open(url, function (status) {
+        if (status !== 'success') {
+            system.stderr.writeLine('failed to load ' + url);
+            phantom.exit(1);
+            return;
+        }
+        page.evaluate(function () {
+            return document.querySelectorAll('*').length;
+        });
+        page.render(output);
+        page.close();
+
+        completed++;
+        system.stdout.writeLine('iteration ' + completed);
+        if (completed < iterations) {
+            setTimeout(iteration, 0);
+        } else {
+            system.stdout.writeLine('done');
+            phantom.exit(0);
+        }
+    });
+}
+
+iteration();
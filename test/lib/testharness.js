@@ -170,6 +170,67 @@ function done() {
 }
 expose(done, 'done');
 
+/** Public API: Benchmarks.
+ *  These are meant for the scripts run by "run-tests.py --benchmark",
+ *  but they are harmless in ordinary tests.
+ */
+
+/** Record a measurement.  |name| must not contain whitespace, and
+    |value| must be a finite number; |unit| is optional.  run-tests.py
+    reports all recorded measurements along with the test results. */
+function record_metric(name, value, unit) {
+    if (typeof name !== "string" || !/^\S+$/.test(name)) {
+        throw new Error("invalid metric name " + format_value(name));
+    }
+    if (typeof value !== "number" || !isFinite(value)) {
+        throw new Error("invalid value for metric " + name + ": " +
+                        format_value(value));
+    }
+    output.info("metric: " + name + " " + value + (unit ? " " + unit : ""));
+}
+expose(record_metric, 'record_metric');
+
+/** Retrieve a benchmark parameter, as set with run-tests.py's
+    "--bench-param NAME=VALUE" option.  If the parameter was not set,
+    returns |default_value|.  If |default_value| is a number, the
+    parameter's value is converted to a number. */
+function bench_param(name, default_value) {
+    var value = sys.env["BENCH_" + name];
+    if (value === undefined) {
+        return default_value;
+    }
+    if (typeof default_value === "number") {
+        var n = Number(value);
+        if (isNaN(n)) {
+            throw new Error("benchmark parameter " + name +
+                            " must be a number, not " + format_value(value));
+        }
+        return n;
+    }
+    return value;
+}
+expose(bench_param, 'bench_param');
+
+/** Report the current and peak resident set size of this process, in
+    kilobytes, as an object with properties |rss| and |peak|.  This
+    information is read from /proc, so it is only available on Linux;
+    elsewhere, returns null. */
+function process_memory() {
+    var status;
+    try {
+        status = fs.read("/proc/self/status");
+    } catch (e) {
+        return null;
+    }
+    var rss  = /^VmRSS:\s*(\d+) kB$/m.exec(status);
+    var peak = /^VmHWM:\s*(\d+) kB$/m.exec(status);
+    if (!rss || !peak) {
+        return null;
+    }
+    return { rss: parseInt(rss[1], 10), peak: parseInt(peak[1], 10) };
+}
+expose(process_memory, 'process_memory');
+
 
 /** Public API: Assertions.
  *  All assertion functions take a |description| argument which is used to
@@ -662,8 +723,9 @@ function Test(name, properties) {
         properties = {};
     }
     this.properties = properties;
-    this.timeout_length = properties.timeout ? properties.timeout
-                                             : tests.test_timeout_length;
+    this.timeout_length = properties.timeout
+        ? properties.timeout * timeout_factor
+        : tests.test_timeout_length;
     this.should_run = !properties.skip;
     tests.push(this);
     this.number = tests.tests.length;
@@ -994,9 +1056,10 @@ Tests.prototype.setup = function setup(func, properties) {
             } else if (p == "explicit_done" && value) {
                 this.wait_for_finish = true;
             } else if (p == "timeout" && value) {
-                this.harness_timeout_length = value;
+                this.harness_timeout_length = value * timeout_factor;
             } else if (p == "test_timeout") {
-                this.test_timeout_length = value;
+                this.test_timeout_length =
+                    value === null ? null : value * timeout_factor;
             }
         }
     }
@@ -1457,6 +1520,12 @@ var sys  = require('system');
 var fs   = require('fs');
 var args = process_command_line(sys);
 
+// Under a profiler (run-tests.py --profile), PhantomJS runs many times
+// more slowly than usual; run-tests.py sets this environment variable
+// to how many, and all timeouts are stretched to match.
+var timeout_factor = Number(sys.env['TEST_TIMEOUT_FACTOR']) || 1;
+settings.harness_timeout *= timeout_factor;
+
 if (args.test_script === "") {
     // process_command_line has already issued an error message.
     phantom.exit(2);
@@ -1466,6 +1535,21 @@ if (args.test_script === "") {
     expose(sys.env['TEST_HTTP_BASE'], 'TEST_HTTP_BASE');
     expose(sys.env['TEST_HTTPS_BASE'], 'TEST_HTTPS_BASE');
 
+    // run-tests.py sets these environment variables to the base URLs
+    // of its forward proxies: one open to all, one requiring basic
+    // authentication (with the credentials included in the URL).
+    expose(sys.env['TEST_PROXY_BASE'], 'TEST_PROXY_BASE');
+    expose(sys.env['TEST_PROXY_AUTH_BASE'], 'TEST_PROXY_AUTH_BASE');
+
+    // run-tests.py sets this environment variable to a JSON object
+    // mapping the names of its extra HTTPS listeners (see TLS_PROFILES
+    // in run-tests.py) to their base URLs.
+    expose(JSON.parse(sys.env['TEST_TLS_BASES'] || '{}'), 'TEST_TLS_BASES');
+
+    // With --replay, this is the URL of the record/replay proxy;
+    // otherwise it is undefined.
+    expose(sys.env['TEST_REPLAY_BASE'], 'TEST_REPLAY_BASE');
+
     // run-tests.py sets these environment variables to the full pathnames
     // of the PhantomJS binary and Python interpreter.
     expose(sys.env['PHANTOMJS'], 'PHANTOMJS');
@@ -1,2 +1,16 @@
 # This file makes test/www/ into a "package" so that
 # importing Python response hooks works correctly.
+# Response hooks can also import shared helpers from it, as
+# "from test_www import <name>".
+
+import cStringIO as StringIO
+
+def bad_query(req, exc):
+    """Send a 400 response reporting EXC, an error from parsing the
+       query string; the hook should return the result."""
+    body = "Bad query: {}\n".format(exc)
+    req.send_response(400)
+    req.send_header('Content-Type', 'text/plain')
+    req.send_header('Content-Length', str(len(body)))
+    req.end_headers()
+    return StringIO.StringIO(body)
@@ -0,0 +1,80 @@
+import binascii
+import random
+import urlparse
+
+from test_www import bad_query
+
+# Serves deterministic pseudo-random binary data, generated as it is
+# sent, so arbitrarily large responses cost constant memory.  Query
+# parameters:
+#
+#   n      number of bytes to send (required)
+#   seed   PRNG seed (default 0); the same seed always yields the
+#          same bytes, whatever the chunk size
+#   chunk  size of each write (default 65536)
+#
+# Drawing every byte from the PRNG is far too slow to keep a socket
+# busy, so the body is assembled from SEGMENT-byte slices of a pool of
+# random bytes, at offsets chosen by the same PRNG.  Building a pool
+# takes tens of milliseconds, so the pools for the last few seeds used
+# are kept.
+
+POOL_SIZE = 1 << 20
+SEGMENT = 65536
+MAX_POOLS = 8
+
+# seed -> (pool, state of the PRNG after generating the pool)
+pools = {}
+
+def random_bytes(rng, n):
+    return binascii.unhexlify('{:0{}x}'.format(rng.getrandbits(n * 8), n * 2))
+
+def get_pool(seed):
+    try:
+        return pools[seed]
+    except KeyError:
+        rng = random.Random(seed)
+        pool = random_bytes(rng, POOL_SIZE)
+        if len(pools) >= MAX_POOLS:
+            pools.clear()
+        pools[seed] = (pool, rng.getstate())
+        return pools[seed]
+
+def generate(n, seed, chunk):
+    pool, state = get_pool(seed)
+    rng = random.Random()
+    rng.setstate(state)
+    pending = ''
+    while n > 0:
+        size = min(n, SEGMENT)
+        offset = rng.randrange(POOL_SIZE - size + 1)
+        pending += pool[offset:offset+size]
+        n -= size
+        start = 0
+        while len(pending) - start >= chunk:
+            yield pending[start:start+chunk]
+            start += chunk
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query, strict_parsing=True))
+        n = int(query['n'])
+        seed = int(query.get('seed', 0))
+        chunk = int(query.get('chunk', 65536))
+        if n < 0:
+            raise ValueError("n must not be negative")
+        if not 0 < chunk <= POOL_SIZE:
+            raise ValueError("chunk must be between 1 and {}"
+                             .format(POOL_SIZE))
+    except (KeyError, ValueError) as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'application/octet-stream')
+    req.send_header('Content-Length', str(n))
+    req.end_headers()
+    return generate(n, seed, chunk)
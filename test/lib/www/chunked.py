@@ -0,0 +1,25 @@
+import urlparse
+import time
+
+# Sends its response in pieces, using chunked transfer encoding.
+# The query string may specify the number of chunks (n) and the
+# delay between them in milliseconds (delay).
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    query = dict(urlparse.parse_qsl(url.query))
+    n = int(query.get('n', 10))
+    delay = float(query.get('delay', 0)) / 1000
+
+    def generate():
+        for i in range(n):
+            if i > 0:
+                time.sleep(delay)
+                yield ",{}".format(i)
+            else:
+                yield "{}".format(i)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/plain')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return generate()
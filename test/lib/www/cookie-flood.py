@@ -0,0 +1,75 @@
+import cStringIO as StringIO
+import urlparse
+
+from test_www import bad_query
+
+# Sets many cookies at once, for measuring how PhantomJS's cookie jar
+# copes as it grows.  Like status.py, but the Set-Cookie headers are
+# generated rather than spelled out in the query.  Query parameters:
+#
+#   count    number of cookies to set (default 100)
+#   paths    number of distinct paths to spread them over; cookie i
+#            gets "Path=/" if i % paths is 0, and "Path=/cookie-flood/K"
+#            for K = i % paths otherwise (default 1)
+#   size     length of each cookie's value (default 16)
+#   prefix   prefix for the cookie names, which are PREFIX-I; use a
+#            different prefix to add more cookies to the jar instead of
+#            replacing the ones already there (default "c")
+#   max-age  lifetime of the cookies, in seconds; 0 makes them session
+#            cookies (default 86400)
+#
+# The cookies are host-only, so to fill the jar with cookies for many
+# domains, request this page through TEST_PROXY_BASE using host names
+# under .localhost (e.g. http://d1.localhost:PORT/cookie-flood?...).
+# The response body is a short HTML page; the number of cookies set is
+# also reported in an X-Cookies-Set header.
+
+LIMITS = {'count': 100000, 'paths': 10000, 'size': 4000,
+          'max-age': 10 * 365 * 86400}
+
+def parse_query(query):
+    params = {'count': 100, 'paths': 1, 'size': 16, 'prefix': 'c',
+              'max-age': 86400}
+    for key, value in urlparse.parse_qsl(query):
+        if key not in params:
+            raise ValueError('unknown parameter ' + key)
+        if key == 'prefix':
+            if not value.replace('-', '').replace('_', '').isalnum():
+                raise ValueError('bad prefix ' + value)
+            params[key] = value
+            continue
+        value = int(value)
+        if not 0 <= value <= LIMITS[key] or (key == 'paths' and value < 1):
+            raise ValueError('{} out of range'.format(key))
+        params[key] = value
+    return params
+
+def cookie_headers(params):
+    value = 'v' * params['size']
+    attrs = ''
+    if params['max-age']:
+        attrs += '; Max-Age={}'.format(params['max-age'])
+    for i in xrange(params['count']):
+        k = i % params['paths']
+        path = '/cookie-flood/{}'.format(k) if k else '/'
+        yield '{}-{}={}; Path={}{}'.format(params['prefix'], i, value,
+                                            path, attrs)
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        params = parse_query(url.query)
+    except ValueError as e:
+        return bad_query(req, e)
+
+    body = ('<!doctype html><title>cookie-flood</title>'
+            '<p>{} cookies set</p>\n'.format(params['count']))
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/html')
+    req.send_header('Content-Length', str(len(body)))
+    req.send_header('Cache-Control', 'no-store')
+    req.send_header('X-Cookies-Set', str(params['count']))
+    for cookie in cookie_headers(params):
+        req.send_header('Set-Cookie', cookie)
+    req.end_headers()
+    return StringIO.StringIO(body)
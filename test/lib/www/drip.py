@@ -0,0 +1,47 @@
+import time
+import urlparse
+
+from test_www import bad_query
+
+# Serves a body of 'total' bytes at a steady 'rate' bytes per second.
+# Query parameters:
+#
+#   rate   bytes per second (required)
+#   total  number of bytes to send (required)
+#   chunk  size of each write (default: a tenth of a second's worth,
+#          but at most 65536)
+#
+# The pacing is computed from the start of the response, so that
+# scheduling delays do not accumulate.
+
+def generate(rate, total, chunk):
+    block = '*' * chunk
+    start = time.time()
+    sent = 0
+    while sent < total:
+        size = min(chunk, total - sent)
+        yield block if size == chunk else block[:size]
+        sent += size
+        delay = start + float(sent) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query, strict_parsing=True))
+        rate = int(query['rate'])
+        total = int(query['total'])
+        chunk = int(query.get('chunk', max(1, min(rate // 10, 65536))))
+        if rate <= 0 or chunk <= 0:
+            raise ValueError("rate and chunk must be positive")
+        if total < 0:
+            raise ValueError("total must not be negative")
+    except (KeyError, ValueError) as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'application/octet-stream')
+    req.send_header('Content-Length', str(total))
+    req.end_headers()
+    return generate(rate, total, chunk)
@@ -0,0 +1,105 @@
+import cgi
+import cStringIO as StringIO
+import urlparse
+
+from test_www import bad_query
+
+# Serves a page with many subresources, for measuring the per-request
+# overhead of PhantomJS's network machinery and callbacks.  Query
+# parameters:
+#
+#   scripts  number of external scripts (default 10)
+#   images   number of images (default 10)
+#   css      number of stylesheets (default 10)
+#   xhr      number of XMLHttpRequests made by the page (default 10)
+#   size     size of each script, stylesheet, and XHR response, in
+#            bytes (default 256)
+#
+# The subresources are served from this same URL, with "res=KIND&i=N"
+# added, and are never cached.  Once the page has loaded and all of its
+# XHRs have completed, it calls window.callPhantom('fanout-done'), so
+# that a test can wait for everything to finish.
+
+# A 1x1 transparent GIF.
+GIF = ('GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9'
+       '\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00'
+       '\x02\x02D\x01\x00;')
+
+PAGE_SCRIPT = '''<script>
+(function () {
+    var pending = %(xhr)d + 1;
+    function finished() {
+        if (--pending === 0 && window.callPhantom) {
+            window.callPhantom('fanout-done');
+        }
+    }
+    for (var i = 0; i < %(xhr)d; i++) {
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', '%(base)s' + i);
+        xhr.onloadend = finished;
+        xhr.send();
+    }
+    window.addEventListener('load', finished);
+})();
+</script>
+'''
+
+def page(base, counts):
+    out = ['<!doctype html>\n<html><head><title>fanout</title>\n']
+    out.extend('<link rel="stylesheet" href="{}css&amp;i={}">\n'
+               .format(cgi.escape(base, True), i)
+               for i in xrange(counts['css']))
+    out.append('</head><body>\n')
+    out.extend('<script src="{}script&amp;i={}"></script>\n'
+               .format(cgi.escape(base, True), i)
+               for i in xrange(counts['scripts']))
+    out.extend('<img src="{}image&amp;i={}" width="1" height="1">\n'
+               .format(cgi.escape(base, True), i)
+               for i in xrange(counts['images']))
+    out.append(PAGE_SCRIPT % {'xhr': counts['xhr'],
+                              'base': base + 'xhr&i='})
+    out.append('</body></html>\n')
+    return ''.join(out)
+
+def resource(kind, index, size):
+    if kind == 'image':
+        return 'image/gif', GIF
+    if kind == 'script':
+        head = 'window.fanoutScripts = (window.fanoutScripts || 0) + 1;\n'
+        padding = '/' * max(size - len(head), 0)
+        return 'application/javascript', head + padding
+    if kind == 'css':
+        head = '.fanout{} {{ color: #{:06x}; }}\n'.format(index, index)
+        return 'text/css', head + ' ' * max(size - len(head), 0)
+    if kind == 'xhr':
+        return 'text/plain', 'x' * size
+    raise ValueError("unknown resource kind: " + kind)
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        counts = dict((kind, int(query.get(kind, 10)))
+                      for kind in ('scripts', 'images', 'css', 'xhr'))
+        size = int(query.get('size', 256))
+        if min(counts.values()) < 0 or size < 0:
+            raise ValueError("parameters must not be negative")
+        if 'res' in query:
+            ctype, body = resource(query['res'], int(query.get('i', 0)), size)
+        else:
+            # Subresource URLs repeat the page's own parameters, so
+            # that 'size' carries over.
+            base = (url.path.rpartition('/')[2] + '?' +
+                    '&'.join('{}={}'.format(k, v)
+                             for k, v in sorted(query.items())) +
+                    '&res=')
+            ctype, body = 'text/html', page(base, counts)
+    except ValueError as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', ctype)
+    req.send_header('Content-Length', str(len(body)))
+    req.send_header('Cache-Control', 'no-store')
+    req.end_headers()
+    return StringIO.StringIO(body)
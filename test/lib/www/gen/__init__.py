@@ -0,0 +1,31 @@
+# Helpers shared by the generated-page response hooks in this
+# directory, which import them from "test_www.gen".
+
+import cgi
+
+# Generated pages are sent in chunks of at least this many bytes.
+FLUSH = 16384
+
+def chunks(pieces):
+    """Join the strings produced by PIECES into chunks of at least
+       FLUSH bytes (except perhaps the last), so that a page can be
+       streamed out as it is generated, without sending a chunk for
+       every element."""
+    out = []
+    size = 0
+    for piece in pieces:
+        out.append(piece)
+        size += len(piece)
+        if size >= FLUSH:
+            yield ''.join(out)
+            out = []
+            size = 0
+    if out:
+        yield ''.join(out)
+
+def self_link(path):
+    """The page's own URL, relative to itself, with its query string,
+       escaped for use in an attribute and followed by the separator
+       for one more query parameter."""
+    base = cgi.escape(path.rpartition('/')[2], True)
+    return base + ('&amp;' if '?' in base else '?')
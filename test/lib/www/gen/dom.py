@@ -0,0 +1,63 @@
+import random
+import urlparse
+
+from test_www import bad_query
+from test_www.gen import chunks
+
+# Generates an HTML document containing 'nodes' elements, nested at most
+# 'depth' deep, and streams it out as it is generated.  Query parameters:
+#
+#   nodes  number of elements in the body (default 1000)
+#   depth  maximum nesting depth (default 10)
+#   seed   PRNG seed (default 0); the same parameters always produce
+#          the same document
+#
+# The elements are generic containers, which may be nested in any
+# order without the parser having to repair the tree, with short text
+# content and class names; the classes make some of them floats or
+# inline blocks, so that both layout and style resolution have some
+# work to do.
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+TAGS = ('div', 'div', 'div', 'section', 'article')
+
+def generate(nodes, depth, seed):
+    rng = random.Random(seed)
+    yield ('<!doctype html>\n<html><head><title>gen/dom {} {}</title>'
+           '<style>.c0{{margin:1px}}.c1{{padding:1px}}.c2{{color:#333}}'
+           '.c3{{float:left}}.c4{{display:inline-block}}</style>'
+           '</head><body>\n'.format(nodes, depth))
+    stack = []
+    for i in xrange(nodes):
+        # Either descend into a new child of the current element, or
+        # close some of the open elements first.
+        target = rng.randint(0, min(len(stack), depth - 1))
+        while len(stack) > target:
+            yield '</{}>'.format(stack.pop())
+        tag = rng.choice(TAGS)
+        yield '<{} id="n{}" class="c{}">{} '.format(
+            tag, i, rng.randrange(5), rng.choice(WORDS))
+        stack.append(tag)
+    while stack:
+        yield '</{}>'.format(stack.pop())
+    yield '\n</body></html>\n'
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        nodes = int(query.get('nodes', 1000))
+        depth = int(query.get('depth', 10))
+        seed = int(query.get('seed', 0))
+        if nodes < 0 or depth < 1:
+            raise ValueError("nodes must not be negative,"
+                             " and depth must be positive")
+    except ValueError as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/html')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return chunks(generate(nodes, depth, seed))
@@ -0,0 +1,76 @@
+import cStringIO as StringIO
+import random
+import struct
+import urlparse
+import zlib
+
+from test_www import bad_query
+from test_www.gen import chunks, self_link
+
+# Generates an HTML document containing 'count' distinct PNG images.
+# Query parameters:
+#
+#   count  number of images (default 100)
+#   size   width and height of each image, in pixels (default 64)
+#   seed   PRNG seed (default 0); the same parameters always produce
+#          the same images
+#
+# The images are served from this same URL, with "img=N" added.  Each
+# is a pair of random colors in random stripes, so that none of them
+# are identical and all of them have to be decoded.
+
+def png_chunk(kind, data):
+    return (struct.pack('!I', len(data)) + kind + data +
+            struct.pack('!I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+def image(index, size, seed):
+    rng = random.Random(seed * 1000003 + index)
+    colors = [struct.pack('!BBB', rng.randrange(256), rng.randrange(256),
+                          rng.randrange(256)) for _ in range(2)]
+    stripe = rng.randint(1, max(1, size // 4))
+    rows = []
+    for y in xrange(size):
+        # Each scanline starts with filter type 0 (none).
+        rows.append('\0' + colors[(y // stripe) % 2] * size)
+    return ('\x89PNG\r\n\x1a\n' +
+            png_chunk('IHDR', struct.pack('!IIBBBBB', size, size,
+                                          8, 2, 0, 0, 0)) +
+            png_chunk('IDAT', zlib.compress(''.join(rows))) +
+            png_chunk('IEND', ''))
+
+def generate(path, count, size):
+    yield ('<!doctype html>\n<html><head><title>gen/images {}</title>'
+           '</head><body>\n'.format(count))
+    link = self_link(path)
+    for i in xrange(count):
+        yield '<img src="{}img={}" width="{}" height="{}">\n'.format(
+            link, i, size, size)
+    yield '</body></html>\n'
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        count = int(query.get('count', 100))
+        size = int(query.get('size', 64))
+        seed = int(query.get('seed', 0))
+        img = int(query['img']) if 'img' in query else None
+        if count < 0 or not 1 <= size <= 4096:
+            raise ValueError("count must not be negative,"
+                             " and size must be between 1 and 4096")
+    except ValueError as e:
+        return bad_query(req, e)
+
+    if img is not None:
+        body = image(img, size, seed)
+        req.send_response(200)
+        req.send_header('Content-Type', 'image/png')
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        return StringIO.StringIO(body)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/html')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return chunks(generate(req.path, count, size))
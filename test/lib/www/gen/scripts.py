@@ -0,0 +1,77 @@
+import cStringIO as StringIO
+import random
+import urlparse
+
+from test_www import bad_query
+from test_www.gen import chunks, self_link
+
+# Generates an HTML document that runs 'count' scripts.  Query
+# parameters:
+#
+#   count     number of scripts (default 100)
+#   size      approximate size of each script, in bytes (default 1024)
+#   external  if 1, the scripts are loaded with <script src>, from this
+#             same URL with "js=N" added; otherwise (the default) they
+#             are inline
+#   seed      PRNG seed (default 0); the same parameters always produce
+#             the same scripts
+#
+# Each script defines a few functions and calls one of them, and
+# increments window.genScriptsRun, so that a test can check that all
+# of them ran.
+
+def script(index, size, seed):
+    rng = random.Random(seed * 1000003 + index)
+    out = ['window.genScriptsRun = (window.genScriptsRun || 0) + 1;\n']
+    length = len(out[0])
+    k = 0
+    while length < size:
+        piece = ('function f{}_{}(x) {{ return (x * {} + {}) % {}; }}\n'
+                 .format(index, k, rng.randrange(1, 1000),
+                         rng.randrange(1000), rng.randrange(1, 10007)))
+        out.append(piece)
+        length += len(piece)
+        k += 1
+    if k:
+        out.append('window.genScriptsValue = f{}_{}({});\n'
+                   .format(index, rng.randrange(k), index))
+    return ''.join(out)
+
+def generate(path, count, size, external, seed):
+    yield ('<!doctype html>\n<html><head><title>gen/scripts {}</title>'
+           '</head><body>\n'.format(count))
+    link = self_link(path)
+    for i in xrange(count):
+        if external:
+            yield '<script src="{}js={}"></script>\n'.format(link, i)
+        else:
+            yield '<script>\n{}</script>\n'.format(script(i, size, seed))
+    yield '</body></html>\n'
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        count = int(query.get('count', 100))
+        size = int(query.get('size', 1024))
+        external = query.get('external', '0') == '1'
+        seed = int(query.get('seed', 0))
+        js = int(query['js']) if 'js' in query else None
+        if count < 0 or size < 0:
+            raise ValueError("count and size must not be negative")
+    except ValueError as e:
+        return bad_query(req, e)
+
+    if js is not None:
+        body = script(js, size, seed)
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/javascript')
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        return StringIO.StringIO(body)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/html')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return chunks(generate(req.path, count, size, external, seed))
@@ -0,0 +1,59 @@
+import random
+import urlparse
+
+from test_www import bad_query
+from test_www.gen import chunks
+
+# Generates an HTML table with 'rows' rows and 'cols' columns, and
+# streams it out as it is generated.  Query parameters:
+#
+#   rows   number of body rows (default 100)
+#   cols   number of columns (default 10)
+#   seed   PRNG seed (default 0); the same parameters always produce
+#          the same document
+#
+# Cell contents vary in width, so that automatic table layout has to
+# take all of them into account.
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+def generate(rows, cols, seed):
+    rng = random.Random(seed)
+    yield ('<!doctype html>\n<html><head><title>gen/table {} {}</title>'
+           '</head><body>\n<table border="1"><thead><tr>'
+           .format(rows, cols))
+    for c in xrange(cols):
+        yield '<th>col {}</th>'.format(c)
+    yield '</tr></thead>\n<tbody>\n'
+    for r in xrange(rows):
+        cells = ['<tr id="r{}">'.format(r)]
+        for c in xrange(cols):
+            if rng.random() < 0.5:
+                cells.append('<td>{}</td>'.format(rng.randrange(1000000)))
+            else:
+                cells.append('<td>{}</td>'.format(
+                    ' '.join(rng.choice(WORDS)
+                             for _ in xrange(rng.randint(1, 4)))))
+        cells.append('</tr>\n')
+        yield ''.join(cells)
+    yield '</tbody></table>\n</body></html>\n'
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        rows = int(query.get('rows', 100))
+        cols = int(query.get('cols', 10))
+        seed = int(query.get('seed', 0))
+        if rows < 0 or cols < 1:
+            raise ValueError("rows must not be negative,"
+                             " and cols must be positive")
+    except ValueError as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'text/html')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return chunks(generate(rows, cols, seed))
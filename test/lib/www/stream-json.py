@@ -0,0 +1,47 @@
+import json
+import random
+import urlparse
+
+from test_www import bad_query
+
+# Serves a JSON array of 'records' deterministic pseudo-random objects,
+# generated as they are sent.  Query parameters:
+#
+#   records  number of array elements (required)
+#   seed     PRNG seed (default 0)
+#   batch    number of records per chunk (default 256)
+
+def generate(records, seed, batch):
+    rng = random.Random(seed)
+    yield '['
+    for lo in xrange(0, records, batch):
+        chunk = []
+        for i in xrange(lo, min(lo + batch, records)):
+            chunk.append(json.dumps({
+                'id':    i,
+                'key':   '{:08x}'.format(rng.getrandbits(32)),
+                'value': rng.random(),
+                'flags': [rng.randrange(2) == 1 for _ in range(4)]
+            }, sort_keys=True))
+        yield (',' if lo else '') + ','.join(chunk)
+    yield ']\n'
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query, strict_parsing=True))
+        records = int(query['records'])
+        seed = int(query.get('seed', 0))
+        batch = int(query.get('batch', 256))
+        if records < 0:
+            raise ValueError("records must not be negative")
+        if batch <= 0:
+            raise ValueError("batch must be positive")
+    except (KeyError, ValueError) as e:
+        return bad_query(req, e)
+
+    req.send_response(200)
+    req.send_header('Content-Type', 'application/json')
+    req.send_header('Transfer-Encoding', 'chunked')
+    req.end_headers()
+    return generate(records, seed, batch)
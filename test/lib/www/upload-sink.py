@@ -0,0 +1,44 @@
+import cStringIO as StringIO
+import hashlib
+import json
+import time
+
+# Accepts a POST body of any size, without keeping it, and responds
+# with a JSON description of it:
+#
+#   size            length of the body, in bytes
+#   sha256          hex SHA-256 digest of the body
+#   chunked         whether the body used chunked transfer encoding
+#   seconds         time taken to receive the body
+#   bytes_per_sec   receive throughput
+
+def handle_request(req):
+    if req.body is None:
+        body = "POST something to this URL.\n"
+        req.send_response(405)
+        req.send_header('Allow', 'POST')
+        req.send_header('Content-Type', 'text/plain')
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        return StringIO.StringIO(body)
+
+    digest = hashlib.sha256()
+    size = 0
+    start = time.time()
+    for block in req.body:
+        digest.update(block)
+        size += len(block)
+    seconds = time.time() - start
+
+    body = json.dumps({
+        'size':          size,
+        'sha256':        digest.hexdigest(),
+        'chunked':       req.body.chunked,
+        'seconds':       seconds,
+        'bytes_per_sec': size / seconds if seconds > 0 else None,
+    }) + '\n'
+    req.send_response(200)
+    req.send_header('Content-Type', 'application/json')
+    req.send_header('Content-Length', str(len(body)))
+    req.end_headers()
+    return StringIO.StringIO(body)
@@ -1,7 +1,6 @@
 # -*- encoding: utf-8 -*-
 import urlparse
 from cStringIO import StringIO
-import time
 
 def html_esc(s):
     return s.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')
@@ -74,8 +73,7 @@ def handle_request(req):
             code=500)
 
     elif url.query == "/%89i%8Bv": # 永久
-        time.sleep(5)
-        return do_response(req, '', code=204)
+        return req.defer(5, lambda req: do_response(req, '', code=204))
 
     else:
         return do_response(req,
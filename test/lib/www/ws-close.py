@@ -0,0 +1,38 @@
+import time
+import urlparse
+
+# WebSocket endpoint for testing unusual ways of ending a connection.
+# The query string selects one:
+#
+#   server&code=C&reason=R
+#           the server starts the closing handshake, with status code C
+#           (default 1000) and reason R (default empty)
+#   drop    the server drops the TCP connection without a close frame
+#   ignore  the server waits for the client's close frame, does not
+#           answer it, and drops the connection two seconds later
+#   invalid the server sends a malformed close frame (a one-byte
+#           payload), which the client should treat as a protocol error
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    mode, _, params = url.query.partition('&')
+    query = dict(urlparse.parse_qsl(params))
+
+    ws = req.accept_websocket()
+    if ws is None:
+        return None
+
+    if mode == 'server':
+        ws.close(int(query.get('code', 1000)), query.get('reason', ''))
+    elif mode == 'ignore':
+        while True:
+            frame = ws.read_frame()
+            if frame is None or frame[1] == ws.CLOSE:
+                break
+        time.sleep(2)
+    elif mode == 'invalid':
+        ws.send_frame(ws.CLOSE, '\x03')
+        ws.close()
+    # 'drop', and anything unrecognized, just returns, which closes
+    # the TCP connection.
+    return None
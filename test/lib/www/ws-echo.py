@@ -0,0 +1,13 @@
+# WebSocket endpoint which sends each message back to the client,
+# as text or binary to match, until the client closes the connection.
+
+def handle_request(req):
+    ws = req.accept_websocket()
+    if ws is None:
+        return None
+    while True:
+        message = ws.recv()
+        if message is None:
+            return None
+        opcode, data = message
+        ws.send_frame(opcode, data)
@@ -0,0 +1,45 @@
+import time
+import urlparse
+
+from test_www import bad_query
+
+# WebSocket endpoint which sends a stream of text messages, then closes
+# the connection.  Query parameters:
+#
+#   count  number of messages (default 1000)
+#   size   length of each message, in bytes (default 64)
+#   rate   messages per second; 0, the default, means as fast as possible
+#
+# Each message begins with its sequence number and the time it was
+# sent, in milliseconds since the epoch, separated by spaces, so that
+# the client can measure latency; the rest is padding.  As with
+# drip.py, the pacing is computed from the start, so that scheduling
+# delays do not accumulate.
+
+def handle_request(req):
+    url = urlparse.urlparse(req.path)
+    try:
+        query = dict(urlparse.parse_qsl(url.query))
+        count = int(query.get('count', 1000))
+        size = int(query.get('size', 64))
+        rate = float(query.get('rate', 0))
+        if count < 0 or size < 0 or rate < 0:
+            raise ValueError("parameters must not be negative")
+    except ValueError as e:
+        return bad_query(req, e)
+
+    ws = req.accept_websocket()
+    if ws is None:
+        return None
+
+    padding = 'x' * size
+    start = time.time()
+    for seq in xrange(count):
+        if rate:
+            delay = start + seq / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        head = '{} {:.3f} '.format(seq, time.time() * 1000)
+        ws.send(head + padding[len(head):])
+    ws.close(1000, 'done')
+    return None
@@ -1,27 +1,48 @@
 #!/usr/bin/env python
 
 import argparse
+import atexit
+import BaseHTTPServer
+import base64
+import binascii
+import bisect
 import collections
+import copy
 import errno
 import glob
+import hashlib
+import heapq
+import httplib
 import imp
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
 import platform
 import posixpath
+import Queue
+import random
 import re
+import select
 import shlex
+import shutil
 import SimpleHTTPServer
 import socket
 import SocketServer
 import ssl
 import string
+import struct
 import cStringIO as StringIO
 import subprocess
 import sys
+import tempfile
 import threading
 import time
 import traceback
+import types
 import urllib
+import urlparse
 
 # All files matching one of these glob patterns will be run as tests.
 TESTS = [
@@ -31,9 +52,17 @@ TESTS = [
     'regression/*.js',
 ]
 
+# With --benchmark, files matching these patterns are run instead.
+# Benchmarks use the same harness as tests, but their main product is
+# the measurements they record with record_metric().
+BENCHMARKS = [
+    'benchmarks/*.js',
+]
+
 TIMEOUT    = 7     # Maximum duration of PhantomJS execution (in seconds).
                    # This is a backstop; testharness.js imposes a shorter
                    # timeout.  Both can be increased if necessary.
+STATS_WAIT = 2     # Maximum wait for a test's requests to be recorded.
 
 #
 # Utilities
@@ -124,6 +153,61 @@ def wrap_socket_ssl(sock, base_path):
                                server_side=True,
                                ciphers=CIPHERLIST_2_7_9)
 
+# TLS configurations for the test server's extra HTTPS listeners,
+# which exist for measuring the cost of TLS setup with different keys
+# and cipher suites (TEST_HTTPS_BASE itself always uses
+# wrap_socket_ssl).  |cert| names a certificate and key pair in
+# lib/certs; all of them are self-signed for "localhost", and were made
+# with commands like
+#
+#   openssl req -x509 -newkey rsa:2048 -nodes -sha256 -days 7300 \
+#     -subj /CN=localhost -addext subjectAltName=DNS:localhost \
+#     -keyout https-rsa2048.key -out https-rsa2048.crt
+#
+# |ciphers|, if not None, is an OpenSSL cipher list; it only governs
+# TLS 1.2 and earlier, so it also turns off TLS 1.3.  With |resume|
+# false, session tickets are turned off, and every connection gets a
+# fresh SSLContext: otherwise sessions could still be resumed from the
+# context's session cache, which Python 2's ssl module cannot turn
+# off.  A resumable profile's SSLContext is made once and shared.
+class TLSProfile(object):
+    def __init__(self, name, cert, ciphers=None, resume=True):
+        self.name    = name
+        self.cert    = cert
+        self.ciphers = ciphers
+        self.resume  = resume
+
+    def context(self, base_path):
+        prefix = os.path.join(base_path, 'lib/certs', self.cert)
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ctx.load_cert_chain(prefix + '.crt', prefix + '.key')
+        if self.ciphers is not None:
+            ctx.set_ciphers(self.ciphers)
+            ctx.options |= getattr(ssl, 'OP_NO_TLSv1_3', 0)
+        if not self.resume:
+            ctx.options |= getattr(ssl, 'OP_NO_TICKET', 0)
+        return ctx
+
+    # Wraps the accepted connection |sock| for the server side, and
+    # does the handshake; |shared| is a context made by context().
+    def wrap(self, shared, sock, base_path):
+        ctx = shared if self.resume else self.context(base_path)
+        return ctx.wrap_socket(sock, server_side=True)
+
+TLS_PROFILES = [
+    TLSProfile('rsa2048',             'https-rsa2048'),
+    TLSProfile('rsa2048-noresume',    'https-rsa2048', resume=False),
+    TLSProfile('rsa4096',             'https-rsa4096'),
+    TLSProfile('rsa4096-noresume',    'https-rsa4096', resume=False),
+    TLSProfile('ecdsa-p256',          'https-ecdsa-p256'),
+    TLSProfile('ecdsa-p256-noresume', 'https-ecdsa-p256', resume=False),
+    # RSA key exchange: no forward secrecy, but no ECDHE either.
+    TLSProfile('rsa2048-rsa-kx',      'https-rsa2048',
+               ciphers='AES128-SHA:AES256-SHA'),
+    TLSProfile('rsa2048-ecdhe-gcm',   'https-rsa2048',
+               ciphers='ECDHE-RSA-AES128-GCM-SHA256'),
+]
+
 # This should be in the standard library somewhere, but as far as I
 # can tell, it isn't.
 class ResponseHookImporter(object):
@@ -133,6 +217,7 @@ class ResponseHookImporter(object):
         if 'test_www' not in sys.modules:
             imp.load_source('test_www', www_path + '/__init__.py')
 
+        self.www_path = www_path
         self.tr = string.maketrans('-./%', '____')
 
     def __call__(self, path):
@@ -140,8 +225,98 @@ class ResponseHookImporter(object):
         try:
             return sys.modules[modname]
         except KeyError:
+            self.load_packages(os.path.dirname(path))
             return imp.load_source(modname, path)
 
+    # The __init__.py of a subdirectory of www_path, if there is one,
+    # holds helpers shared by the hooks in that subdirectory, which
+    # import them from "test_www.<subdirectory>".
+    def load_packages(self, dirpath):
+        rel = os.path.relpath(dirpath, self.www_path)
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return
+        parts = rel.split(os.sep)
+        for i in range(1, len(parts) + 1):
+            modname = '.'.join(['test_www'] + parts[:i])
+            init = os.path.join(self.www_path, *parts[:i] + ['__init__.py'])
+            if modname not in sys.modules and os.path.isfile(init):
+                imp.load_source(modname, init)
+
+# Python 3 has functools.lru_cache, but Python 2 doesn't.
+class LRUCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # Return the cached value for 'key', computing it with compute(key)
+    # if necessary.  'compute' is called without the lock held, so two
+    # threads may occasionally compute the same value; that's harmless.
+    def get(self, key, compute):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+                self.data[key] = value
+                return value
+            except KeyError:
+                pass
+        value = compute(key)
+        with self.lock:
+            self.data[key] = value
+            if len(self.data) > self.size:
+                self.data.popitem(last=False)
+        return value
+
+# Maps the translated path (see FileHandler.translate_path) of every
+# file, directory, and response hook below www_path to what should be
+# served for it, so that requests do not have to probe the filesystem.
+# Built once, when the server starts; anything created later is still
+# found by probing, but that is not expected to happen in practice.
+class RouteTable(object):
+    FILE = 'file'
+    DIR  = 'dir'
+    HOOK = 'hook'
+
+    def __init__(self, www_path, get_response_hook):
+        self.routes = {}
+        hooks = []
+        for dirpath, dirnames, filenames in os.walk(www_path):
+            self.add(www_path, dirpath, self.DIR)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith('.py'):
+                    if name != '__init__.py':
+                        hooks.append(path)
+                elif not name.endswith('.pyc'):
+                    self.add(www_path, path, self.FILE)
+
+        # A static file takes precedence over a hook with the same name.
+        for path in hooks:
+            if self.add(www_path, path[:-3], self.HOOK, path):
+                # Import now, rather than on first use.  If this fails,
+                # it will fail again when the hook is used, and be
+                # reported then.
+                try:
+                    get_response_hook(path)
+                except Exception:
+                    pass
+
+    # URLs are case-insensitive as far as the test server is concerned,
+    # so the routes are keyed by the lowercased, quoted path.
+    def add(self, www_path, path, kind, target=None):
+        rel = os.path.relpath(path, www_path).replace(os.sep, '/')
+        key = os.path.normpath(os.path.join(www_path,
+            *urllib.quote(rel).lower().split('/')))
+        if key in self.routes:
+            return False
+        self.routes[key] = (kind, target or path)
+        return True
+
+    def lookup(self, translated_path):
+        if translated_path.endswith('/'):
+            translated_path = translated_path[:-1]
+        return self.routes.get(translated_path)
+
 # This should also be in the standard library somewhere, and
 # definitely isn't.
 #
@@ -155,7 +330,11 @@ try:
 except:
     devnull = os.open(os.devnull, os.O_RDONLY)
 
-def do_call_subprocess(command, verbose, stdin_data, timeout):
+# If |timeline| is a dict, the times at which the process was started
+# and exited are stored in it as 'spawn' and 'exit', and 'lines' is set
+# to a list of (arrival time, stream, line) for every line of output.
+def do_call_subprocess(command, verbose, stdin_data, timeout, env=None,
+                       timeline=None):
 
     def read_thread(linebuf, fp):
         while True:
@@ -164,6 +343,9 @@ def do_call_subprocess(command, verbose, stdin_data, timeout):
             line = line.rstrip()
             if line:
                 linebuf.append(line)
+                if timeline is not None:
+                    timeline['lines'].append((time.time(),
+                                              linebuf is stdout, line))
                 if verbose >= 3:
                     sys.stdout.write(line + '\n')
 
@@ -185,10 +367,14 @@ def do_call_subprocess(command, verbose, stdin_data, timeout):
     else:
         stdin = devnull
 
+    if timeline is not None:
+        timeline['lines'] = []
+        timeline['spawn'] = time.time()
     proc = subprocess.Popen(command,
                             stdin=stdin,
                             stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
+                            stderr=subprocess.PIPE,
+                            env=env)
 
     if stdin_data:
         sithrd = threading.Thread(target=write_thread,
@@ -209,6 +395,8 @@ def do_call_subprocess(command, verbose, stdin_data, timeout):
     rpthrd.start()
 
     proc.wait()
+    if timeline is not None:
+        timeline['exit'] = time.time()
     if not timed_out[0]: rpthrd.cancel()
 
     sithrd.join()
@@ -234,14 +422,790 @@ def do_call_subprocess(command, verbose, stdin_data, timeout):
 # HTTP/HTTPS server, presented on localhost to the tests
 #
 
+# Traffic shaping: the test server can be told to limit bandwidth
+# and delay the first byte of responses, to imitate a slow network.
+# Shaping parameters come from the --shape command line option, which
+# applies to every request, and from query parameters with a leading
+# double underscore (e.g. "hello.html?__latency=200"), which apply to
+# one request and are removed before the request is processed further.
+#
+#   rate     bandwidth limit, bytes per second (k, m, g suffixes allowed)
+#   burst    token bucket capacity, bytes (default: rate/10)
+#   latency  delay before the first byte of the response, milliseconds
+#   jitter   additional random first-byte delay, up to this many
+#            milliseconds; the nth request for any given URL always
+#            gets the same jitter, for a given seed
+#   seed     seed for the jitter (default 0)
+#   scope    "connection" (the default) for one token bucket per
+#            connection, "path" for one token bucket shared by all
+#            requests for the same URL
+SHAPING_PARAMS = ('rate', 'burst', 'latency', 'jitter', 'seed', 'scope')
+
+def parse_size(value):
+    m = re.match(r"^([0-9]+(?:\.[0-9]*)?)([kmg]?)$", value.lower())
+    if not m:
+        raise ValueError("invalid size {!r}".format(value))
+    return int(float(m.group(1)) * {"": 1, "k": 1<<10,
+                                    "m": 1<<20, "g": 1<<30}[m.group(2)])
+
+def parse_shaping(pairs, spec=None):
+    spec = dict(spec or {})
+    for key, value in pairs:
+        if key == 'scope':
+            if value not in ('connection', 'path'):
+                raise ValueError("scope must be 'connection' or 'path'")
+            spec[key] = value
+        elif key == 'seed':
+            spec[key] = int(value)
+        elif key in ('rate', 'burst'):
+            spec[key] = parse_size(value)
+        elif key in ('latency', 'jitter'):
+            spec[key] = float(value) / 1000
+            if spec[key] < 0:
+                raise ValueError(key + " must not be negative")
+        else:
+            raise ValueError("unknown traffic shaping parameter " + key)
+    return spec
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate   = float(rate)
+        self.burst  = burst
+        self.tokens = float(burst)
+        self.stamp  = time.time()
+        self.lock   = threading.Lock()
+
+    # Block until 'n' more bytes may be sent.  Tokens are allowed to go
+    # negative, so concurrent senders sharing a bucket queue up in
+    # order rather than competing for each refill.
+    def consume(self, n):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            deficit = -self.tokens
+        if deficit > 0:
+            time.sleep(deficit / self.rate)
+
+class ShapedWriter(object):
+    def __init__(self, fp, bucket, delay):
+        self.fp     = fp
+        self.bucket = bucket
+        self.delay  = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        if self.bucket is None:
+            self.fp.write(data)
+            return
+        step = self.bucket.burst
+        for i in xrange(0, len(data), step):
+            piece = data[i:i+step]
+            self.bucket.consume(len(piece))
+            self.fp.write(piece)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+class TrafficShaper(object):
+    def __init__(self, spec):
+        self.spec         = spec or {}
+        self.lock         = threading.Lock()
+        self.path_buckets = {}
+        self.path_counts  = collections.defaultdict(int)
+
+    # Remove shaping parameters from the query string of 'path', and
+    # return the remaining path and the effective shaping parameters.
+    # Raises ValueError if the shaping parameters are invalid.
+    def extract(self, path):
+        x = path.find('?')
+        if x == -1 or '__' not in path:
+            return path, self.spec
+
+        query = path[x+1:]
+        fragment = ''
+        y = query.find('#')
+        if y != -1:
+            query, fragment = query[:y], query[y:]
+
+        kept, pairs = [], []
+        for item in query.split('&'):
+            if item.startswith('__'):
+                key, _, value = item[2:].partition('=')
+                pairs.append((key, urllib.unquote_plus(value)))
+            else:
+                kept.append(item)
+        if not pairs:
+            return path, self.spec
+
+        path = path[:x]
+        if kept:
+            path += '?' + '&'.join(kept)
+        return path + fragment, parse_shaping(pairs, self.spec)
+
+    def first_byte_delay(self, spec, path):
+        delay = spec.get('latency', 0)
+        jitter = spec.get('jitter', 0)
+        if jitter:
+            with self.lock:
+                n = self.path_counts[path]
+                self.path_counts[path] += 1
+            seed = hashlib.sha1("{}:{}:{}".format(spec.get('seed', 0),
+                                                  path, n)).hexdigest()
+            delay += random.Random(int(seed, 16)).random() * jitter
+        return delay
+
+    def bucket(self, spec, path, conn_bucket):
+        rate = spec.get('rate')
+        if not rate:
+            return None
+        burst = spec.get('burst') or max(rate // 10, 1)
+        if spec.get('scope') == 'path':
+            with self.lock:
+                key = (path, rate, burst)
+                if key not in self.path_buckets:
+                    self.path_buckets[key] = TokenBucket(rate, burst)
+                return self.path_buckets[key]
+        if (conn_bucket is not None and conn_bucket.rate == rate and
+            conn_bucket.burst == burst):
+            return conn_bucket
+        return TokenBucket(rate, burst)
+
+# Runs callbacks at scheduled times.  One dispatcher thread waits for
+# the earliest deadline and hands expired callbacks to a small, fixed
+# pool of worker threads, so any number of pending callbacks costs no
+# threads at all.  Callbacks should be quick; anything that could take
+# a long time belongs on a thread of its own.
+class TimerQueue(object):
+    def __init__(self, workers=4):
+        self.cond    = threading.Condition()
+        self.heap    = []
+        self.counter = itertools.count()
+        self.ready   = Queue.Queue()
+        self.workers = workers
+        self.started = False
+
+    def schedule(self, delay, callback):
+        with self.cond:
+            if not self.started:
+                self.start_threads()
+            heapq.heappush(self.heap, (time.time() + delay,
+                                       next(self.counter), callback))
+            self.cond.notify()
+
+    def start_threads(self):
+        self.started = True
+        for target in [self.dispatch] + [self.work] * self.workers:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def dispatch(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.time():
+                    if self.heap:
+                        self.cond.wait(self.heap[0][0] - time.time())
+                    else:
+                        self.cond.wait()
+                _, _, callback = heapq.heappop(self.heap)
+            self.ready.put(callback)
+
+    def work(self):
+        while True:
+            self.ready.get()()
+
+# A response hook may return req.defer(delay, respond) to send its
+# response 'delay' seconds later, without occupying a server thread in
+# the meantime.  When the time comes, 'respond' is called with the
+# request object, and must do exactly what handle_request would have
+# done (including, if it likes, deferring again).
+class DeferredResponse(object):
+    def __init__(self, delay, respond):
+        self.delay   = delay
+        self.respond = respond
+
+# Response hooks may return an iterable instead of a file-like
+# object.  Each item it produces is written to the client, and flushed,
+# as soon as it is available; if the hook sent "Transfer-Encoding:
+# chunked", each item becomes one chunk.  Nothing is buffered, so
+# responses of any length (including endless ones) cost constant
+# memory.
+class StreamingBody(object):
+    def __init__(self, chunks, chunked):
+        self.chunks  = chunks
+        self.chunked = chunked
+
+    def send(self, fp):
+        for chunk in self.chunks:
+            # A zero-length chunk would terminate the body prematurely.
+            if not chunk:
+                continue
+            if self.chunked:
+                fp.write("{:x}\r\n{}\r\n".format(len(chunk), chunk))
+            else:
+                fp.write(chunk)
+            fp.flush()
+        if self.chunked:
+            fp.write("0\r\n\r\n")
+            fp.flush()
+
+    def close(self):
+        # Generators have a close method; other iterables may not.
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+# The server side of a WebSocket connection (RFC 6455), returned by
+# req.accept_websocket().  recv() returns each message from the client
+# as (opcode, data), answering pings and reassembling fragmented
+# messages along the way; it returns None once the connection has been
+# closed, after replying to the client's close frame if necessary.
+# send_frame() can send arbitrary frames, for testing the client's
+# handling of unusual ones.
+class WebSocket(object):
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    CONTINUATION = 0x0
+    TEXT         = 0x1
+    BINARY       = 0x2
+    CLOSE        = 0x8
+    PING         = 0x9
+    PONG         = 0xA
+
+    def __init__(self, rfile, wfile):
+        self.rfile      = rfile
+        self.wfile      = wfile
+        self.closed     = False
+        self.close_sent = False
+        self.close_code = None
+
+    @staticmethod
+    def unmask(mask, data):
+        # XORing two long integers is much faster than doing it a byte
+        # at a time.
+        n = len(data)
+        if n == 0:
+            return data
+        key = (mask * (n // 4 + 1))[:n]
+        x = int(binascii.hexlify(data), 16) ^ int(binascii.hexlify(key), 16)
+        return binascii.unhexlify('{:0{}x}'.format(x, 2*n))
+
+    def read_frame(self):
+        head = self.rfile.read(2)
+        if len(head) < 2:
+            return None
+        b0, b1 = struct.unpack('!BB', head)
+        n = b1 & 0x7F
+        if n == 126:
+            n, = struct.unpack('!H', self.rfile.read(2))
+        elif n == 127:
+            n, = struct.unpack('!Q', self.rfile.read(8))
+        mask = self.rfile.read(4) if b1 & 0x80 else None
+        payload = self.rfile.read(n)
+        if len(payload) < n:
+            return None
+        if mask:
+            payload = self.unmask(mask, payload)
+        return bool(b0 & 0x80), b0 & 0x0F, payload
+
+    def send_frame(self, opcode, payload, fin=True):
+        b0 = (0x80 if fin else 0) | opcode
+        n = len(payload)
+        if n < 126:
+            head = struct.pack('!BB', b0, n)
+        elif n < 65536:
+            head = struct.pack('!BBH', b0, 126, n)
+        else:
+            head = struct.pack('!BBQ', b0, 127, n)
+        self.wfile.write(head + payload)
+        self.wfile.flush()
+        if opcode == self.CLOSE:
+            self.close_sent = True
+
+    def send(self, data, binary=False):
+        self.send_frame(self.BINARY if binary else self.TEXT, data)
+
+    def recv(self):
+        parts = []
+        message_opcode = None
+        while not self.closed:
+            frame = self.read_frame()
+            if frame is None:
+                self.closed = True
+                break
+            fin, opcode, payload = frame
+            if opcode == self.PING:
+                self.send_frame(self.PONG, payload)
+            elif opcode == self.CLOSE:
+                if len(payload) >= 2:
+                    self.close_code, = struct.unpack('!H', payload[:2])
+                if not self.close_sent:
+                    self.send_frame(self.CLOSE, payload[:2])
+                self.closed = True
+            elif opcode != self.PONG:
+                if opcode != self.CONTINUATION:
+                    message_opcode = opcode
+                parts.append(payload)
+                if fin:
+                    return message_opcode, ''.join(parts)
+        return None
+
+    # Start the closing handshake, and wait for the client to finish it.
+    # Messages received in the meantime are discarded.
+    def close(self, code=1000, reason=''):
+        if not self.close_sent:
+            self.send_frame(self.CLOSE, struct.pack('!H', code) + reason)
+        while self.recv() is not None:
+            pass
+
+# The body of a POST request, as a file-like object.  The body is read
+# from the connection only as the response hook asks for it, so that
+# uploads of any size can be handled in constant memory.  Both
+# Content-Length-delimited and chunked bodies are supported; 'length'
+# is None for the latter.
+class RequestBody(object):
+    def __init__(self, rfile, length):
+        self.rfile      = rfile
+        self.chunked    = length is None
+        self.remaining  = length or 0
+        self.eof        = length == 0
+        self.bytes_read = 0
+
+    def next_chunk(self):
+        line = self.rfile.readline(1024)
+        try:
+            size = int(line.split(';', 1)[0].strip(), 16)
+        except ValueError:
+            if not line:
+                raise socket.error(errno.ECONNRESET,
+                                   'request body truncated')
+            raise ValueError('invalid chunk size line: {!r}'.format(line))
+        if size == 0:
+            # Discard any trailers.
+            while self.rfile.readline(65537) not in ('\r\n', '\n', ''):
+                pass
+            self.eof = True
+        self.remaining = size
+
+    def read(self, size=-1):
+        parts = []
+        while not self.eof and size != 0:
+            if self.remaining == 0:
+                self.next_chunk()
+                continue
+            n = self.remaining if size < 0 else min(size, self.remaining)
+            data = self.rfile.read(n)
+            if not data:
+                raise socket.error(errno.ECONNRESET,
+                                   'request body truncated')
+            parts.append(data)
+            self.remaining  -= len(data)
+            self.bytes_read += len(data)
+            if size > 0:
+                size -= len(data)
+            if self.remaining == 0:
+                if self.chunked:
+                    self.rfile.readline(3)
+                else:
+                    self.eof = True
+        return ''.join(parts)
+
+    def __iter__(self):
+        while True:
+            block = self.read(65536)
+            if not block:
+                return
+            yield block
+
+    # Read and throw away up to 'limit' bytes of whatever the response
+    # hook did not read.  Returns True if that reached the end of the
+    # body, so that the connection can be reused.
+    def discard(self, limit):
+        while not self.eof and limit > 0:
+            limit -= len(self.read(min(limit, 65536)))
+        return self.eof
+
+# Per-test request statistics.  Tests run one at a time, and the test
+# runner calls set_test() with each test's tag as it starts it (and
+# with the empty tag once it is done); requests are filed under the
+# tag of the test running when they begin, unless they carry an
+# X-Test-Tag header naming another.  For each tag, this counts requests,
+# bytes received and sent, and response status codes, and keeps a
+# histogram of the time from the end of the request headers to the
+# last byte of the response.  If |spans| is a list (see --trace), each
+# request's start time, method, path, and server process and thread are
+# also appended to it.
+#
+# A request is counted only once its response is complete, which may
+# be after the client has received all of it.  So that a test's
+# requests are not missed, or counted against the next test, begin() is
+# called as each request starts, and get() can wait for all of a tag's
+# requests to be recorded.
+class ServerStats(object):
+    # Upper bounds of the latency histogram buckets, in milliseconds.
+    # The last bucket is unbounded.
+    LATENCY_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.lock    = threading.Condition()
+        self.tags    = {}
+        self.pending = collections.defaultdict(int)
+        self.spans    = None
+        self.test     = ''
+        self.channels = []
+
+    # Waits for the server subprocesses, if any, to pass on everything
+    # they have sent so far; see ServerChannel.
+    def sync(self):
+        for channel in list(self.channels):
+            channel.sync()
+
+    def set_test(self, tag):
+        self.sync()
+        with self.lock:
+            self.test = tag
+
+    @classmethod
+    def empty(cls):
+        return {
+            'requests':  0,
+            'bytes_in':  0,
+            'bytes_out': 0,
+            'status':    {},
+            'latency': {
+                'total':     0.0,
+                'max':       0.0,
+                'bounds':    list(cls.LATENCY_BOUNDS),
+                'histogram': [0] * (len(cls.LATENCY_BOUNDS) + 1),
+            },
+        }
+
+    # Called as each request starts, with the tag from its X-Test-Tag
+    # header, if any.  Returns the tag the request is filed under,
+    # which must be passed on to record().  (A ServerChannel returns
+    # an id instead.)
+    def begin(self, tag):
+        with self.lock:
+            tag = tag or self.test
+            self.pending[tag] += 1
+            return tag
+
+    # Records a request that begin() was called for.  If |status| is
+    # None, the request is not counted (for instance, requests for
+    # /__stats).
+    def record(self, tag, status, bytes_in, bytes_out, latency, span=None):
+        latency *= 1000
+        bucket = bisect.bisect_left(self.LATENCY_BOUNDS, latency)
+        with self.lock:
+            if self.pending[tag] > 0:
+                self.pending[tag] -= 1
+                self.lock.notify_all()
+            if status is None:
+                return
+            st = self.tags.get(tag)
+            if st is None:
+                st = self.tags[tag] = self.empty()
+            st['requests']  += 1
+            st['bytes_in']  += bytes_in
+            st['bytes_out'] += bytes_out
+            status = str(status)
+            st['status'][status] = st['status'].get(status, 0) + 1
+            lat = st['latency']
+            lat['total'] += latency
+            lat['max'] = max(lat['max'], latency)
+            lat['histogram'][bucket] += 1
+            if self.spans is not None and span is not None:
+                self.spans.append([tag, status, latency] + list(span))
+
+    # Returns the statistics for 'tag' (or, if it is empty, for the
+    # test now running), and optionally resets them.  Waits up to
+    # 'wait' seconds for requests still in progress.
+    def get(self, tag, reset=False, wait=0):
+        deadline = time.time() + wait
+        with self.lock:
+            tag = tag or self.test
+            while self.pending[tag] > 0 and time.time() < deadline:
+                self.lock.wait(deadline - time.time())
+            if reset:
+                st = self.tags.pop(tag, None)
+            else:
+                st = copy.deepcopy(self.tags.get(tag))
+        return st or self.empty()
+
+# Counts the bytes written to a file.
+class CountingWriter(object):
+    def __init__(self, fp):
+        self.fp    = fp
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        self.fp.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
 class FileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
 
+    # HTTP/1.1 is required for chunked responses.  It also permits
+    # persistent connections, so end_headers() below makes sure that
+    # every response whose length is not otherwise delimited closes
+    # the connection.
+    protocol_version = 'HTTP/1.1'
+
+    # The status line and each header go out in separate writes; with
+    # Nagle's algorithm on, the client's delayed ACK of the first of
+    # them would hold up the rest by tens of milliseconds, on every
+    # request on a persistent connection.
+    disable_nagle_algorithm = True
+
+    # Translated paths, shared by all handlers; see translate_path.
+    translated_paths = LRUCache(4096)
+
     def __init__(self, *args, **kwargs):
-        self._cached_untranslated_path = None
-        self._cached_translated_path = None
-        self.postdata = None
+        self._body_delimited = False
+        self._chunked = False
+        self._conn_bucket = None
+        self.deferred = False
+        self.pending_deferral = None
+        self.body = None
+        self._postdata = None
+        self.stats_start = None
         super(FileHandler, self).__init__(*args, **kwargs)
 
+    def setup(self):
+        super(FileHandler, self).setup()
+        self.wfile = CountingWriter(self.wfile)
+        self.unshaped_wfile = self.wfile
+
+    # One handler object may process several requests on a persistent
+    # connection, so per-request state must be reset for each.
+    def handle_one_request(self):
+        self.body = None
+        self._postdata = None
+        self.stats_start = None
+        try:
+            super(FileHandler, self).handle_one_request()
+        finally:
+            self.wfile = self.unshaped_wfile
+            if not self.deferred:
+                self.finish_body()
+                self.record_stats()
+
+    # If the response hook left part of the request body unread, the
+    # connection can only be reused if the rest is small enough to skip.
+    def finish_body(self):
+        if self.body is not None and not self.close_connection:
+            try:
+                if not self.body.discard(1024 * 1024):
+                    self.close_connection = 1
+            except (socket.error, ValueError):
+                self.close_connection = 1
+
+    # The entire request body, as a string, for response hooks that
+    # do not need to stream it.
+    @property
+    def postdata(self):
+        if self.body is None:
+            return None
+        if self._postdata is None:
+            self._postdata = self.body.read()
+        return self._postdata
+
+    # Called after the request line and headers have been read.
+    def parse_request(self):
+        if not super(FileHandler, self).parse_request():
+            return False
+
+        self.stats_start = time.time()
+        self.stats_status = None
+        self.stats_bytes_in = (len(self.raw_requestline) +
+                               sum(len(h) for h in self.headers.headers) + 2)
+        self.unshaped_wfile.count = 0
+
+        self.stats_tag = self.headers.get('x-test-tag', '')
+        self.stats_key = self.stats.begin(self.stats_tag)
+        return True
+
+    def record_stats(self):
+        if self.stats_start is None:
+            return
+        self.stats.record(self.stats_key,
+                          self.stats_status,
+                          self.stats_bytes_in +
+                              (self.body.bytes_read if self.body else 0),
+                          self.unshaped_wfile.count,
+                          time.time() - self.stats_start,
+                          (self.stats_start, self.command, self.path,
+                           os.getpid(),
+                           threading.current_thread().name))
+        self.stats_start = None
+
+    # GET /__stats returns the statistics for this request's tag (or,
+    # with ?tag=T, for tag T) as JSON; with ?reset=1, it also resets
+    # them.  Requests for /__stats are not themselves counted.
+    def send_stats(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        tag = query.get('tag', [self.stats_tag])[0]
+        reset = query.get('reset', ['0'])[0] not in ('', '0')
+        body = json.dumps(self.stats.get(tag, reset), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.stats_status = None
+        return StringIO.StringIO(body)
+
+    # Apply traffic shaping, if any, to the response to this request.
+    # Returns False, after sending an error response, if the shaping
+    # parameters were invalid.
+    def apply_shaping(self):
+        try:
+            self.path, spec = self.shaper.extract(self.path)
+        except ValueError as e:
+            self.send_error(400, 'Invalid traffic shaping: ' + str(e))
+            return False
+        if spec:
+            delay = self.shaper.first_byte_delay(spec, self.path)
+            bucket = self.shaper.bucket(spec, self.path, self._conn_bucket)
+            if bucket is not None and spec.get('scope') != 'path':
+                self._conn_bucket = bucket
+            self.wfile = ShapedWriter(self.unshaped_wfile, bucket, delay)
+        return True
+
+    def send_response(self, code, message=None):
+        self._body_delimited = code < 200 or code in (204, 304)
+        self._chunked = False
+        self.stats_status = code
+        super(FileHandler, self).send_response(code, message)
+
+    def send_header(self, keyword, value):
+        keyword_l = keyword.lower()
+        if keyword_l == 'content-length':
+            self._body_delimited = True
+        elif keyword_l == 'transfer-encoding' and value.lower() == 'chunked':
+            # HTTP/1.0 clients do not understand chunked encoding;
+            # they get the raw body, delimited by closing the connection.
+            if self.request_version < 'HTTP/1.1':
+                return
+            self._body_delimited = True
+            self._chunked = True
+        super(FileHandler, self).send_header(keyword, value)
+
+    def end_headers(self):
+        # A deferred response always ends the connection; see below.
+        if not self._body_delimited or self.deferred:
+            self.send_header('Connection', 'close')
+        super(FileHandler, self).end_headers()
+
+    def defer(self, delay, respond):
+        return DeferredResponse(delay, respond)
+
+    # For response hooks: complete a WebSocket handshake and return a
+    # WebSocket object.  The hook should carry on the conversation
+    # and then return None.  If the request was not a WebSocket
+    # upgrade, this sends an error response and returns None.
+    def accept_websocket(self):
+        key = self.headers.get('sec-websocket-key')
+        if self.headers.get('upgrade', '').lower() != 'websocket' or not key:
+            self.send_error(400, 'Expected WebSocket upgrade')
+            return None
+        accept = base64.b64encode(
+            hashlib.sha1(key.strip() + WebSocket.GUID).digest())
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = 1
+        return WebSocket(self.rfile, self.wfile)
+
+    # Deferred responses: the connection is detached from the server
+    # thread that accepted it, which then goes away.  When the time
+    # comes, a TimerQueue worker produces the response, and the body
+    # is sent, and the connection closed, from a new thread of the
+    # request's own, so that a long or slow body cannot hold up other
+    # deferred responses.  The timer is not started until the
+    # accepting thread is entirely done with this object (see finish),
+    # to avoid racing with it.
+    def defer_response(self, deferral, name):
+        if not self.deferred:
+            self.deferred = True
+            self.close_connection = 1
+            self.server.detach_request(self.request)
+        self.pending_deferral = (deferral, self.wfile, name)
+
+    def complete_deferred(self, respond, wfile, name):
+        self.wfile = wfile
+        body = None
+        try:
+            body = self.call_response_hook(name, lambda: respond(self))
+            if isinstance(body, DeferredResponse):
+                self.defer_response(body, name)
+                body = None
+        except:
+            self.server.handle_error(self.request, self.client_address)
+        if body is None:
+            self.end_deferred()
+            return
+        thread = threading.Thread(target=self.send_deferred_body,
+                                  args=(body,))
+        thread.daemon = True
+        thread.start()
+
+    def send_deferred_body(self, body):
+        try:
+            try:
+                if self.command != 'HEAD':
+                    self.copyfile(body, self.wfile)
+            finally:
+                body.close()
+        except:
+            self.server.handle_error(self.request, self.client_address)
+        finally:
+            self.end_deferred()
+
+    def end_deferred(self):
+        self.wfile = self.unshaped_wfile
+        rescheduled = self.pending_deferral is not None
+        if not rescheduled:
+            self.record_stats()
+        self.finish()
+        if not rescheduled:
+            self.server.release_request(self.request)
+
+    def finish(self):
+        if self.pending_deferral is not None:
+            deferral, wfile, name = self.pending_deferral
+            self.pending_deferral = None
+            self.timers.schedule(deferral.delay,
+                lambda: self.complete_deferred(deferral.respond, wfile, name))
+            return
+        super(FileHandler, self).finish()
+
+    def call_response_hook(self, name, hook):
+        try:
+            body = hook()
+        except:
+            self.send_error(500, 'Internal Server Error in ' + name)
+            raise
+        if (body is not None and not hasattr(body, 'read') and
+            not isinstance(body, DeferredResponse)):
+            body = StreamingBody(body, self._chunked)
+        return body
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, StreamingBody):
+            source.send(outputfile)
+        else:
+            super(FileHandler, self).copyfile(source, outputfile)
+
     def log_message(self, format, *args):
         if self.verbose >= 3:
             sys.stdout.write("## " +
@@ -250,26 +1214,41 @@ class FileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
                              "\n")
             sys.stdout.flush()
 
-    # accept POSTs, read the postdata and stash it in an instance variable,
-    # then forward to do_GET; handle_request hooks can vary their behavior
-    # based on the presence of postdata and/or the command verb.
+    # accept POSTs, make the request body available as a file-like
+    # object in req.body (or all at once as a string in req.postdata),
+    # then forward to do_GET; handle_request hooks can vary their
+    # behavior based on the presence of a body and/or the command verb.
     def do_POST(self):
-        try:
-            ln = int(self.headers.get('content-length'))
-        except TypeError, ValueError:
-            self.send_response(400, 'Bad Request')
-            self.send_header('Content-Type', 'text/plain')
-            self.end_headers()
-            self.wfile.write("No or invalid Content-Length in POST (%r)"
-                             % self.headers.get('content-length'))
-            return
-
-        self.postdata = self.rfile.read(ln)
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            length = None
+        else:
+            try:
+                length = int(self.headers.get('content-length'))
+                if length < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                self.send_response(400, 'Bad Request')
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+                self.wfile.write("No or invalid Content-Length in POST (%r)"
+                                 % self.headers.get('content-length'))
+                return
+
+        # Clients that ask permission to send the body get it at once.
+        if (self.headers.get('expect', '').lower() == '100-continue' and
+            self.request_version >= 'HTTP/1.1'):
+            self.wfile.write(self.protocol_version + ' 100 Continue\r\n\r\n')
+
+        self.body = RequestBody(self.rfile, length)
         self.do_GET()
 
     # allow provision of a .py file that will be interpreted to
     # produce the response.
     def send_head(self):
+        if self.path == '/__stats' or self.path.startswith('/__stats?'):
+            return self.send_stats()
+        if not self.apply_shaping():
+            return None
         path = self.translate_path(self.path)
 
         if self.verbose >= 3:
@@ -287,35 +1266,67 @@ class FileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
             self.send_error(404, 'File not found')
             return None
 
-        if os.path.exists(path):
+        route = self.routes.lookup(path)
+        if route is None:
+            if os.path.exists(path):
+                route = (RouteTable.DIR if os.path.isdir(path)
+                         else RouteTable.FILE, path)
+            elif os.path.exists(path + '.py'):
+                route = (RouteTable.HOOK, path + '.py')
+            else:
+                self.send_error(404, 'File not found')
+                return None
+
+        kind, target = route
+        if kind == RouteTable.DIR:
             return super(FileHandler, self).send_head()
 
-        py = path + '.py'
-        if os.path.exists(py):
-            try:
-                mod = self.get_response_hook(py)
-                return mod.handle_request(self)
-            except:
-                self.send_error(500, 'Internal Server Error in '+py)
-                raise
+        if path.endswith('/'):
+            self.send_error(404, 'File not found')
+            return None
 
-        self.send_error(404, 'File not found')
-        return None
+        if kind == RouteTable.FILE:
+            return self.send_file(target)
+
+        body = self.call_response_hook(target,
+            lambda: self.get_response_hook(target).handle_request(self))
+        if isinstance(body, DeferredResponse):
+            self.defer_response(body, target)
+            return None
+        return body
+
+    # Equivalent to the regular-file case of SimpleHTTPRequestHandler's
+    # send_head, but without translating the path again or checking
+    # whether it is a directory.
+    def send_file(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, 'File not found')
+            return None
+        try:
+            fs = os.fstat(f.fileno())
+            self.send_response(200)
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Length', str(fs.st_size))
+            self.send_header('Last-Modified',
+                             self.date_time_string(fs.st_mtime))
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
 
     # modified version of SimpleHTTPRequestHandler's translate_path
     # to resolve the URL relative to the www/ directory
     # (e.g. /foo -> test/www/foo)
     def translate_path(self, path):
+        # Cache for efficiency: the same URLs are requested over and
+        # over, and for directories, our send_head calls this and then
+        # the parent class's send_head immediately calls it again.
+        return self.translated_paths.get(path, self.do_translate_path)
 
-        # Cache for efficiency, since our send_head calls this and
-        # then, in the normal case, the parent class's send_head
-        # immediately calls it again.
-        if (self._cached_translated_path is not None and
-            self._cached_untranslated_path == path):
-            return self._cached_translated_path
-
-        orig_path = path
-
+    def do_translate_path(self, path):
         # Strip query string and/or fragment, if present.
         x = path.find('?')
         if x != -1: path = path[:x]
@@ -347,21 +1358,75 @@ class FileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
             # it must be a '/' even on Windows
             path += '/'
 
-        self._cached_untranslated_path = orig_path
-        self._cached_translated_path = path
         return path
 
 class TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    # Persistent connections can outlive the test that opened them;
+    # they must not keep the test runner from exiting.
+    daemon_threads = True
+
+    # The default listen backlog of 5 is much too small for load tests.
+    request_queue_size = socket.SOMAXCONN
+
     # This is how you are officially supposed to set SO_REUSEADDR per
     # https://docs.python.org/2/library/socketserver.html#SocketServer.BaseServer.allow_reuse_address
     allow_reuse_address = True
 
-    def __init__(self, use_ssl, handler, base_path, signal_error):
-        SocketServer.TCPServer.__init__(self, ('localhost', 0), handler)
-        if use_ssl:
+    def __init__(self, use_ssl, handler, base_path, signal_error,
+                 port=0, reuse_port=False, tls_profile=None):
+        self.reuse_port = reuse_port
+        SocketServer.TCPServer.__init__(self, ('localhost', port), handler)
+        self.base_path = base_path
+        self.tls_profile = tls_profile
+        if tls_profile is not None:
+            self.tls_context = tls_profile.context(base_path)
+        elif use_ssl:
             self.socket = wrap_socket_ssl(self.socket, base_path)
         self._signal_error = signal_error
-        self.is_ssl = use_ssl
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        self.is_ssl = use_ssl or tls_profile is not None
+
+    # With a TLSProfile, connections are wrapped, and the handshake
+    # done, in each connection's own thread rather than in the thread
+    # that accepts them (as a wrapped listening socket would), so that
+    # a slow client cannot hold up everyone else's.
+    def process_request_thread(self, request, client_address):
+        if self.tls_profile is not None:
+            try:
+                request = self.tls_profile.wrap(self.tls_context, request,
+                                                self.base_path)
+            except (ssl.SSLError, socket.error):
+                # As with a wrapped listening socket, the connection
+                # is dropped.
+                self.shutdown_request(request)
+                return
+        SocketServer.ThreadingMixIn.process_request_thread(
+            self, request, client_address)
+
+    # With reuse_port, several processes can listen on the same port;
+    # see HTTPTestServer.
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        SocketServer.TCPServer.server_bind(self)
+
+    # Connections with deferred responses outlive the thread that
+    # accepted them; they are closed by release_request instead.
+    def detach_request(self, request):
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def release_request(self, request):
+        with self._detached_lock:
+            self._detached.discard(request)
+        SocketServer.TCPServer.shutdown_request(self, request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                return
+        SocketServer.TCPServer.shutdown_request(self, request)
 
     def handle_error(self, request, client_address):
         # Ignore errors which can occur naturally if the client
@@ -375,14 +1440,193 @@ class TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
         # Otherwise, report the error to the test runner.
         self._signal_error(sys.exc_info())
 
+# Errors in server subprocesses (see HTTPTestServer) are reported to
+# the test runner as instances of this exception, which carry the
+# already-formatted traceback and message of the original error.
+class RemoteServerError(Exception):
+    def __init__(self, message, tb_lines):
+        Exception.__init__(self, message)
+        self.message_line = message
+        self.tb_lines     = tb_lines
+
+# Server subprocesses report errors and request statistics to the main
+# process over a socket, one JSON message per line.  In the subprocess,
+# a ServerChannel stands in for both the signal_error callback and the
+# ServerStats object; in the main process, serve() relays its messages
+# to the real ones.
+#
+# So that handler threads never wait on the main process, the
+# subprocess sends everything but get one way: messages are queued,
+# and a writer thread sends whatever has been queued in one write.
+# begin gives each request an id, which the main process maps to the
+# tag it files the request under.  Instead of acknowledging each
+# message, the main process calls sync(), which sends a sync message
+# and waits for the "synced" reply; the subprocess queues that behind
+# everything it has already queued, so once it arrives, all of those
+# messages have been processed.  ServerStats.set_test() syncs every
+# subprocess, and so does each get from a subprocess before answering.
+class ServerChannel(object):
+    # Maximum wait for a subprocess to answer a sync, in seconds.
+    SYNC_TIMEOUT = 5
+
+    def __init__(self, sock):
+        self.sock    = sock
+        self.rfile   = sock.makefile('rb')
+        self.wfile   = sock.makefile('wb', 0)
+        self.lock    = threading.Condition()
+        self.outbox  = []
+        self.next_id = 0
+        self.replies = {}
+        self.synced  = 0
+        self.closed  = False
+
+    #
+    # In the subprocess.
+    #
+
+    def send(self, message):
+        with self.lock:
+            self.outbox.append(json.dumps(message) + "\n")
+            self.lock.notify_all()
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    # Starts the threads that write queued messages and read replies.
+    def start(self):
+        for target in (self.run_writer, self.run_reader):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def run_writer(self):
+        while True:
+            with self.lock:
+                while not self.outbox:
+                    self.lock.wait()
+                batch = ''.join(self.outbox)
+                self.outbox = []
+            self.wfile.write(batch)
+
+    def run_reader(self):
+        for line in iter(self.rfile.readline, ''):
+            message = json.loads(line)
+            if message['op'] == 'sync':
+                self.send({'op': 'synced'})
+            elif message['op'] == 'reply':
+                with self.lock:
+                    self.replies[message['id']] = message['value']
+                    self.lock.notify_all()
+
+    def signal_error(self, exc_info):
+        ty, val, tb = exc_info
+        self.send({
+            'op':        'error',
+            'message':   traceback.format_exception_only(ty, val)[-1],
+            'traceback': traceback.format_tb(tb, 5),
+        })
+
+    def begin(self, tag):
+        request_id = self.new_id()
+        self.send({'op': 'begin', 'id': request_id, 'tag': tag})
+        return request_id
+
+    def record(self, request_id, *args):
+        self.send({'op': 'record', 'id': request_id, 'args': args})
+
+    def get(self, tag, reset=False, wait=0):
+        call_id = self.new_id()
+        self.send({'op': 'get', 'id': call_id, 'tag': tag, 'reset': reset,
+                   'wait': wait})
+        with self.lock:
+            while call_id not in self.replies:
+                self.lock.wait()
+            return self.replies.pop(call_id)
+
+    #
+    # In the main process.
+    #
+
+    def write(self, message):
+        with self.lock:
+            self.wfile.write(json.dumps(message) + "\n")
+
+    def sync(self):
+        deadline = time.time() + self.SYNC_TIMEOUT
+        with self.lock:
+            if self.closed:
+                return
+            target = self.synced + 1
+            self.wfile.write(json.dumps({'op': 'sync'}) + "\n")
+            while (self.synced < target and not self.closed and
+                   time.time() < deadline):
+                self.lock.wait(deadline - time.time())
+
+    def serve(self, stats, signal_error):
+        tags = {}
+        for line in iter(self.rfile.readline, ''):
+            message = json.loads(line)
+            op = message['op']
+            if op == 'begin':
+                tags[message['id']] = stats.begin(message['tag'])
+            elif op == 'record':
+                stats.record(tags.pop(message['id']), *message['args'])
+            elif op == 'get':
+                # Answered in a thread of its own, since syncing waits
+                # for this thread, among others.
+                thread = threading.Thread(target=self.answer_get,
+                                          args=(stats, message))
+                thread.daemon = True
+                thread.start()
+            elif op == 'synced':
+                with self.lock:
+                    self.synced += 1
+                    self.lock.notify_all()
+            elif op == 'error':
+                signal_error((RemoteServerError,
+                              RemoteServerError(message['message'],
+                                                message['traceback']),
+                              None))
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def answer_get(self, stats, message):
+        stats.sync()
+        self.write({'op': 'reply', 'id': message['id'],
+                    'value': stats.get(message['tag'], message['reset'],
+                                       message['wait'])})
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+# The HTTP and HTTPS test servers.  Normally they run in threads of the
+# test runner process, but Python can only use one CPU at a time, so
+# with processes > 1, additional copies of the servers are forked off.
+# All of the copies listen on the same two ports (using SO_REUSEPORT),
+# and the kernel distributes incoming connections among them, so tests
+# still see just one TEST_HTTP_BASE and one TEST_HTTPS_BASE.
 class HTTPTestServer(object):
-    def __init__(self, base_path, signal_error, verbose):
+    def __init__(self, base_path, signal_error, verbose, shaping=None,
+                 stats=None, processes=1):
         self.httpd        = None
         self.httpsd       = None
         self.base_path    = base_path
         self.www_path     = os.path.join(base_path, 'lib/www')
         self.signal_error = signal_error
         self.verbose      = verbose
+        self.shaping      = shaping
+        self.stats        = stats or ServerStats()
+        self.processes    = processes
+        self.children     = []
+        self.channels     = []
+        self.relays       = []
+        self.exit_pipe    = None
+        self.tls_servers  = []
 
     def __enter__(self):
         handler = FileHandler
@@ -395,37 +1639,1371 @@ class HTTPTestServer(object):
         })
         handler.www_path = self.www_path
         handler.get_response_hook = ResponseHookImporter(self.www_path)
+        handler.routes = RouteTable(self.www_path, handler.get_response_hook)
+        handler.shaper = TrafficShaper(self.shaping)
+        handler.timers = TimerQueue()
+        handler.stats = self.stats
         handler.verbose = self.verbose
 
+        reuse_port = self.processes > 1
         self.httpd  = TCPServer(False, handler,
-                                self.base_path, self.signal_error)
+                                self.base_path, self.signal_error,
+                                reuse_port=reuse_port)
+        self.httpsd = TCPServer(True, handler,
+                                self.base_path, self.signal_error,
+                                reuse_port=reuse_port)
+        # The extra HTTPS listeners need SSLContext (Python 2.7.9).
+        if hasattr(ssl, 'SSLContext'):
+            for profile in TLS_PROFILES:
+                self.tls_servers.append(
+                    TCPServer(True, handler,
+                              self.base_path, self.signal_error,
+                              reuse_port=reuse_port, tls_profile=profile))
+
+        # The subprocesses must be forked before this process starts any
+        # threads of its own.
+        if reuse_port:
+            self.fork_servers(handler)
+
         os.environ['TEST_HTTP_BASE'] = \
             'http://localhost:{}/'.format(self.httpd.server_address[1])
-        httpd_thread = threading.Thread(target=self.httpd.serve_forever)
-        httpd_thread.daemon = True
-        httpd_thread.start()
-        if self.verbose >= 3:
-            sys.stdout.write("## HTTP server at {}\n".format(
-                os.environ['TEST_HTTP_BASE']))
-
-        self.httpsd = TCPServer(True, handler,
-                                self.base_path, self.signal_error)
         os.environ['TEST_HTTPS_BASE'] = \
             'https://localhost:{}/'.format(self.httpsd.server_address[1])
-        httpsd_thread = threading.Thread(target=self.httpsd.serve_forever)
-        httpsd_thread.daemon = True
-        httpsd_thread.start()
+        os.environ['TEST_TLS_BASES'] = json.dumps(collections.OrderedDict(
+            (server.tls_profile.name,
+             'https://localhost:{}/'.format(server.server_address[1]))
+            for server in self.tls_servers))
+        for server in [self.httpd, self.httpsd] + self.tls_servers:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        for channel in self.channels:
+            thread = threading.Thread(target=channel.serve,
+                                      args=(self.stats, self.signal_error))
+            thread.daemon = True
+            thread.start()
+            self.relays.append(thread)
+            self.stats.channels.append(channel)
+
         if self.verbose >= 3:
+            sys.stdout.write("## HTTP server at {}\n".format(
+                os.environ['TEST_HTTP_BASE']))
             sys.stdout.write("## HTTPS server at {}\n".format(
                 os.environ['TEST_HTTPS_BASE']))
+            for server in self.tls_servers:
+                sys.stdout.write("## HTTPS server ({}) at port {}\n".format(
+                    server.tls_profile.name, server.server_address[1]))
+            if self.children:
+                sys.stdout.write("## {} server processes\n".format(
+                    len(self.children) + 1))
 
         return self
 
+    def fork_servers(self, handler):
+        # Subprocesses exit when the write end of this pipe is closed.
+        exit_r, self.exit_pipe = os.pipe()
+        sys.stdout.flush()
+        for _ in range(self.processes - 1):
+            parent_sock, child_sock = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    parent_sock.close()
+                    os.close(self.exit_pipe)
+                    for channel in self.channels:
+                        channel.close()
+                    self.run_server_child(handler, ServerChannel(child_sock),
+                                          exit_r)
+                    status = 0
+                finally:
+                    os._exit(status)
+
+            child_sock.close()
+            self.children.append(pid)
+            self.channels.append(ServerChannel(parent_sock))
+        os.close(exit_r)
+
+    def run_server_child(self, handler, channel, exit_r):
+        listeners = [(False, None, self.httpd), (True, None, self.httpsd)]
+        listeners.extend((True, server.tls_profile, server)
+                         for server in self.tls_servers)
+        for _, _, server in listeners:
+            server.server_close()
+        handler.stats = channel
+        channel.start()
+        handler.timers = TimerQueue()
+        for use_ssl, profile, parent_server in listeners:
+            server = TCPServer(use_ssl, handler,
+                               self.base_path, channel.signal_error,
+                               port=parent_server.server_address[1],
+                               reuse_port=True, tls_profile=profile)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        while os.read(exit_r, 1):
+            pass
+
     def __exit__(self, *dontcare):
         self.httpd.shutdown()
         del os.environ['TEST_HTTP_BASE']
         self.httpsd.shutdown()
         del os.environ['TEST_HTTPS_BASE']
+        for server in self.tls_servers:
+            server.shutdown()
+        del os.environ['TEST_TLS_BASES']
+        if self.children:
+            os.close(self.exit_pipe)
+            for pid in self.children:
+                os.waitpid(pid, 0)
+            # Once the children have exited, each channel's serve() sees
+            # the end of its input and returns; only then can the
+            # channel be closed.
+            for thread in self.relays:
+                thread.join()
+            for channel in self.channels:
+                self.stats.channels.remove(channel)
+                channel.close()
+
+#
+# Record/replay server, for benchmarking with real-world pages
+# without network access
+#
+
+# A collection of recorded responses, indexed by request method, URL,
+# and a hash of the request body.  It can be loaded directly from a
+# HAR file (for instance, one written by examples/netsniff.js), or
+# from a packed archive made from one with --pack-har.  Packed archives
+# are memory-mapped and searched in place, so even very large ones
+# load instantly.  Their layout is:
+#
+#   header   magic, entry count, offset and length of the metadata
+#   index    entry count * (SHA-1 key, data offset, data length),
+#            sorted by key
+#   data     for each response: 4-byte length of a JSON header
+#            (status, reason, headers, recorded timings), the JSON
+#            header, and the body
+#   metadata JSON: the URLs of the recorded pages
+#
+# HAR files do not always include response bodies (netsniff.js's don't);
+# missing bodies are replaced with the right number of spaces.
+class ReplayArchive(object):
+    MAGIC  = 'PJSRPLY1'
+    HEADER = struct.Struct('<8sIQI')
+    INDEX  = struct.Struct('<20sQI')
+
+    # These describe the recorded transfer, not the replayed one.
+    SKIP_HEADERS = frozenset(('content-length', 'content-encoding',
+                              'transfer-encoding', 'connection',
+                              'keep-alive'))
+
+    def __init__(self, path):
+        self.mm = None
+        self.entries = None
+        with open(path, 'rb') as f:
+            is_packed = f.read(len(self.MAGIC)) == self.MAGIC
+            f.seek(0)
+            if is_packed:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                _, self.count, meta_off, meta_len = \
+                    self.HEADER.unpack_from(self.mm, 0)
+                self.pages = json.loads(self.mm[meta_off:meta_off+meta_len])
+            else:
+                self.entries = {}
+                self.pages = self.load_har(json.load(f), self.entries)
+
+    # Requests are matched on method, URL, and body; failing that, on
+    # method and URL alone.
+    @staticmethod
+    def keys(method, url, body):
+        exact = hashlib.sha1('{} {} {}'.format(
+            method, url, hashlib.sha1(body or '').hexdigest())).digest()
+        loose = hashlib.sha1('{} {} *'.format(method, url)).digest()
+        return exact, loose
+
+    @classmethod
+    def load_har(cls, har, entries):
+        log = har['log']
+        for entry in log['entries']:
+            rq = entry['request']
+            rs = entry['response']
+            body = (rq.get('postData') or {}).get('text', '').encode('utf-8')
+            content = rs.get('content') or {}
+            text = content.get('text')
+            if text is None:
+                data = ' ' * max(content.get('size', 0), 0)
+            elif content.get('encoding') == 'base64':
+                data = base64.b64decode(text)
+            else:
+                data = text.encode('utf-8')
+            timings = entry.get('timings') or {}
+            record = (json.dumps({
+                'status':  rs['status'],
+                'reason':  rs.get('statusText') or '',
+                'headers': [(h['name'], h['value'])
+                            for h in rs.get('headers', [])
+                            if h['name'].lower() not in cls.SKIP_HEADERS],
+                'wait':    max(timings.get('wait', 0), 0),
+                'receive': max(timings.get('receive', 0), 0),
+            }), data)
+            for key in cls.keys(rq['method'], rq['url'], body):
+                entries.setdefault(key, record)
+
+        urls = set(entry['request']['url'] for entry in log['entries'])
+        return [page['id'] for page in log.get('pages', [])
+                if page.get('id') in urls]
+
+    @classmethod
+    def pack(cls, har_path, out_path):
+        entries = {}
+        with open(har_path, 'rb') as f:
+            pages = cls.load_har(json.load(f), entries)
+        keys = sorted(entries)
+        offset = cls.HEADER.size + cls.INDEX.size * len(keys)
+        index, blobs, written = [], [], {}
+        for key in keys:
+            # The exact and loose keys usually share a record.
+            record = entries[key]
+            if id(record) not in written:
+                meta, body = record
+                blob = struct.pack('<I', len(meta)) + meta + body
+                written[id(record)] = (offset, len(blob))
+                blobs.append(blob)
+                offset += len(blob)
+            index.append(cls.INDEX.pack(key, *written[id(record)]))
+        meta = json.dumps(pages)
+        with open(out_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(keys), offset, len(meta)))
+            f.writelines(index)
+            f.writelines(blobs)
+            f.write(meta)
+        return len(keys)
+
+    # Returns (metadata, body) or None.
+    def lookup(self, method, url, body):
+        for key in self.keys(method, url, body):
+            if self.entries is not None:
+                record = self.entries.get(key)
+                if record is not None:
+                    return json.loads(record[0]), record[1]
+            else:
+                record = self.lookup_packed(key)
+                if record is not None:
+                    return record
+        return None
+
+    def lookup_packed(self, key):
+        base, size = self.HEADER.size, self.INDEX.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.mm[base + mid*size : base + mid*size + 20]
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                _, off, ln = self.INDEX.unpack_from(self.mm, base + mid*size)
+                meta_len, = struct.unpack_from('<I', self.mm, off)
+                meta = json.loads(self.mm[off+4 : off+4+meta_len])
+                return meta, self.mm[off+4+meta_len : off+ln]
+        return None
+
+# Serves the responses in a ReplayArchive.  It expects to be used as
+# an HTTP proxy (phantom.setProxy), so that pages can be loaded by their
+# original URLs; HTTPS URLs work too, via CONNECT, with the test
+# server's certificate standing in for the real one (so PhantomJS must
+# be run with --ignore-ssl-errors=true).  "/__replay/pages" on any host
+# returns the list of recorded page URLs as JSON.
+class ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler, object):
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, *args, **kwargs):
+        self.tunnel_host = None
+        self.tunnel_relay = None
+        super(ReplayHandler, self).__init__(*args, **kwargs)
+
+    def setup(self):
+        super(ReplayHandler, self).setup()
+        self.rfile = RelayableFile(self.connection, 'rb', self.rbufsize)
+
+    def log_message(self, format, *args):
+        if self.verbose >= 3:
+            sys.stdout.write("## REPLAY: " + (format % args) + "\n")
+            sys.stdout.flush()
+
+    def do_CONNECT(self):
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+        self.tunnel_host = self.path
+        # The start of the client's TLS handshake may already have been
+        # read into rfile.  If so, the SSL layer reads it, and the rest
+        # of the connection, from one of a pair of sockets, with the
+        # client's connection relayed to the other.
+        sock = self.connection
+        pending = self.rfile.take_buffered()
+        if pending:
+            # (ssl can only wrap socket.socket objects, which Python 2's
+            # socketpair() does not return.)
+            sock, inner = [socket.socket(_sock=end)
+                           for end in socket.socketpair()]
+            self.tunnel_relay = threading.Thread(
+                target=self.relay_tunnel, args=(inner, pending))
+            self.tunnel_relay.daemon = True
+            self.tunnel_relay.start()
+        self.connection = wrap_socket_ssl(sock, self.base_path)
+        self.rfile = self.connection.makefile('rb', self.rbufsize)
+        self.wfile = self.connection.makefile('wb', self.wbufsize)
+
+    def relay_tunnel(self, inner, pending):
+        try:
+            inner.sendall(pending)
+            relay_sockets(inner, self.request)
+        except socket.error:
+            pass
+        finally:
+            inner.close()
+
+    # The client's connection must not be closed while the relay is
+    # still using it; shutting down this end of the pair ends it.
+    def finish(self):
+        super(ReplayHandler, self).finish()
+        if self.tunnel_relay is not None:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.tunnel_relay.join()
+
+    def replay(self):
+        ln = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(ln) if ln else ''
+
+        if self.tunnel_host is not None:
+            host = self.tunnel_host
+            if host.endswith(':443'):
+                host = host[:-4]
+            url = 'https://' + host + self.path
+        elif self.path.startswith('/'):
+            url = 'http://' + self.headers.get('host', '') + self.path
+        else:
+            url = self.path
+
+        if urlparse.urlparse(url).path == '/__replay/pages':
+            meta = {'status': 200, 'reason': 'OK', 'wait': 0, 'receive': 0,
+                    'headers': [('Content-Type', 'application/json')]}
+            record = meta, json.dumps(self.archive.pages)
+        else:
+            record = self.archive.lookup(self.command, url, body)
+            if record is None and self.command == 'HEAD':
+                record = self.archive.lookup('GET', url, body)
+        if record is None:
+            self.send_error(404, 'Not recorded: ' + url)
+            return
+        meta, data = record
+
+        body_writer = self.wfile
+        if self.use_timing:
+            time.sleep(meta['wait'] / 1000.0)
+            receive = meta['receive'] / 1000.0
+            if receive > 0 and data:
+                rate = max(len(data) / receive, 1)
+                body_writer = ShapedWriter(
+                    self.wfile, TokenBucket(rate, max(int(rate) // 10, 1)), 0)
+
+        self.send_response(meta['status'], meta['reason'] or None)
+        for name, value in meta['headers']:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            body_writer.write(data)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_OPTIONS = replay
+
+class ReplayServer(object):
+    def __init__(self, archive_path, use_timing, base_path,
+                 signal_error, verbose):
+        self.archive_path = archive_path
+        self.use_timing   = use_timing
+        self.base_path    = base_path
+        self.signal_error = signal_error
+        self.verbose      = verbose
+        self.server       = None
+
+    def __enter__(self):
+        if self.archive_path is None:
+            return self
+
+        handler = ReplayHandler
+        handler.archive    = ReplayArchive(self.archive_path)
+        handler.use_timing = self.use_timing
+        handler.base_path  = self.base_path
+        handler.verbose    = self.verbose
+
+        self.server = TCPServer(False, handler,
+                                self.base_path, self.signal_error)
+        os.environ['TEST_REPLAY_BASE'] = \
+            'http://localhost:{}/'.format(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        if self.verbose >= 3:
+            sys.stdout.write("## replay server at {} ({} pages)\n".format(
+                os.environ['TEST_REPLAY_BASE'], len(handler.archive.pages)))
+        return self
+
+    def __exit__(self, *dontcare):
+        if self.server is not None:
+            self.server.shutdown()
+            del os.environ['TEST_REPLAY_BASE']
+
+#
+# Forward proxy, for testing PhantomJS's proxy support
+#
+
+# Credentials required by the authenticating proxy; see ProxyServer.
+PROXY_USER     = 'phantom'
+PROXY_PASSWORD = 'proxy-password'
+
+# httplib refuses responses with more than 100 header lines, which
+# some servers exceed (lib/www/cookie-flood.py, for one); the proxy
+# should pass them through.  The limit is a global of httplib, read by
+# HTTPMessage.readheaders, which HTTPResponse.begin calls by way of
+# the global HTTPMessage; so the proxy's responses use copies of those
+# two methods that see different globals, and httplib itself is left
+# alone.
+def with_globals(func, **overrides):
+    return types.FunctionType(func.func_code,
+                              dict(func.func_globals, **overrides),
+                              func.func_name, func.func_defaults,
+                              func.func_closure)
+
+class ProxyMessage(httplib.HTTPMessage):
+    readheaders = with_globals(httplib.HTTPMessage.readheaders.im_func,
+                               _MAXHEADERS=100000)
+
+class ProxyResponse(httplib.HTTPResponse):
+    begin = with_globals(httplib.HTTPResponse.begin.im_func,
+                         HTTPMessage=ProxyMessage)
+
+class ProxyConnection(httplib.HTTPConnection):
+    response_class = ProxyResponse
+
+    # httplib also sends the request line and headers in pieces.
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+# A socket file whose buffered input can be taken back, so that a
+# handler can turn its connection into a relay of raw bytes (as for
+# CONNECT) without losing anything the client sent ahead.
+class RelayableFile(socket._fileobject):
+    def take_buffered(self):
+        data = self._rbuf.getvalue()
+        self._rbuf = StringIO.StringIO()
+        return data
+
+# Copies bytes between sockets |a| and |b|, both ways, until either
+# reaches end of file or neither has anything to send for |timeout|
+# seconds.
+def relay_sockets(a, b, timeout=60):
+    peer = {a: b, b: a}
+    while True:
+        readable, _, _ = select.select(list(peer), [], [], timeout)
+        if not readable:
+            return
+        for sock in readable:
+            data = sock.recv(65536)
+            if not data:
+                return
+            peer[sock].sendall(data)
+
+# Idle connections to upstream servers, kept for reuse.
+class ConnectionPool(object):
+    def __init__(self, max_idle=8):
+        self.lock     = threading.Lock()
+        self.idle     = collections.defaultdict(list)
+        self.max_idle = max_idle
+
+    # Returns a connection to host:port, and whether it was reused.
+    def get(self, host, port):
+        with self.lock:
+            conns = self.idle.get((host, port))
+            if conns:
+                return conns.pop(), True
+        return ProxyConnection(host, port, timeout=30), False
+
+    def put(self, host, port, conn):
+        with self.lock:
+            conns = self.idle[(host, port)]
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+# Counters kept by the proxy, and the overhead of each proxied request:
+# the time from receiving its request line to writing the last byte of
+# the response, minus the time spent waiting for the upstream server.
+class ProxyStats(object):
+    COUNTERS = ('client_connections', 'reused_connections', 'requests',
+                'tunnels', 'auth_failures', 'pool_hits', 'pool_misses',
+                'upstream_errors')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.overheads = []
+
+    def add(self, counter):
+        with self.lock:
+            self.counts[counter] += 1
+
+    def record_overhead(self, seconds):
+        with self.lock:
+            self.overheads.append(seconds * 1000)
+
+    def get(self, reset=False):
+        with self.lock:
+            result = dict(self.counts)
+            overheads = sorted(self.overheads)
+            if reset:
+                self.counts = dict.fromkeys(self.COUNTERS, 0)
+                self.overheads = []
+        if overheads:
+            n = len(overheads)
+            result['overhead_ms'] = {
+                'mean': sum(overheads) / n,
+                'p50':  percentile(overheads, 50),
+                'p90':  percentile(overheads, 90),
+                'max':  overheads[-1],
+            }
+        return result
+
+# An HTTP forward proxy.  Requests in absolute form ("GET http://...")
+# are forwarded upstream, over pooled persistent connections; CONNECT
+# requests open a tunnel (for HTTPS).  If the server has credentials
+# set, clients must supply them with HTTP basic authentication.
+# "GET /__proxy/stats" on the proxy itself returns its ProxyStats as
+# JSON (with ?reset=1, also resetting them).
+class ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler, object):
+    protocol_version = 'HTTP/1.1'
+
+    HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-connection',
+                            'proxy-authenticate', 'proxy-authorization',
+                            'te', 'trailer', 'transfer-encoding',
+                            'upgrade'))
+
+    # See FileHandler.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super(ProxyHandler, self).setup()
+        self.rfile = RelayableFile(self.connection, 'rb', self.rbufsize)
+        self.requests_handled = 0
+        self.stats.add('client_connections')
+
+    # Called as soon as the request line has been read.
+    def parse_request(self):
+        self.arrival = time.time()
+        return super(ProxyHandler, self).parse_request()
+
+    def log_message(self, format, *args):
+        if self.verbose >= 3:
+            sys.stdout.write("## PROXY: " + (format % args) + "\n")
+            sys.stdout.flush()
+
+    def start_request(self):
+        self.stats.add('requests')
+        self.requests_handled += 1
+        if self.requests_handled > 1:
+            self.stats.add('reused_connections')
+
+        credentials = self.server.credentials
+        if credentials is None:
+            return True
+        scheme, _, value = \
+            self.headers.get('proxy-authorization', '').partition(' ')
+        if scheme.lower() == 'basic' and value.strip() == credentials:
+            return True
+
+        self.stats.add('auth_failures')
+        self.send_response(407, 'Proxy Authentication Required')
+        self.send_header('Proxy-Authenticate', 'Basic realm="test proxy"')
+        self.send_header('Content-Length', '0')
+        if ('content-length' in self.headers or
+            'transfer-encoding' in self.headers):
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        return False
+
+    def do_CONNECT(self):
+        if not self.start_request():
+            return
+        host, _, port = self.path.rpartition(':')
+        try:
+            upstream = socket.create_connection(
+                (self.upstream_host(host), int(port)), 30)
+            upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (socket.error, ValueError) as e:
+            self.stats.add('upstream_errors')
+            self.send_error(502, 'Cannot connect to {}: {}'
+                            .format(self.path, e))
+            return
+        self.stats.add('tunnels')
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+        self.close_connection = 1
+        try:
+            self.tunnel(upstream)
+        finally:
+            upstream.close()
+
+    # Host names under .localhost always refer to this machine (RFC
+    # 6761), whether or not the system resolver knows that, so tests
+    # can use as many distinct host names as they need by going through
+    # the proxy.
+    @staticmethod
+    def upstream_host(host):
+        if host == 'localhost' or host.endswith('.localhost'):
+            return '127.0.0.1'
+        return host
+
+    def tunnel(self, upstream):
+        # Anything the client sent after the CONNECT request may already
+        # have been read into rfile.
+        pending = self.rfile.take_buffered()
+        if pending:
+            upstream.sendall(pending)
+        relay_sockets(self.connection, upstream)
+
+    def send_stats(self, query):
+        reset = urlparse.parse_qs(query).get('reset', ['0'])[0]
+        reset = reset not in ('', '0')
+        body = json.dumps(self.stats.get(reset), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def forward(self):
+        url = urlparse.urlsplit(self.path)
+        host, port = url.hostname, url.port or 80
+
+        # Requests for the proxy's statistics may arrive either directly
+        # or, from a client that is using this proxy, in absolute form.
+        if url.path == '/__proxy/stats' and (
+                not url.scheme or
+                (host in ('localhost', '127.0.0.1') and
+                 port == self.server.server_address[1])):
+            self.send_stats(url.query)
+            return
+        if not self.start_request():
+            return
+        if url.scheme != 'http' or not host:
+            self.send_error(400, 'Not a proxy request: ' + self.path)
+            return
+
+        body = None
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = RequestBody(self.rfile, None)
+        elif 'content-length' in self.headers:
+            body = RequestBody(self.rfile,
+                               int(self.headers['content-length']))
+
+        path = urlparse.urlunsplit(('', '', url.path or '/', url.query, ''))
+        host = self.upstream_host(host)
+        conn, reused = self.pool.get(host, port)
+        while True:
+            try:
+                sent = time.time()
+                self.send_upstream(conn, path, body)
+                response = conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                # A pooled connection may have been closed by the server
+                # while idle; if so, and the request can be repeated, try
+                # again with a new one.
+                if reused and (body is None or body.bytes_read == 0):
+                    conn, reused = self.pool.get(host, port)
+                    continue
+                self.stats.add('upstream_errors')
+                self.send_error(502, 'Upstream request failed: {}'.format(e))
+                return
+        upstream_time = time.time() - sent
+        self.stats.add('pool_hits' if reused else 'pool_misses')
+
+        self.send_response(response.status, response.reason)
+        for line in response.msg.headers:
+            name, _, value = line.partition(':')
+            if name.lower() not in self.HOP_BY_HOP:
+                self.send_header(name, value.strip())
+
+        has_body = not (self.command == 'HEAD' or
+                        response.status in (204, 304) or
+                        100 <= response.status < 200)
+        chunked = False
+        if has_body and response.getheader('content-length') is None:
+            if self.request_version >= 'HTTP/1.1':
+                self.send_header('Transfer-Encoding', 'chunked')
+                chunked = True
+            else:
+                self.send_header('Connection', 'close')
+        self.end_headers()
+
+        while True:
+            waited = time.time()
+            data = response.read(65536)
+            upstream_time += time.time() - waited
+            if not data:
+                break
+            if chunked:
+                self.wfile.write('{:x}\r\n{}\r\n'.format(len(data), data))
+            else:
+                self.wfile.write(data)
+        if chunked:
+            self.wfile.write('0\r\n\r\n')
+        self.stats.record_overhead(time.time() - self.arrival - upstream_time)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(host, port, conn)
+
+    def send_upstream(self, conn, path, body):
+        conn.putrequest(self.command, path,
+                        skip_host=True, skip_accept_encoding=True)
+        for line in self.headers.headers:
+            name, _, value = line.partition(':')
+            if name.lower() not in self.HOP_BY_HOP:
+                conn.putheader(name, value.strip())
+        if body is not None and body.chunked:
+            conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        if body is not None:
+            for block in body:
+                if body.chunked:
+                    block = '{:x}\r\n{}\r\n'.format(len(block), block)
+                conn.send(block)
+            if body.chunked:
+                conn.send('0\r\n\r\n')
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_OPTIONS = forward
+
+# Runs two instances of the proxy, sharing one connection pool and one
+# set of statistics: TEST_PROXY_BASE, which is open to all, and
+# TEST_PROXY_AUTH_BASE, which requires basic authentication with
+# PROXY_USER and PROXY_PASSWORD (which are included in the URL).
+class ProxyServer(object):
+    def __init__(self, base_path, signal_error, verbose):
+        self.base_path    = base_path
+        self.signal_error = signal_error
+        self.verbose      = verbose
+        self.servers      = []
+
+    def __enter__(self):
+        handler = ProxyHandler
+        handler.pool    = ConnectionPool()
+        handler.stats   = ProxyStats()
+        handler.verbose = self.verbose
+
+        for var, credentials in (
+                ('TEST_PROXY_BASE', None),
+                ('TEST_PROXY_AUTH_BASE', base64.b64encode(
+                    PROXY_USER + ':' + PROXY_PASSWORD))):
+            server = TCPServer(False, handler,
+                               self.base_path, self.signal_error)
+            server.credentials = credentials
+            userinfo = (PROXY_USER + ':' + PROXY_PASSWORD + '@'
+                        if credentials else '')
+            os.environ[var] = 'http://{}localhost:{}/'.format(
+                userinfo, server.server_address[1])
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.servers.append((var, server))
+            if self.verbose >= 3:
+                sys.stdout.write("## proxy server at {}\n".format(
+                    os.environ[var]))
+        return self
+
+    def __exit__(self, *dontcare):
+        for var, server in self.servers:
+            server.shutdown()
+            del os.environ[var]
+
+#
+# Load generator, for PhantomJS scripts that use the webserver module
+#
+
+# The |p|th percentile (0 to 100) of |sorted_values|, which must be
+# sorted; 0 if there are none.
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1,
+                             len(sorted_values) * p // 100)]
+
+# Samples the resident memory of process |pid| every |interval|
+# seconds, from /proc (so only on Linux; elsewhere there are no
+# samples).  |samples| is a list of (seconds since start, kB).
+class MemorySampler(object):
+    def __init__(self, pid, interval=0.5):
+        self.path     = '/proc/{}/status'.format(pid)
+        self.interval = interval
+        self.samples  = []
+        self.start    = time.time()
+        self.stopped  = threading.Event()
+        self.thread   = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def sample(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        kb = int(line.split()[1])
+                        self.samples.append((time.time() - self.start, kb))
+                        return kb
+        except (IOError, ValueError):
+            pass
+        return None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *dontcare):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+# Sends GET requests for |path| to localhost:|port| from |concurrency|
+# threads, each making one request at a time, for |duration| seconds.
+# With |keepalive|, each thread keeps its connection open for as long
+# as the server allows; otherwise every request asks for the
+# connection to be closed, and is made on a new one.
+class LoadGenerator(object):
+    def __init__(self, port, path, keepalive, concurrency, duration):
+        self.port        = port
+        self.path        = path
+        self.keepalive   = keepalive
+        self.concurrency = concurrency
+        self.duration    = duration
+        self.latencies   = []
+        self.errors      = 0
+        self.connections = 0
+        self.lock        = threading.Lock()
+
+    def worker(self, deadline):
+        conn = None
+        headers = {'Connection': 'keep-alive' if self.keepalive else 'close'}
+        latencies, errors, connections = [], 0, 0
+        while time.time() < deadline:
+            if conn is None:
+                conn = httplib.HTTPConnection('localhost', self.port,
+                                              timeout=30)
+                connections += 1
+            start = time.time()
+            try:
+                conn.request('GET', self.path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                errors += 1
+                conn.close()
+                conn = None
+                continue
+            latencies.append((time.time() - start) * 1000)
+            if response.status != 200:
+                errors += 1
+            if not self.keepalive or response.will_close:
+                conn.close()
+                conn = None
+        if conn is not None:
+            conn.close()
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.errors += errors
+            self.connections += connections
+
+    def run(self):
+        start = time.time()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self.worker, args=(deadline,))
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.time() - start
+        return self
+
+    def percentile(self, p):
+        return percentile(sorted(self.latencies), p)
+
+#
+# Pipe throughput, for the system module's stdin and stdout
+#
+
+# Returns the number of read and write system calls process |pid| has
+# made, from /proc (so only on Linux; elsewhere, None).
+def process_syscalls(pid):
+    try:
+        with open('/proc/{}/io'.format(pid)) as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['syscr']), int(fields['syscw'])
+    except (IOError, KeyError, ValueError):
+        return None
+
+# One run of lib/fixtures/pipe-echo.js: feeds it input from a thread,
+# and reads its output, recording when each piece arrives.
+class PipeRun(object):
+    def __init__(self, cmd):
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+        self.stdout = self.proc.stdout.fileno()
+        self.buf = ''
+        self.stderr = []
+        thread = threading.Thread(target=self.drain_stderr)
+        thread.daemon = True
+        thread.start()
+
+    def drain_stderr(self):
+        for line in iter(self.proc.stderr.readline, ''):
+            self.stderr.append(line.rstrip('\n'))
+
+    def read(self):
+        return os.read(self.stdout, 65536)
+
+    # Waits for the "ready" line; returns False if it does not come.
+    def wait_ready(self):
+        while '\n' not in self.buf:
+            data = self.read()
+            if not data:
+                return False
+            self.buf += data
+        line, _, self.buf = self.buf.partition('\n')
+        return line == 'ready'
+
+    # Writes each string produced by |chunks| to the script's stdin,
+    # from another thread, then closes it.
+    def feed(self, chunks):
+        def writer():
+            try:
+                for chunk in chunks:
+                    self.proc.stdin.write(chunk)
+            except IOError:
+                pass
+            finally:
+                try:
+                    self.proc.stdin.close()
+                except IOError:
+                    pass
+        thread = threading.Thread(target=writer)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def finish(self):
+        self.proc.stdout.close()
+        return self.proc.wait()
+
+#
+# Concurrency scaling, for sizing hosts that run many PhantomJS processes
+#
+
+# Runs |jobs| commands, no more than |concurrency| at a time; |command|
+# is called with each job's number and returns its argument list.
+# While they run, the total resident memory of all the running jobs is
+# sampled every |interval| seconds (on Linux; elsewhere, |rss_samples|
+# stays empty).  Afterward, |latencies| holds the time each job took,
+# in seconds, |failures| holds (job, exit code, output) for each job
+# that failed, and |elapsed| and |cpu| are the wall-clock and CPU time
+# (user plus system, of all the jobs together) for the whole run.
+class ProcessPool(object):
+    def __init__(self, command, jobs, concurrency, interval=0.2):
+        self.command     = command
+        self.jobs        = jobs
+        self.concurrency = concurrency
+        self.interval    = interval
+        self.lock        = threading.Lock()
+        self.next_job    = 0
+        self.running     = set()
+        self.latencies   = []
+        self.failures    = []
+        self.rss_samples = []
+        self.elapsed     = 0
+        self.cpu         = 0
+
+    def worker(self):
+        while True:
+            with self.lock:
+                job = self.next_job
+                if job >= self.jobs:
+                    return
+                self.next_job += 1
+            start = time.time()
+            proc = subprocess.Popen(self.command(job),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            with self.lock:
+                self.running.add(proc.pid)
+            output, _ = proc.communicate()
+            with self.lock:
+                self.running.discard(proc.pid)
+                self.latencies.append(time.time() - start)
+                if proc.returncode != 0:
+                    self.failures.append((job, proc.returncode, output))
+
+    def sample_rss(self, stopped):
+        while not stopped.wait(self.interval):
+            with self.lock:
+                pids = list(self.running)
+            total, seen = 0, False
+            for pid in pids:
+                try:
+                    with open('/proc/{}/status'.format(pid)) as f:
+                        for line in f:
+                            if line.startswith('VmRSS:'):
+                                total += int(line.split()[1])
+                                seen = True
+                                break
+                except (IOError, ValueError):
+                    pass
+            if seen:
+                self.rss_samples.append(total)
+
+    def run(self):
+        stopped = threading.Event()
+        sampler = threading.Thread(target=self.sample_rss, args=(stopped,))
+        sampler.daemon = True
+        workers = [threading.Thread(target=self.worker)
+                   for _ in range(self.concurrency)]
+        times = os.times()
+        start = time.time()
+        sampler.start()
+        for w in workers:
+            w.daemon = True
+            w.start()
+        for w in workers:
+            w.join()
+        self.elapsed = time.time() - start
+        stopped.set()
+        sampler.join()
+        after = os.times()
+        # os.times()[2:4] are the user and system time of children that
+        # have been waited for.
+        self.cpu = (after[2] - times[2]) + (after[3] - times[3])
+        return self
+
+#
+# Soak testing, for memory that grows with every unit of work
+#
+
+# Fields of /proc/PID/status and /proc/PID/smaps_rollup recorded by
+# the soak test.  All are in kB.
+SOAK_STATUS_FIELDS = ('VmRSS', 'VmHWM', 'VmData', 'RssAnon', 'RssFile',
+                      'VmSwap')
+SOAK_SMAPS_FIELDS  = ('Pss', 'Private_Dirty', 'Anonymous', 'Swap')
+
+# Returns the memory statistics of process |pid| that are listed
+# above, named "status.FIELD" and "smaps.FIELD", as an OrderedDict.
+# Fields the kernel doesn't provide are left out (smaps_rollup is
+# Linux 4.14 and later); on other systems, the result is empty.
+def process_memory_fields(pid):
+    fields = collections.OrderedDict()
+    for prefix, name, wanted in (('status', 'status', SOAK_STATUS_FIELDS),
+                                 ('smaps', 'smaps_rollup',
+                                  SOAK_SMAPS_FIELDS)):
+        try:
+            with open('/proc/{}/{}'.format(pid, name)) as f:
+                values = {}
+                for line in f:
+                    key, _, rest = line.partition(':')
+                    if key in wanted:
+                        values[key] = int(rest.split()[0])
+        except (IOError, ValueError, IndexError):
+            continue
+        for key in wanted:
+            if key in values:
+                fields[prefix + '.' + key] = values[key]
+    return fields
+
+# The least-squares slope of |ys| against |xs|, or None if all the
+# |xs| are the same.
+def linear_slope(xs, ys):
+    n = float(len(xs))
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    if sxx == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+
+#
+# Profilers, for --profile
+#
+
+# Each profiler wraps PhantomJS in a command that writes a profile to
+# a file, and knows how to read the hottest functions back out of that
+# file, so that they can be added up across all the tests in a run.
+# |timeout_factor| is how much slower PhantomJS runs under it.
+class Profiler(object):
+    name           = None
+    suffix         = None
+    unit           = None
+    timeout_factor = 1
+
+    # The command to run |exe| under the profiler, writing its profile
+    # to |path|.
+    def command(self, exe, path):
+        raise NotImplementedError
+
+    # The cost of each function in the profile in |path|, as a dict.
+    def hot_functions(self, path):
+        raise NotImplementedError
+
+# Valgrind writes its own messages to a log file beside the profile,
+# so that they don't get mixed up with the test's output.  PhantomJS
+# generates code at runtime, which valgrind must be told to watch for.
+def valgrind_command(tool, exe, path, *args):
+    return (["valgrind", "--tool=" + tool,
+             "--log-file=" + path + ".log",
+             "--smc-check=all-non-file"] + list(args) + [exe])
+
+class CallgrindProfiler(Profiler):
+    name           = "callgrind"
+    suffix         = ".callgrind.out"
+    unit           = "Ir"
+    timeout_factor = 50
+
+    def command(self, exe, path):
+        return valgrind_command("callgrind", exe, path,
+                                "--callgrind-out-file=" + path)
+
+    # Adds up the self cost (the first event, normally instructions
+    # executed) of each function.  See "Callgrind Format Specification"
+    # in the valgrind manual: names may be compressed to "(N)" after
+    # their first appearance, and the cost line after a "calls=" line
+    # is the inclusive cost of the call, which belongs to the callee.
+    def hot_functions(self, path):
+        costs = collections.defaultdict(int)
+        names = {}
+        npos = 1
+        fn = None
+        skip_next = False
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line[0].isdigit() or line[0] in '+-*':
+                    if skip_next:
+                        skip_next = False
+                    elif fn is not None:
+                        fields = line.split()
+                        if len(fields) > npos:
+                            costs[fn] += int(fields[npos])
+                    continue
+                key, _, value = line.partition('=')
+                if key in ('fn', 'cfn'):
+                    m = re.match(r'^\((\d+)\)(?:\s+(.*))?$', value)
+                    if m and m.group(2) is not None:
+                        names[m.group(1)] = m.group(2)
+                    if key == 'fn':
+                        fn = names.get(m.group(1)) if m else value
+                elif key == 'calls':
+                    skip_next = True
+                elif line.startswith('positions:'):
+                    npos = len(line.split()) - 1
+        return costs
+
+class MassifProfiler(Profiler):
+    name           = "massif"
+    suffix         = ".massif.out"
+    unit           = "bytes"
+    timeout_factor = 20
+
+    def command(self, exe, path):
+        return valgrind_command("massif", exe, path,
+                                "--massif-out-file=" + path)
+
+    # The heap held by each allocation site directly below the root of
+    # the peak snapshot's tree.
+    def hot_functions(self, path):
+        costs = collections.defaultdict(int)
+        in_peak = False
+        with open(path) as f:
+            for line in f:
+                if line.startswith('heap_tree='):
+                    in_peak = line.strip() == 'heap_tree=peak'
+                    continue
+                if not in_peak:
+                    continue
+                if line.startswith('snapshot='):
+                    break
+                m = re.match(r'^ n\d+: (\d+) 0x[0-9A-Fa-f]+: (.*)$', line)
+                if m:
+                    costs[m.group(2).strip()] += int(m.group(1))
+        return costs
+
+class PerfProfiler(Profiler):
+    name           = "perf"
+    suffix         = ".perf.data"
+    unit           = "samples"
+    timeout_factor = 2
+
+    def command(self, exe, path):
+        return ["perf", "record", "--quiet", "-g", "-o", path, "--", exe]
+
+    def hot_functions(self, path):
+        costs = collections.defaultdict(int)
+        report = subprocess.Popen(["perf", "report", "-i", path, "--stdio",
+                                   "--quiet", "--no-children", "-n",
+                                   "--sort", "symbol"],
+                                  stdin=devnull, stdout=subprocess.PIPE,
+                                  stderr=devnull)
+        for line in report.stdout:
+            m = re.match(r'^\s*[\d.]+%\s+(\d+)\s+\[.\]\s+(.*?)\s*$', line)
+            if m:
+                costs[m.group(2)] += int(m.group(1))
+        report.wait()
+        return costs
+
+PROFILERS = dict((cls.name, cls) for cls in
+                 (CallgrindProfiler, MassifProfiler, PerfProfiler))
+
+#
+# Timelines of whole test runs, for --trace
+#
+
+# Collects events in the Trace Event Format (as read by chrome://tracing
+# and Perfetto) and writes them out as JSON.  The test runner is one
+# process in the trace, with one lane ("thread") for the tests, which
+# run one at a time; each test server process is another, with as many
+# lanes as it had requests in progress at once.  Times are in
+# microseconds from the start of the run.
+class TraceRecorder(object):
+    def __init__(self):
+        self.start  = time.time()
+        self.pid    = os.getpid()
+        self.events = []
+        self.lanes  = {}
+        self.processes = set()
+        # (begin, end) of each test, in order; they never overlap.
+        self.tests  = []
+
+    def us(self, t):
+        return int(round((t - self.start) * 1000000))
+
+    # The thread id of the lane called |name| in process |pid|, which
+    # is created, and named in the trace, the first time it is used.
+    def lane(self, pid, name, process_name):
+        if pid not in self.processes:
+            self.processes.add(pid)
+            self.events.append({"ph": "M", "name": "process_name",
+                                "pid": pid, "tid": 0,
+                                "args": {"name": process_name}})
+        key = (pid, name)
+        if key not in self.lanes:
+            self.lanes[key] = len(self.lanes) + 1
+            self.events.append({"ph": "M", "name": "thread_name",
+                                "pid": pid, "tid": self.lanes[key],
+                                "args": {"name": name}})
+        return self.lanes[key]
+
+    def span(self, pid, tid, cat, name, begin, end, args=None):
+        event = {"ph": "X", "cat": cat, "name": name,
+                 "pid": pid, "tid": tid,
+                 "ts": self.us(begin), "dur": max(self.us(end) -
+                                                  self.us(begin), 0)}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def instant(self, pid, tid, cat, name, t, args=None):
+        event = {"ph": "i", "s": "t", "cat": cat, "name": name,
+                 "pid": pid, "tid": tid, "ts": self.us(t)}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    # A flow arrow, drawn at time |t| from whatever span encloses it
+    # on lane |from_tid| to the span beginning then on lane |to_tid|.
+    def flow(self, from_pid, from_tid, to_pid, to_tid, id, t):
+        for ph, pid, tid in (("s", from_pid, from_tid),
+                             ("f", to_pid, to_tid)):
+            self.events.append({"ph": ph, "bp": "e", "cat": "request",
+                                "name": "request", "id": id,
+                                "pid": pid, "tid": tid, "ts": self.us(t)})
+
+    # Adds one test: its whole lifetime, from |begin| to |end|; the
+    # PhantomJS process's startup, from spawning it to its first line
+    # of output; and each TAP test point, when its line arrived.
+    # |timeline| is as filled in by do_call_subprocess.
+    def add_test(self, grp, begin, end, timeline):
+        tid = self.lane(self.pid, "tests", "run-tests.py")
+        self.tests.append((begin, end))
+        self.span(self.pid, tid, "test", grp.name, begin, end,
+                  dict((t.label.strip().lower(), grp.n[t])
+                       for t in (T.PASS, T.FAIL, T.XPASS, T.XFAIL,
+                                 T.ERROR, T.SKIP) if grp.n[t]))
+        if not timeline or 'spawn' not in timeline:
+            return
+        lines = timeline['lines']
+        first = lines[0][0] if lines else timeline['exit']
+        self.span(self.pid, tid, "phantomjs", "startup",
+                  timeline['spawn'], first)
+        for t, is_stdout, line in lines:
+            if is_stdout and TAPTestGroup.test_r.match(line):
+                self.instant(self.pid, tid, "tap", line, t)
+
+    # Adds the requests recorded by ServerStats.  Each goes in the first
+    # lane of its server process that is free when it starts, with a
+    # flow arrow to it from the test running at the time, if any.  (Requests made by
+    # one test can overlap, so they cannot be nested under the test's
+    # span on its own lane.)
+    def add_requests(self, spans):
+        test_tid = self.lane(self.pid, "tests", "run-tests.py")
+        busy_until = collections.defaultdict(list)
+        for n, span in enumerate(sorted(spans, key=lambda span: span[3])):
+            tag, status, latency, start, method, path, pid, thread = span
+            end = start + latency / 1000.0
+            lanes = busy_until[pid]
+            for i, until in enumerate(lanes):
+                if until <= start:
+                    break
+            else:
+                i = len(lanes)
+                lanes.append(None)
+            lanes[i] = end
+            tid = self.lane(pid, "requests {}".format(i + 1),
+                            "test server" if pid == self.pid
+                            else "test server (process {})".format(pid))
+            self.span(pid, tid, "http", "{} {}".format(method, path),
+                      start, end, {"test": tag, "status": status,
+                                   "thread": thread})
+            i = bisect.bisect(self.tests, (start, float('inf'))) - 1
+            if i >= 0 and start <= self.tests[i][1]:
+                self.flow(self.pid, test_tid, pid, tid, n + 1, start)
+
+    def write(self, path):
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": "ms"}, fp)
+            fp.write("\n")
 
 #
 # Running tests and interpreting their results
@@ -457,14 +3035,22 @@ class TestDetail(object):
                         for chunk in message
                         for line in chunk.split("\n")]
 
-        self.dtype   = detail_type
-        self.test_id = test_id
+        self.dtype    = detail_type
+        self.test_id  = test_id
+        # Seconds attributed to this test point; see TAPTestGroup.
+        self.duration = None
 
     def report(self, fp):
         col, label = self.dtype.color, self.dtype.label
         if self.test_id:
-            fp.write("{:>5}: {}\n".format(colorize(col, label),
-                                          self.test_id))
+            if self.duration is not None:
+                fp.write("{:>5}: {} {}\n".format(
+                    colorize(col, label), self.test_id,
+                    colorize("b", "[{:.0f} ms]".format(
+                        self.duration * 1000))))
+            else:
+                fp.write("{:>5}: {}\n".format(colorize(col, label),
+                                              self.test_id))
             lo = 0
         else:
             fp.write("{:>5}: {}\n".format(colorize(col, label),
@@ -480,10 +3066,21 @@ class TestGroup(object):
        A test with zero details is considered to be successful.
     """
 
+    metric_r = re.compile(r"^## metric: (\S+) (\S+)(?: (\S+))?$")
+
     def __init__(self, name):
         self.name    = name
         self.n       = [0]*T.MAX
         self.details = []
+        self.metrics = []
+        self.server_stats = None
+        # If known, the arrival time of each line of stdout, and the
+        # time PhantomJS took from start to exit.
+        self.out_times = None
+        self.elapsed   = None
+        # (point number, description, seconds) for each test point
+        # that a duration could be attributed to.
+        self.point_times = []
 
     def parse(self, rc, out, err):
         raise NotImplementedError
@@ -499,6 +3096,17 @@ class TestGroup(object):
     def add_error(self, m, t): self._add_d(m, t, T.ERROR)
     def add_skip (self, m, t): self._add_d(m, t, T.SKIP)
 
+    def collect_metrics(self, out):
+        for line in out:
+            m = self.metric_r.match(line)
+            if m:
+                try:
+                    value = float(m.group(2))
+                except ValueError:
+                    self.add_error([line], "invalid metric value")
+                    continue
+                self.metrics.append((m.group(1), value, m.group(3) or ""))
+
     def default_interpret_exit_code(self, rc):
         if rc == 0:
             if not self.is_successful() and not self.n[T.ERROR]:
@@ -542,9 +3150,46 @@ class TestGroup(object):
             if show_all or detail.dtype not in (T.PASS, T.XFAIL, T.SKIP):
                 detail.report(fp)
                 need_blank_line = True
+        if self.metrics:
+            self.report_metrics(fp)
+            need_blank_line = True
+        if show_all and self.server_stats and self.server_stats['requests']:
+            self.report_server_stats(fp)
+            need_blank_line = True
         if need_blank_line:
             fp.write("\n")
 
+    def report_metrics(self, fp):
+        width = max(len(name) for name, _, _ in self.metrics)
+        for name, value, unit in self.metrics:
+            fp.write("  {:<{}}  {:>14.6g}{}\n".format(
+                name, width, value, " " + unit if unit else ""))
+
+    def report_server_stats(self, fp):
+        st = self.server_stats
+        fp.write("  server: {} requests, {} bytes in, {} bytes out\n".format(
+            st['requests'], st['bytes_in'], st['bytes_out']))
+        fp.write("  server: status {}\n".format(", ".join(
+            "{}x{}".format(code, n)
+            for code, n in sorted(st['status'].items()))))
+        fp.write("  server: latency mean {:.1f} ms, max {:.1f} ms\n".format(
+            st['latency']['total'] / st['requests'], st['latency']['max']))
+
+    # In benchmark mode, the server statistics are recorded along with
+    # the benchmark's own measurements.
+    def add_server_metrics(self):
+        st = self.server_stats
+        if not st or not st['requests']:
+            return
+        self.metrics.extend([
+            ("server.requests",     st['requests'], ""),
+            ("server.bytes_in",     st['bytes_in'], "bytes"),
+            ("server.bytes_out",    st['bytes_out'], "bytes"),
+            ("server.latency.mean", st['latency']['total'] / st['requests'],
+                                    "ms"),
+            ("server.latency.max",  st['latency']['max'], "ms"),
+        ])
+
     def report_for_verbose_level(self, fp, verbose):
         if verbose == 0:
             self.one_char_summary(sys.stdout)
@@ -621,6 +3266,11 @@ class TAPTestGroup(TestGroup):
     """Test group whose output is interpreted according to a variant of the
        Test Anything Protocol (http://testanything.org/tap-specification.html).
 
+       If the arrival time of each output line is known, each test
+       point is credited with the time since the line before it (the
+       plan, or the previous test point), which is roughly how long
+       that subtest took.
+
        Relative to that specification, these are the changes:
 
          * Plan-at-the-end, explanations for directives, and "Bail out!"
@@ -642,6 +3292,7 @@ class TAPTestGroup(TestGroup):
                         r"([^#]*)(?:# (TODO|SKIP))?$")
 
     def parse(self, rc, out, err):
+        self.collect_metrics(out)
         self.parse_tap(out, err)
         self.default_interpret_exit_code(rc)
 
@@ -691,6 +3342,7 @@ class TAPTestGroup(TestGroup):
             messages = []
 
         prev_point = 0
+        prev_time = self.out_times[i] if self.out_times else None
 
         for i in range(i+1, len(out)):
             line = out[i]
@@ -740,6 +3392,14 @@ class TAPTestGroup(TestGroup):
                             self.add_error(messages, desc +
                                 " [not ok, with invalid directive "+dirv+"]")
 
+                    if prev_time is not None:
+                        duration = self.out_times[i] - prev_time
+                        self.details[-1].duration = duration
+                        self.point_times.append((point, desc.strip(),
+                                                 duration))
+
+                if prev_time is not None:
+                    prev_time = self.out_times[i]
                 del messages[:]
                 prev_point = point
 
@@ -769,8 +3429,35 @@ class TestRunner(object):
         self.phantomjs_exe   = phantomjs_exe
         self.verbose         = options.verbose
         self.debugger        = options.debugger
+        self.profiler        = (PROFILERS[options.profile]()
+                                if options.profile else None)
+        self.profile_dir     = options.profile_dir
+        self.profile_top     = options.profile_top
+        self.profiles        = []
+        self.trace_path      = options.trace
+        self.trace           = None
+        self.history_path    = options.history
+        self.font_cache      = options.font_cache
+        self.unshared_font_environ = None
         self.to_run          = options.to_run
+        self.benchmark       = options.benchmark
+        self.bench_params    = options.bench_params
+        self.bench_output    = options.bench_output
+        self.shaping         = options.shape
+        self.replay          = options.replay
+        self.server_procs    = options.server_processes
+        self.replay_timing   = options.replay_timing
+        self.load_script     = options.load
+        self.load_modes      = options.load_mode
+        self.load_clients    = options.load_concurrency
+        self.load_duration   = options.load_duration
+        self.load_path       = options.load_path
+        self.pipe            = options.pipe
+        self.scaling         = options.scaling
+        self.soak            = options.soak
+        self.soak_timeline   = options.soak_timeline
         self.server_errs     = []
+        self.server_stats    = ServerStats()
         self.prepare_environ()
 
     def prepare_environ(self):
@@ -802,6 +3489,104 @@ class TestRunner(object):
         # usually written, e.g. UTC+1 would be xxx-1:00.
         os.environ["TZ"] = "CIST-12:45:00"
 
+        # Benchmark parameters are passed down as environment variables;
+        # see bench_param() in testharness.js.
+        for name, value in self.bench_params:
+            os.environ["BENCH_" + name] = value
+
+        if self.font_cache:
+            self.prepare_font_cache()
+
+    # Give all the test processes one private fontconfig configuration
+    # and cache, which prewarm_font_cache fills before the tests start,
+    # so that each of them doesn't scan the fonts for itself.  The
+    # configuration is the system's, but with the user's own fontconfig
+    # settings and caches shut out, so that font lookup depends only on
+    # the fonts installed.  (Only where Qt uses fontconfig.)
+    FONTCONFIG_TEMPLATE = """<?xml version="1.0"?>
+<!DOCTYPE fontconfig SYSTEM "fonts.dtd">
+<fontconfig>
+  <cachedir>{cache}</cachedir>
+  <include>{system}</include>
+</fontconfig>
+"""
+
+    def prepare_font_cache(self):
+        if sys.platform in ('win32', 'cygwin', 'darwin'):
+            self.font_cache = False
+            return
+        system_path = os.environ.get("FONTCONFIG_PATH", "/etc/fonts")
+        system_file = os.environ.get("FONTCONFIG_FILE",
+                                     os.path.join(system_path, "fonts.conf"))
+        # Without the system configuration, there would be no fonts.
+        if not os.path.isfile(system_file):
+            sys.stdout.write(colorize("Y", "WARNING") +
+                             ": {} not found; not sharing a font cache"
+                             " (set FONTCONFIG_FILE or FONTCONFIG_PATH to"
+                             " the system fontconfig configuration)\n"
+                             .format(system_file))
+            self.font_cache = False
+            return
+
+        # For prewarm_font_cache's comparison.
+        self.unshared_font_environ = dict(os.environ)
+
+        private = tempfile.mkdtemp(prefix="phantomjs-tests-fonts-")
+        atexit.register(shutil.rmtree, private, True)
+        for sub in ("cache", "config"):
+            os.mkdir(os.path.join(private, sub))
+        conf = os.path.join(private, "fonts.conf")
+        with open(conf, "w") as fp:
+            fp.write(self.FONTCONFIG_TEMPLATE.format(
+                cache=os.path.join(private, "cache", "fontconfig"),
+                system=system_file))
+
+        os.environ["FONTCONFIG_FILE"] = conf
+        # Relative paths in the system configuration (such as
+        # "conf.d") are resolved against FONTCONFIG_PATH.
+        os.environ["FONTCONFIG_PATH"] = system_path
+        os.environ["XDG_CACHE_HOME"] = os.path.join(private, "cache")
+        os.environ["XDG_CONFIG_HOME"] = os.path.join(private, "config")
+
+    # Run lib/fixtures/font-warmup.js to fill the shared font cache.
+    # With -v, also time it with the environment tests would have had
+    # without the shared cache, and again once the cache is full; the
+    # difference is what the shared cache saves each test.
+    def prewarm_font_cache(self):
+        if not self.font_cache:
+            return
+        script = os.path.join(self.base_path, 'lib/fixtures/font-warmup.js')
+        runs = [None]
+        if self.verbose:
+            runs = [self.unshared_font_environ, None, None]
+        times = []
+        for env in runs:
+            start = time.time()
+            rc, out, err = self.run_phantomjs(script, silent=True,
+                                              timeout=120, env=env)
+            times.append(time.time() - start)
+            if rc != 0:
+                sys.stdout.write(colorize("Y", "WARNING") +
+                                 ": could not prewarm the font cache"
+                                 " (exit {})\n".format(rc))
+                for line in out + err:
+                    sys.stdout.write(colorize("b", "## " + line) + "\n")
+                return
+        if self.verbose:
+            sys.stdout.write(colorize("b",
+                "## Font cache: startup {:.0f} ms without it, {:.0f} ms"
+                " with it (saves {:.0f} ms per test)".format(
+                    times[0] * 1000, times[2] * 1000,
+                    (times[0] - times[2]) * 1000)) + "\n")
+
+    # The value of benchmark parameter |name|, as given with --bench-param,
+    # converted to the type of |default|; or |default| if not given.
+    def bench_value(self, name, default):
+        for param, value in reversed(self.bench_params):
+            if param == name:
+                return type(default)(value)
+        return default
+
     def signal_server_error(self, exc_info):
         self.server_errs.append(exc_info)
 
@@ -817,9 +3602,12 @@ class TestRunner(object):
         else:
             raise RuntimeError("Don't know how to invoke " + self.debugger)
 
+    # With --profile, |profile| names the file (in the profile
+    # directory) that the profile of this run goes to.
     def run_phantomjs(self, script,
                       script_args=[], pjs_args=[], stdin_data=[],
-                      timeout=TIMEOUT, silent=False):
+                      timeout=TIMEOUT, silent=False, env=None,
+                      profile=None, timeline=None):
         verbose  = self.verbose
         debugger = self.debugger
         if silent:
@@ -827,7 +3615,17 @@ class TestRunner(object):
             debugger = None
 
         output = []
-        command = self.get_base_command(debugger)
+        if self.profiler and profile and not debugger:
+            path = os.path.join(self.profile_dir,
+                                profile + self.profiler.suffix)
+            command = self.profiler.command(self.phantomjs_exe, path)
+            timeout *= self.profiler.timeout_factor
+            # testharness.js stretches its own timeouts to match.
+            env = dict(os.environ if env is None else env)
+            env['TEST_TIMEOUT_FACTOR'] = str(self.profiler.timeout_factor)
+            self.profiles.append(path)
+        else:
+            command = self.get_base_command(debugger)
         command.extend(pjs_args)
         command.append(script)
         if verbose:
@@ -844,7 +3642,8 @@ class TestRunner(object):
             subprocess.call(command)
             return 0, [], []
         else:
-            return do_call_subprocess(command, verbose, stdin_data, timeout)
+            return do_call_subprocess(command, verbose, stdin_data, timeout,
+                                      env, timeline)
 
     def run_test(self, script, name):
         script_args = []
@@ -864,6 +3663,7 @@ class TestRunner(object):
             if i+1 == len(tokens):
                 raise ValueError(what + "directive requires an argument")
 
+        begin = time.time()
         if self.verbose >= 3:
             sys.stdout.write(colorize("^", name) + ":\n")
         # Parse any directives at the top of the script.
@@ -940,8 +3740,18 @@ class TestRunner(object):
         if use_snakeoil:
             pjs_args.insert(0, '--ssl-certificates-path=' + self.cert_path)
 
-        rc, out, err = self.run_phantomjs(script, script_args, pjs_args,
-                                          stdin_data, timeout)
+        # File the requests the test makes under its own tag; see
+        # ServerStats.
+        tag = name.replace('/', '.')
+        self.server_stats.set_test(tag)
+
+        timeline = {}
+        try:
+            rc, out, err = self.run_phantomjs(script, script_args, pjs_args,
+                                              stdin_data, timeout,
+                                              profile=tag, timeline=timeline)
+        finally:
+            self.server_stats.set_test('')
 
         if rc_exp or stdout_exp or stderr_exp:
             grp = ExpectTestGroup(name,
@@ -949,17 +3759,30 @@ class TestRunner(object):
                                   rc_xfail, stdout_xfail, stderr_xfail)
         else:
             grp = TAPTestGroup(name)
+        if 'spawn' in timeline:
+            grp.elapsed = timeline['exit'] - timeline['spawn']
+            grp.out_times = [t for t, is_stdout, _ in timeline['lines']
+                             if is_stdout]
         grp.parse(rc, out, err)
+        grp.server_stats = self.server_stats.get(tag, reset=True,
+                                                 wait=STATS_WAIT)
+        if self.benchmark:
+            grp.add_server_metrics()
+        if self.trace:
+            self.trace.add_test(grp, begin, time.time(), timeline)
         return grp
 
     def run_tests(self):
         start = time.time()
         base = self.base_path
         nlen = len(base) + 1
+        if self.trace_path:
+            self.trace = TraceRecorder()
+            self.server_stats.spans = []
 
         results = []
 
-        for test_glob in TESTS:
+        for test_glob in (BENCHMARKS if self.benchmark else TESTS):
             test_glob = os.path.join(base, test_glob)
 
             for test_script in sorted(glob.glob(test_glob)):
@@ -978,14 +3801,111 @@ class TestRunner(object):
 
         grp = TestGroup("HTTP server errors")
         for ty, val, tb in self.server_errs:
-            grp.add_error(traceback.format_tb(tb, 5),
-                          traceback.format_exception_only(ty, val)[-1])
+            if isinstance(val, RemoteServerError):
+                grp.add_error(val.tb_lines, val.message_line)
+            else:
+                grp.add_error(traceback.format_tb(tb, 5),
+                              traceback.format_exception_only(ty, val)[-1])
         grp.report_for_verbose_level(sys.stdout, self.verbose)
         results.append(grp)
 
         sys.stdout.write("\n")
+        if self.profiler:
+            self.report_profiles()
+        if self.trace:
+            self.trace.add_requests(self.server_stats.spans)
+            self.trace.write(self.trace_path)
+        if self.history_path:
+            self.update_history(results)
         return self.report(results, time.time() - start)
 
+    # Adds up the hottest functions across all the profiles taken in
+    # this run, and reports the top |self.profile_top|, both on stdout
+    # and in "summary.txt" in the profile directory.
+    def report_profiles(self):
+        totals = collections.defaultdict(int)
+        tests = collections.defaultdict(int)
+        read = 0
+        for path in self.profiles:
+            if not os.path.exists(path):
+                continue
+            try:
+                costs = self.profiler.hot_functions(path)
+            except (IOError, OSError, ValueError) as e:
+                sys.stdout.write(colorize("R", "WARNING") +
+                                 ": cannot read {}: {}\n".format(path, e))
+                continue
+            read += 1
+            for fn, cost in costs.items():
+                totals[fn] += cost
+                tests[fn] += 1
+
+        grand_total = sum(totals.values()) or 1
+        hottest = sorted(totals.items(), key=lambda item: -item[1])
+        lines = ["Hottest functions in {} {} profiles:"
+                 .format(read, self.profiler.name), "",
+                 "{:>16} {:>6} {:>5}  {}".format(self.profiler.unit, "%",
+                                                 "tests", "function")]
+        for fn, cost in hottest[:self.profile_top]:
+            lines.append("{:>16,} {:>6.2f} {:>5}  {}".format(
+                cost, cost * 100.0 / grand_total, tests[fn], fn))
+
+        with open(os.path.join(self.profile_dir, "summary.txt"), "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        sys.stdout.write("\n".join(lines) + "\n\n")
+
+    # The history file (--history) has one line per run, a JSON object
+    # giving the time taken by each test and each of its test points,
+    # in milliseconds.  Reports the test points that took at least
+    # HISTORY_SLOWER_RATIO times as long as in the previous run of the
+    # same test, and at least HISTORY_SLOWER_MS longer, then appends
+    # this run.
+    HISTORY_SLOWER_RATIO = 1.5
+    HISTORY_SLOWER_MS    = 50
+
+    def update_history(self, results):
+        previous = {}
+        if os.path.exists(self.history_path):
+            with open(self.history_path) as fp:
+                for line in fp:
+                    try:
+                        run = json.loads(line)
+                    except ValueError:
+                        continue
+                    previous.update(run.get("tests", {}))
+
+        tests = collections.OrderedDict()
+        for grp in results:
+            if grp.elapsed is None:
+                continue
+            tests[grp.name] = {
+                "elapsed": round(grp.elapsed * 1000, 1),
+                "points":  collections.OrderedDict(
+                    ("{} {}".format(point, desc), round(secs * 1000, 1))
+                    for point, desc, secs in grp.point_times),
+            }
+
+        slower = []
+        for name, test in tests.items():
+            before = previous.get(name, {}).get("points", {})
+            for point, ms in test["points"].items():
+                old = before.get(point)
+                if (old is not None and
+                        ms >= old * self.HISTORY_SLOWER_RATIO and
+                        ms - old >= self.HISTORY_SLOWER_MS):
+                    slower.append((ms - old, name, point, old, ms))
+        if slower:
+            sys.stdout.write(colorize("Y", "Slower than last time") + ":\n")
+            for _, name, point, old, ms in sorted(slower, reverse=True):
+                sys.stdout.write("  {}: {}  {:.0f} ms -> {:.0f} ms\n"
+                                 .format(name, point, old, ms))
+            sys.stdout.write("\n")
+
+        with open(self.history_path, "a") as fp:
+            fp.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                 "benchmark": self.benchmark,
+                                 "tests": tests}) + "\n")
+
     def report(self, results, elapsed):
         # There is always one test group, for the HTTP server errors.
         if len(results) == 1:
@@ -999,6 +3919,9 @@ class TestRunner(object):
                 grp.report(sys.stdout, False)
             for i, x in enumerate(grp.n): n[i] += x
 
+        if self.benchmark:
+            self.report_benchmarks(results)
+
         sys.stdout.write("{:6.3f}s elapsed\n".format(elapsed))
         for s in (T.PASS, T.FAIL, T.XPASS, T.XFAIL, T.ERROR, T.SKIP):
             if n[s]:
@@ -1009,6 +3932,671 @@ class TestRunner(object):
         else:
             return 1
 
+    def report_benchmarks(self, results):
+        measured = [grp for grp in results if grp.metrics]
+        # At verbosity 1 and up, the metrics have already been reported
+        # along with each group.
+        if self.verbose == 0:
+            for grp in measured:
+                sys.stdout.write(colorize("^", grp.name) + ":\n")
+                grp.report_metrics(sys.stdout)
+            if measured:
+                sys.stdout.write("\n")
+
+        if self.bench_output:
+            self.write_bench_output(measured)
+
+    def write_bench_output(self, groups):
+        with open(self.bench_output, "w") as fp:
+            json.dump(dict((grp.name, [{"name": name,
+                                        "value": value,
+                                        "unit": unit}
+                                       for name, value, unit
+                                       in grp.metrics])
+                           for grp in groups),
+                      fp, indent=2, sort_keys=True)
+            fp.write("\n")
+
+    # Load-test mode (--load): start the PhantomJS script
+    # |self.load_script|, which must run a webserver on the port given
+    # as its only argument, and drive it with a LoadGenerator at each
+    # combination of connection mode and concurrency, sampling its
+    # memory use throughout.  The results are reported like benchmark
+    # metrics, one group per combination, plus "load/rss" with the
+    # memory samples.
+    def run_load(self):
+        start = time.time()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        cmd = self.get_base_command(self.debugger)
+        cmd.extend([self.load_script, str(port)])
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        proc.stdin.close()
+
+        # The script's output is discarded (or, with -vvv, echoed), but
+        # it must be read, lest the script block writing it.
+        def drain():
+            for line in iter(proc.stdout.readline, ''):
+                if self.verbose >= 3:
+                    sys.stdout.write(colorize("b", "## load: " + line))
+        drainer = threading.Thread(target=drain)
+        drainer.daemon = True
+        drainer.start()
+
+        results = []
+        try:
+            if not self.wait_for_listener(proc, port):
+                return 1
+            with MemorySampler(proc.pid) as sampler:
+                steps = [(mode, concurrency) for mode in self.load_modes
+                         for concurrency in self.load_clients]
+                for mode, concurrency in steps:
+                    grp = self.run_load_step(proc, sampler, port,
+                                             mode, concurrency)
+                    # If the script has died, there is nothing left to
+                    # measure, in this mode or any other.
+                    dead = proc.poll() is not None
+                    if dead and not grp.n[T.ERROR]:
+                        grp.add_error([], "server exited with code {}"
+                                      .format(proc.returncode))
+                    grp.report(sys.stdout, False)
+                    results.append(grp)
+                    if dead:
+                        break
+
+            grp = TestGroup("load/rss")
+            grp.metrics.extend(("t+{:.3f}s".format(t), kb, "kB")
+                               for t, kb in sorted(sampler.samples))
+            if self.verbose and grp.metrics:
+                grp.report(sys.stdout, False)
+            results.append(grp)
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+
+        if self.bench_output:
+            self.write_bench_output([grp for grp in results if grp.metrics])
+        sys.stdout.write("{:6.3f}s elapsed\n".format(time.time() - start))
+        return 0 if all(grp.is_successful() for grp in results) else 1
+
+    # Pipe benchmark mode (--pipe): measure how fast data can be copied
+    # from system.stdin to system.stdout, using lib/fixtures/pipe-echo.js.
+    # Parameters come from --bench-param; see writing-tests.md.  Besides
+    # the throughput and latency, this checks for buffering problems:
+    # output held back until a buffer fills, and (on Linux, where the
+    # system calls can be counted) input read or output written in
+    # pieces much smaller than a buffer.
+    def run_pipe(self):
+        start = time.time()
+        self.pipe_script = os.path.join(self.base_path,
+                                        'lib/fixtures/pipe-echo.js')
+        param = self.bench_value
+        self.pipe_syscall_limit = param('PIPE_SYSCALLS_PER_LINE', 0.5)
+        size = param('PIPE_LINE_SIZE', 100)
+        results = [
+            self.run_pipe_lines("pipe/lines",
+                                param('PIPE_LINES', 100000), size, 0, None),
+            self.run_pipe_lines("pipe/paced",
+                                param('PIPE_PACED_LINES', 200), size,
+                                param('PIPE_PACED_RATE', 100.0),
+                                param('PIPE_LATENCY_LIMIT', 50.0)),
+            self.run_pipe_binary("pipe/binary",
+                                 param('PIPE_BYTES', 64 * 1024 * 1024),
+                                 param('PIPE_MIN_BLOCK', 4096)),
+        ]
+        for grp in results:
+            grp.report(sys.stdout, self.verbose >= 2)
+
+        if self.bench_output:
+            self.write_bench_output(results)
+        sys.stdout.write("{:6.3f}s elapsed\n".format(time.time() - start))
+        return 0 if all(grp.is_successful() for grp in results) else 1
+
+    def start_pipe(self, grp, mode):
+        cmd = self.get_base_command(self.debugger)
+        cmd.extend([self.pipe_script, mode])
+        run = PipeRun(cmd)
+        if not run.wait_ready():
+            run.finish()
+            grp.add_error(run.stderr, "pipe-echo.js did not start")
+            return None
+        return run
+
+    def check_pipe_exit(self, grp, run):
+        rc = run.finish()
+        if rc != 0:
+            grp.add_error(run.stderr,
+                          "pipe-echo.js exited with code {}".format(rc))
+
+    # Sends |count| lines of |size| bytes, each "SEQ TIMESTAMP PADDING",
+    # as fast as possible (|rate| 0) or |rate| lines per second, and
+    # measures how long each takes to come back.
+    def run_pipe_lines(self, name, count, size, rate, latency_limit):
+        grp = TestGroup(name)
+        run = self.start_pipe(grp, 'lines')
+        if run is None:
+            return grp
+
+        def line(seq):
+            head = '{} {:.6f} '.format(seq, time.time())
+            return head + 'x' * max(size - len(head) - 1, 0) + '\n'
+
+        def flood():
+            seq = 0
+            while seq < count:
+                batch = min(count - seq, max(1, 65536 // size))
+                yield ''.join(line(i) for i in xrange(seq, seq + batch))
+                seq += batch
+
+        def paced():
+            begin = time.time()
+            for seq in xrange(count):
+                delay = begin + seq / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                yield line(seq)
+
+        syscalls = process_syscalls(run.proc.pid)
+        begin = time.time()
+        run.feed(paced() if rate else flood())
+
+        latencies, received, reads, out_of_order = [], 0, 0, 0
+        data = run.buf
+        while True:
+            lines = data.split('\n')
+            now = time.time()
+            for text in lines[:-1]:
+                fields = text.split(' ', 2)
+                try:
+                    seq, sent = int(fields[0]), float(fields[1])
+                except (IndexError, ValueError):
+                    out_of_order += 1
+                    continue
+                if seq != received:
+                    out_of_order += 1
+                latencies.append((now - sent) * 1000)
+                received += 1
+            data = run.read()
+            if not data:
+                break
+            reads += 1
+            data = lines[-1] + data
+        elapsed = max(time.time() - begin, 1e-6)
+        # The process has not exited yet, so /proc is still there.
+        if syscalls is not None:
+            after = process_syscalls(run.proc.pid)
+            syscalls = (None if after is None else
+                        (after[0] - syscalls[0], after[1] - syscalls[1]))
+        self.check_pipe_exit(grp, run)
+
+        if received != count or out_of_order:
+            grp.add_fail(["sent {} lines, received {}, {} out of order"
+                          .format(count, received, out_of_order)],
+                         "lines echoed intact")
+        else:
+            grp.add_pass([], "lines echoed intact")
+
+        latencies.sort()
+        def pct(p):
+            return percentile(latencies, p)
+        grp.metrics.extend([
+            ("lines",            received, ""),
+            ("lines_per_sec",    received / elapsed, "lines/s"),
+            ("throughput",       received * size / elapsed / (1024*1024),
+                                 "MiB/s"),
+            ("latency.p50",      pct(50), "ms"),
+            ("latency.p90",      pct(90), "ms"),
+            ("latency.p99",      pct(99), "ms"),
+            ("stdout_reads",     reads, ""),
+        ])
+
+        if latency_limit is not None:
+            if pct(90) > latency_limit:
+                grp.add_fail(["90% of lines took up to {:.1f} ms to come"
+                              " back, at only {} lines/s; output appears"
+                              " to be held in a buffer".format(pct(90), rate)],
+                             "paced lines come back promptly")
+            else:
+                grp.add_pass([], "paced lines come back promptly")
+
+        if syscalls is not None and received and not rate:
+            per_read = syscalls[0] / float(received)
+            per_write = syscalls[1] / float(received)
+            grp.metrics.extend([
+                ("read_calls_per_line",  per_read, ""),
+                ("write_calls_per_line", per_write, ""),
+            ])
+            for what, per_line in (("stdin is read", per_read),
+                                   ("stdout is written", per_write)):
+                label = what + " in blocks"
+                if per_line > self.pipe_syscall_limit:
+                    grp.add_fail(["{} with {:.2f} system calls per line"
+                                  .format(what, per_line)], label)
+                else:
+                    grp.add_pass([], label)
+        return grp
+
+    # Sends |total| bytes of every byte value, and checks that they
+    # come back intact.
+    def run_pipe_binary(self, name, total, min_block):
+        grp = TestGroup(name)
+        run = self.start_pipe(grp, 'binary')
+        if run is None:
+            return grp
+
+        block = ''.join(chr(i) for i in xrange(256)) * 256
+        def chunks():
+            sent = 0
+            while sent < total:
+                chunk = block[:total - sent]
+                sent += len(chunk)
+                yield chunk
+        expected = hashlib.sha1()
+        for chunk in chunks():
+            expected.update(chunk)
+
+        syscalls = process_syscalls(run.proc.pid)
+        begin = time.time()
+        run.feed(chunks())
+        received, reads, digest = len(run.buf), 0, hashlib.sha1(run.buf)
+        while True:
+            data = run.read()
+            if not data:
+                break
+            reads += 1
+            received += len(data)
+            digest.update(data)
+        elapsed = max(time.time() - begin, 1e-6)
+        if syscalls is not None:
+            after = process_syscalls(run.proc.pid)
+            syscalls = (None if after is None else
+                        (after[0] - syscalls[0], after[1] - syscalls[1]))
+        self.check_pipe_exit(grp, run)
+
+        if received != total or digest.digest() != expected.digest():
+            grp.add_fail(["sent {} bytes, received {}{}".format(
+                total, received,
+                "" if received != total else ", but they differ")],
+                         "bytes echoed intact")
+        else:
+            grp.add_pass([], "bytes echoed intact")
+
+        grp.metrics.extend([
+            ("bytes",        received, "bytes"),
+            ("throughput",   received / elapsed / (1024*1024), "MiB/s"),
+            ("stdout_reads", reads, ""),
+        ])
+        if syscalls is not None and all(syscalls):
+            for what, metric, calls in (
+                    ("stdin is read", "bytes_per_read", syscalls[0]),
+                    ("stdout is written", "bytes_per_write", syscalls[1])):
+                per_call = total / float(calls)
+                grp.metrics.append((metric, per_call, "bytes"))
+                label = what + " in blocks"
+                if per_call < min_block:
+                    grp.add_fail(["{} {:.0f} bytes at a time"
+                                  .format(what, per_call)], label)
+                else:
+                    grp.add_pass([], label)
+        return grp
+
+    # Concurrency scaling mode (--scaling): run a fixed workload --
+    # lib/fixtures/render-job.js, loading and rendering one page from
+    # the test server -- in many separate PhantomJS processes, with 1,
+    # 2, 4, ... of them at a time, up to SCALING_FACTOR times the number
+    # of CPU cores, and report how the throughput, latency, memory, and
+    # CPU use change.  Parameters come from --bench-param; see
+    # writing-tests.md.
+    def run_scaling(self):
+        start = time.time()
+        cores = multiprocessing.cpu_count()
+        url = os.environ["TEST_HTTP_BASE"] + self.bench_value(
+            'SCALING_PAGE', 'gen/table?rows=1000&cols=10')
+        per_level = self.bench_value('SCALING_JOBS', 5)
+        min_jobs = self.bench_value('SCALING_MIN_JOBS', 20)
+        limit = max(1, int(self.bench_value('SCALING_FACTOR', 2.0) * cores))
+
+        levels = []
+        concurrency = 1
+        while concurrency < limit:
+            levels.append(concurrency)
+            concurrency *= 2
+        levels.append(limit)
+
+        script = os.path.join(self.base_path, 'lib/fixtures/render-job.js')
+        scratch = tempfile.mkdtemp(prefix='phantomjs-scaling-')
+        def command(job):
+            return (self.get_base_command(None) +
+                    [script, url, os.path.join(scratch,
+                                               'job-{}.png'.format(job))])
+
+        results = []
+        try:
+            for concurrency in levels:
+                jobs = max(min_jobs, per_level * concurrency)
+                pool = ProcessPool(command, jobs, concurrency).run()
+                grp = self.scaling_group(pool, concurrency, cores,
+                                         results[0] if results else None)
+                if self.verbose or not grp.is_successful():
+                    grp.report(sys.stdout, self.verbose >= 2)
+                results.append(grp)
+                for name in os.listdir(scratch):
+                    os.remove(os.path.join(scratch, name))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        self.report_scaling(results, cores)
+        if self.bench_output:
+            self.write_bench_output(results)
+        sys.stdout.write("{:6.3f}s elapsed\n".format(time.time() - start))
+        return 0 if all(grp.is_successful() for grp in results) else 1
+
+    def scaling_group(self, pool, concurrency, cores, baseline):
+        grp = TestGroup("scaling/{}".format(concurrency))
+        if pool.failures:
+            job, code, output = pool.failures[0]
+            grp.add_fail(["{} of {} jobs failed; job {} exited with"
+                          " code {}:".format(len(pool.failures), pool.jobs,
+                                             job, code)] +
+                         output.splitlines()[-10:],
+                         "all jobs succeed")
+        else:
+            grp.add_pass([], "all jobs succeed")
+
+        latencies = sorted(pool.latencies)
+        def pct(p):
+            return percentile(latencies, p) * 1000
+        rate = pool.jobs / max(pool.elapsed, 1e-6)
+        grp.metrics.extend([
+            ("jobs",            pool.jobs, ""),
+            ("jobs_per_sec",    rate, "jobs/s"),
+            ("latency.p50",     pct(50), "ms"),
+            ("latency.p99",     pct(99), "ms"),
+            ("cpu_utilization", pool.cpu / max(pool.elapsed, 1e-6)
+                                / cores * 100, "%"),
+            ("cpu_per_job",     pool.cpu / pool.jobs * 1000, "ms"),
+        ])
+        if pool.rss_samples:
+            grp.metrics.extend([
+                ("rss_total.mean", sum(pool.rss_samples)
+                                   / len(pool.rss_samples), "kB"),
+                ("rss_total.peak", max(pool.rss_samples), "kB"),
+            ])
+        if baseline is not None:
+            # Throughput relative to what |concurrency| independent
+            # copies of the single-process run would manage.
+            base_rate = dict((name, value)
+                             for name, value, _ in baseline.metrics)
+            grp.metrics.append(
+                ("efficiency",
+                 rate / (base_rate["jobs_per_sec"] * concurrency) * 100,
+                 "%"))
+        return grp
+
+    def report_scaling(self, results, cores):
+        sys.stdout.write("Concurrency scaling ({} CPU cores):\n\n"
+                         .format(cores))
+        columns = [("jobs_per_sec", "jobs/s", 1),
+                   ("efficiency", "effic. %", 1),
+                   ("latency.p50", "p50 ms", 1),
+                   ("latency.p99", "p99 ms", 1),
+                   ("rss_total.peak", "RSS MiB", 1.0/1024),
+                   ("cpu_utilization", "CPU %", 1)]
+        sys.stdout.write("{:>9}".format("processes") +
+                         "".join("{:>10}".format(heading)
+                                 for _, heading, _ in columns) + "\n")
+        best = None
+        for grp in results:
+            values = dict((name, value) for name, value, _ in grp.metrics)
+            concurrency = grp.name.partition("/")[2]
+            row = "{:>9}".format(concurrency)
+            for name, _, scale in columns:
+                if name in values:
+                    row += "{:>10.1f}".format(values[name] * scale)
+                else:
+                    row += "{:>10}".format("-")
+            if not grp.is_successful():
+                row += "  " + colorize("R", "FAIL")
+            sys.stdout.write(row + "\n")
+            if best is None or values["jobs_per_sec"] > best[1]:
+                best = (concurrency, values["jobs_per_sec"])
+        if best is not None:
+            sys.stdout.write("\nPeak throughput: {:.1f} jobs/s with {}"
+                             " processes\n\n".format(best[1], best[0]))
+
+    # Soak mode (--soak): run lib/fixtures/soak-loop.js, which opens,
+    # evaluates, renders, and closes a page over and over in one
+    # process, sampling its memory statistics at a fixed interval.  The
+    # growth of each statistic per iteration is estimated by a linear
+    # fit, ignoring the first SOAK_WARMUP iterations (caches filling
+    # up are not leaks), and the run fails if resident memory grows by
+    # more than SOAK_LIMIT kB per iteration.  Parameters come from
+    # --bench-param; see writing-tests.md.
+    def run_soak(self):
+        start = time.time()
+        param = self.bench_value
+        iterations = param('SOAK_ITERATIONS', 2000)
+        interval = param('SOAK_INTERVAL', 1.0)
+        warmup = param('SOAK_WARMUP', 100)
+        limit = param('SOAK_LIMIT', 1.0)
+        timeout = param('SOAK_TIMEOUT', 3600.0)
+        url = os.environ["TEST_HTTP_BASE"] + param('SOAK_PAGE',
+                                                   'render/index.html')
+
+        grp = TestGroup("soak")
+        scratch = tempfile.mkdtemp(prefix='phantomjs-soak-')
+        cmd = self.get_base_command(None)
+        cmd.extend([os.path.join(self.base_path, 'lib/fixtures/soak-loop.js'),
+                    url, str(iterations),
+                    os.path.join(scratch, 'render.png')])
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        proc.stdin.close()
+
+        # The script reports each iteration as it completes.
+        progress = { 'iteration': 0, 'done': False, 'other': [] }
+        def read_progress():
+            for line in iter(proc.stdout.readline, ''):
+                line = line.rstrip('\n')
+                if line.startswith('iteration '):
+                    progress['iteration'] = int(line.split()[1])
+                elif line == 'done':
+                    progress['done'] = True
+                else:
+                    progress['other'].append(line)
+        reader = threading.Thread(target=read_progress)
+        reader.daemon = True
+        reader.start()
+
+        samples = []
+        timed_out = False
+        try:
+            while proc.poll() is None:
+                now = time.time() - start
+                if now > timeout:
+                    timed_out = True
+                    break
+                # Until the first iteration is done, PhantomJS is still
+                # starting up.
+                fields = (progress['iteration'] and
+                          process_memory_fields(proc.pid))
+                if fields:
+                    samples.append((now, progress['iteration'], fields))
+                    if self.verbose >= 2:
+                        sys.stdout.write(colorize("b", "## soak: {} {}kB\n"
+                            .format(progress['iteration'],
+                                    fields.get('status.VmRSS', '?'))))
+                time.sleep(interval)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            reader.join(5)
+            shutil.rmtree(scratch, ignore_errors=True)
+        elapsed = time.time() - start
+
+        if timed_out:
+            problem = "timed out"
+        elif proc.returncode != 0:
+            problem = "exited with code {}".format(proc.returncode)
+        elif not progress['done']:
+            problem = "stopped"
+        else:
+            problem = None
+        if problem:
+            grp.add_error(progress['other'][-10:],
+                          "soak-loop.js {} after {} of {} iterations"
+                          .format(problem, progress['iteration'], iterations))
+
+        grp.metrics.extend([
+            ("iterations",     progress['iteration'], ""),
+            ("iterations_per_sec", progress['iteration'] / elapsed, "/s"),
+            ("samples",        len(samples), ""),
+        ])
+        self.fit_soak(grp, samples, warmup, limit)
+        grp.report(sys.stdout, self.verbose >= 2)
+
+        if self.soak_timeline:
+            self.write_soak_timeline(samples)
+        if self.bench_output:
+            self.write_bench_output([grp])
+        sys.stdout.write("{:6.3f}s elapsed\n".format(elapsed))
+        return 0 if grp.is_successful() else 1
+
+    def fit_soak(self, grp, samples, warmup, limit):
+        if not samples:
+            # Either PhantomJS never finished an iteration, or /proc
+            # is unavailable; either way, nothing was measured.
+            grp.add_error(["no memory samples (memory can only be sampled"
+                           " on Linux, once the first iteration is done)"],
+                          "resident memory stops growing")
+            return
+        names = samples[-1][2].keys()
+        fitted = [(it, fields) for _, it, fields in samples if it >= warmup]
+        for name in names:
+            values = [fields[name] for _, _, fields in samples
+                      if name in fields]
+            grp.metrics.append((name + ".start", values[0], "kB"))
+            grp.metrics.append((name + ".end", values[-1], "kB"))
+            points = [(it, fields[name]) for it, fields in fitted
+                      if name in fields]
+            slope = None
+            if len(points) >= 3:
+                slope = linear_slope([it for it, _ in points],
+                                     [value for _, value in points])
+            if slope is not None:
+                grp.metrics.append((name + ".per_iteration", slope, "kB"))
+
+            if name == 'status.VmRSS':
+                label = "resident memory stops growing"
+                if slope is None:
+                    grp.add_error(["only {} samples after the first {}"
+                                   " iterations; use a larger SOAK_ITERATIONS"
+                                   " or a smaller SOAK_INTERVAL"
+                                   .format(len(points), warmup)], label)
+                elif slope > limit:
+                    grp.add_fail(["resident memory grows by {:.2f} kB per"
+                                  " iteration (limit {} kB)"
+                                  .format(slope, limit)], label)
+                else:
+                    grp.add_pass([], label)
+
+    # Writes the memory samples to |self.soak_timeline| as CSV: one row
+    # per sample, with the elapsed time, the iteration count, and each
+    # statistic.
+    def write_soak_timeline(self, samples):
+        names = samples[-1][2].keys() if samples else []
+        with open(self.soak_timeline, "w") as fp:
+            fp.write(",".join(["time", "iteration"] + names) + "\n")
+            for t, it, fields in samples:
+                fp.write(",".join(["{:.3f}".format(t), str(it)] +
+                                  [str(fields.get(name, ""))
+                                   for name in names]) + "\n")
+
+    def wait_for_listener(self, proc, port, timeout=30):
+        deadline = time.time() + timeout
+        while True:
+            if proc.poll() is not None:
+                problem = "exited with code {}".format(proc.returncode)
+                break
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                return True
+            except socket.error:
+                pass
+            if time.time() > deadline:
+                problem = "did not listen within {}s".format(timeout)
+                break
+            time.sleep(0.1)
+        sys.stdout.write(colorize("R", "FATAL") + ": {} {} (port {})\n"
+                         .format(self.load_script, problem, port))
+        return False
+
+    def run_load_step(self, proc, sampler, port, mode, concurrency):
+        grp = TestGroup("load/{}/{}".format(mode, concurrency))
+        first = len(sampler.samples)
+        sampler.sample()
+        gen = LoadGenerator(port, self.load_path, mode == "keepalive",
+                            concurrency, self.load_duration).run()
+        sampler.sample()
+        rss = [kb for _, kb in sampler.samples[first:]]
+
+        requests = len(gen.latencies)
+        grp.metrics.extend([
+            ("requests",         requests, ""),
+            ("errors",           gen.errors, ""),
+            ("connections",      gen.connections, ""),
+            ("requests_per_sec", requests / gen.elapsed, "req/s"),
+            ("latency.p50",      gen.percentile(50), "ms"),
+            ("latency.p90",      gen.percentile(90), "ms"),
+            ("latency.p99",      gen.percentile(99), "ms"),
+            ("latency.max",      gen.percentile(100), "ms"),
+        ])
+        if rss:
+            grp.metrics.extend([
+                ("rss.start", rss[0], "kB"),
+                ("rss.end",   rss[-1], "kB"),
+                ("rss.peak",  max(rss), "kB"),
+            ])
+        if proc.poll() is not None:
+            grp.add_error([], "server exited with code {}"
+                          .format(proc.returncode))
+        elif requests == 0:
+            grp.add_error([], "no requests completed")
+        return grp
+
+def bench_param(arg):
+    name, sep, value = arg.partition("=")
+    if not sep or not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+        raise argparse.ArgumentTypeError(
+            "expected NAME=VALUE, not {!r}".format(arg))
+    return name, value
+
+def number_list(arg):
+    try:
+        values = [int(item) for item in arg.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected a comma-separated list of numbers, not {!r}"
+            .format(arg))
+    if any(value < 1 for value in values):
+        raise argparse.ArgumentTypeError("numbers must be at least 1")
+    return values
+
+def shaping_spec(arg):
+    try:
+        return parse_shaping(item.partition("=")[::2]
+                             for item in arg.split(","))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 def init():
     base_path = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
 
@@ -1027,13 +4615,131 @@ def init():
                         help='tests to run (default: all of them)')
     parser.add_argument('--debugger', default=None,
                         help="Run PhantomJS under DEBUGGER")
+    parser.add_argument('--profile', metavar="TOOL", default=None,
+                        choices=sorted(PROFILERS),
+                        help="profile each test with TOOL ('callgrind',"
+                        " 'massif', or 'perf'), writing the profiles to"
+                        " --profile-dir, and summarize the hottest"
+                        " functions across all of them")
+    parser.add_argument('--profile-dir', metavar="DIR", default="profiles",
+                        help="with --profile, where to write the profiles"
+                        " (default 'profiles')")
+    parser.add_argument('--profile-top', metavar="N", type=int, default=30,
+                        help="with --profile, how many functions to list"
+                        " in the summary (default 30)")
+    parser.add_argument('--trace', metavar="FILE", default=None,
+                        help="write a timeline of the run to FILE, in the"
+                        " Trace Event Format (for chrome://tracing or"
+                        " Perfetto)")
+    parser.add_argument('--history', metavar="FILE", default=None,
+                        help="append the time taken by each test and test"
+                        " point to FILE, and report those that have got"
+                        " slower since the last run recorded there")
+    parser.add_argument('--no-font-cache', dest='font_cache',
+                        action='store_false',
+                        help="don't give the tests a private, prewarmed"
+                        " fontconfig cache; use the user's own fontconfig"
+                        " configuration and caches")
     parser.add_argument('--color', metavar="WHEN", default='auto',
                         choices=['always', 'never', 'auto'],
                         help="colorize the output; can be 'always',"
                         " 'never', or 'auto' (the default)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="run benchmarks instead of tests")
+    parser.add_argument('--bench-param', metavar="NAME=VALUE",
+                        dest='bench_params', action='append', default=[],
+                        type=bench_param,
+                        help="set a parameter for the benchmarks"
+                        " (may be repeated)")
+    parser.add_argument('--bench-output', metavar="FILE", default=None,
+                        help="write all benchmark measurements to FILE,"
+                        " as JSON")
+    parser.add_argument('--server-processes', metavar="N", type=int,
+                        default=1,
+                        help="run the HTTP and HTTPS test servers in N"
+                        " processes, sharing the same ports (requires"
+                        " SO_REUSEPORT)")
+    parser.add_argument('--replay', metavar="ARCHIVE", default=None,
+                        help="serve the responses recorded in ARCHIVE"
+                        " (a HAR file, or see --pack-har) from a proxy"
+                        " server, for benchmarks/replay-pages.js")
+    parser.add_argument('--replay-timing', action='store_true',
+                        help="with --replay, reproduce the recorded"
+                        " latency and transfer time of each response")
+    parser.add_argument('--pack-har', metavar=("HAR", "ARCHIVE"), nargs=2,
+                        default=None,
+                        help="convert HAR to a packed archive, which loads"
+                        " much faster with --replay, and exit")
+    parser.add_argument('--shape', metavar="PARAM=VALUE,...", default=None,
+                        type=shaping_spec,
+                        help="shape the test server's traffic to imitate"
+                        " a slow network; parameters are rate, burst,"
+                        " latency, jitter, seed, and scope")
+    parser.add_argument('--load', metavar="SCRIPT", default=None,
+                        help="instead of running tests, start SCRIPT (a"
+                        " PhantomJS webserver script, given a port number"
+                        " as its argument) and measure its throughput,"
+                        " latency, and memory use under load")
+    parser.add_argument('--load-concurrency', metavar="N,...",
+                        type=number_list, default=[1, 4, 16],
+                        help="with --load, numbers of concurrent clients"
+                        " to try (default 1,4,16)")
+    parser.add_argument('--load-mode', action='append',
+                        choices=['keepalive', 'close'], default=None,
+                        help="with --load, use persistent connections"
+                        " ('keepalive') or a new connection for every"
+                        " request ('close'); may be repeated (default:"
+                        " both)")
+    parser.add_argument('--load-duration', metavar="SECONDS", type=float,
+                        default=10,
+                        help="with --load, how long to run each"
+                        " combination of mode and concurrency"
+                        " (default 10)")
+    parser.add_argument('--load-path', metavar="PATH", default='/',
+                        help="with --load, the path to request"
+                        " (default /)")
+    parser.add_argument('--scaling', action='store_true',
+                        help="instead of running tests, measure how the"
+                        " throughput of a page-loading workload scales"
+                        " with the number of PhantomJS processes run at"
+                        " once (parameters are set with --bench-param)")
+    parser.add_argument('--soak', action='store_true',
+                        help="instead of running tests, load and render a"
+                        " page thousands of times in one PhantomJS"
+                        " process, and fail if its memory keeps growing"
+                        " (parameters are set with --bench-param)")
+    parser.add_argument('--soak-timeline', metavar="FILE",
+                        help="with --soak, write the memory samples to"
+                        " FILE, as CSV")
+    parser.add_argument('--pipe', action='store_true',
+                        help="instead of running tests, measure how fast"
+                        " PhantomJS can copy data from system.stdin to"
+                        " system.stdout, and check for buffering problems"
+                        " (parameters are set with --bench-param)")
 
     options = parser.parse_args()
     activate_colorization(options)
+    if options.server_processes < 1:
+        parser.error("--server-processes must be at least 1")
+    if options.server_processes > 1 and not (hasattr(socket, 'SO_REUSEPORT')
+                                             and hasattr(os, 'fork')):
+        parser.error("--server-processes is not supported on this platform")
+    if options.load_mode is None:
+        options.load_mode = ['keepalive', 'close']
+    if options.load_duration <= 0:
+        parser.error("--load-duration must be positive")
+    if options.profile:
+        if options.debugger:
+            parser.error("--profile and --debugger cannot be used together")
+        if options.profile_top < 1:
+            parser.error("--profile-top must be at least 1")
+        if not os.path.isdir(options.profile_dir):
+            os.makedirs(options.profile_dir)
+    if options.pack_har:
+        n = ReplayArchive.pack(*options.pack_har)
+        sys.stdout.write("{}: {} index entries\n".format(
+            options.pack_har[1], n))
+        sys.exit(0)
     runner = TestRunner(base_path, phantomjs_exe, options)
     if options.verbose:
         rc, ver, err = runner.run_phantomjs('--version', silent=True)
@@ -1048,6 +4754,7 @@ def init():
 
         sys.stdout.write(colorize("b", "## Testing PhantomJS "+ver[0])+"\n")
 
+    runner.prewarm_font_cache()
     return runner
 
 def main():
@@ -1055,7 +4762,26 @@ def main():
     try:
         with HTTPTestServer(runner.base_path,
                             runner.signal_server_error,
-                            runner.verbose):
+                            runner.verbose,
+                            runner.shaping,
+                            runner.server_stats,
+                            runner.server_procs), \
+             ProxyServer(runner.base_path,
+                         runner.signal_server_error,
+                         runner.verbose), \
+             ReplayServer(runner.replay,
+                          runner.replay_timing,
+                          runner.base_path,
+                          runner.signal_server_error,
+                          runner.verbose):
+            if runner.load_script:
+                sys.exit(runner.run_load())
+            if runner.pipe:
+                sys.exit(runner.run_pipe())
+            if runner.scaling:
+                sys.exit(runner.run_scaling())
+            if runner.soak:
+                sys.exit(runner.run_soak())
             sys.exit(runner.run_tests())
 
     except Exception: